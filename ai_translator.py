@@ -10,20 +10,31 @@ import requests
 import hashlib
 import pathlib
 import base64
-import mimetypes
+import io
+import urllib.request
 import json
 import traceback
 import time
-from flask import Flask, request, jsonify, render_template_string, send_from_directory, Response, send_file
+import sqlite3
+import posixpath
+import tempfile
+import urllib.parse
+import socket
+import atexit
+import itertools
+import subprocess
+import difflib
+import multiprocessing
+import random
+import queue
+import email.utils
+import contextlib
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, FIRST_COMPLETED, wait as futures_wait
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Request, request, jsonify, render_template_string, Response, send_file
 from werkzeug.utils import secure_filename
 
-# Lazy import heavy dependencies
-try:
-    from pypdf import PdfReader
-except ImportError:
-    print("Warning: pypdf not found. Page counting will be disabled.")
-    PdfReader = None
-
 # ==============================================================================
 # AI Model & API Configuration
 # ==============================================================================
@@ -31,6 +42,45 @@ AI_API_URL = ""
 AI_API_KEY = ""
 AI_MODEL = ""
 
+# Large documents are split into Markdown-aware chunks and translated concurrently
+TRANSLATION_CHUNK_MAX_CHARS = 6000
+TRANSLATION_MAX_CONCURRENCY = 4
+# File names are translated in batched requests of up to this many names
+FILENAME_BATCH_SIZE = 100
+# A batched (JSON array) reply of the wrong shape is retried this many times, then the batch is split in halves;
+# only single items, and items the reply got wrong, are sent one per request
+SEGMENT_BATCH_RETRIES = 1
+
+# Progressive translated preview: while the translation streams in, the translated part is re-rendered at most
+# once per PREVIEW_REFRESH_SECONDS and pushed to the preview pane
+PREVIEW_REFRESH_SECONDS = 2
+
+# AI client: one pooled keep-alive session per process, client-side request/token budgets per minute (0 = unlimited),
+# and retries with exponential backoff on 429, 5xx and dropped connections (Retry-After is honoured)
+AI_MAX_CONNECTIONS = 16
+AI_REQUESTS_PER_MINUTE = 0
+AI_TOKENS_PER_MINUTE = 0
+AI_MAX_RETRIES = 4
+AI_RETRY_BASE_SECONDS = 1
+AI_RETRY_MAX_SECONDS = 60
+AI_REQUEST_TIMEOUT = 180
+# Several OpenAI-compatible backends can share the load: a list of dicts with 'url' and optionally 'key', 'model',
+# 'weight' (relative share of traffic), 'max_concurrency', 'requests_per_minute' and 'tokens_per_minute'. Missing
+# values fall back to the settings above, so an empty list means the single AI_API_URL endpoint.
+AI_BACKENDS = []
+# An endpoint failing AI_EJECT_AFTER_FAILURES times in a row is taken out of rotation for AI_EJECT_SECONDS (doubling
+# on each repeat, up to AI_EJECT_MAX_SECONDS). Requests unanswered after AI_HEDGE_AFTER_SECONDS are also sent to
+# another endpoint, first reply wins (0 disables hedging; streamed requests are never hedged).
+AI_EJECT_AFTER_FAILURES = 3
+AI_EJECT_SECONDS = 30
+AI_EJECT_MAX_SECONDS = 600
+AI_HEDGE_AFTER_SECONDS = 0
+
+# Batch pipeline: files translated concurrently per task (I/O-bound threads), then rendered
+# by a shared pool of WeasyPrint worker processes (CPU-bound). 0 render workers renders in-thread.
+TRANSLATION_WORKERS = 4
+RENDER_WORKERS = 2
+
 TRANSLATION_PROMPT = """
 You are a professional linguist and expert document translator. Your task is to translate the following Markdown text into {target_language}.
 
@@ -51,6 +101,19 @@ You are a professional linguist and expert document translator. Your task is to
 Translate the following Markdown content:
 """
 
+SEGMENT_TRANSLATION_PROMPT = """
+You are a professional linguist and expert document translator. You will receive a JSON array of Markdown segments (paragraphs, headings, list items, table rows) taken in order from one document. Translate every segment into {target_language}.
+
+**Critical Instructions:**
+1.  **Same Shape:** Output a JSON array of strings with exactly the same number of elements, in the same order. Element N must be the translation of input element N. Never merge, split, drop or reorder elements.
+2.  **Preserve Formatting:** Keep each segment's Markdown syntax exactly as in the source: heading markers, list markers and indentation, table pipes, emphasis, links and image links.
+3.  **Code:** DO NOT translate inline code (`...`). Leave the code as it is.
+4.  **Accuracy and Tone:** Translate with high accuracy, using the neighbouring segments as context. The translation should be natural-sounding in {target_language}.
+5.  **Output ONLY JSON:** Your output must ONLY be the JSON array. Do not wrap it in a code block or add any explanation.
+
+Translate the following JSON array:
+"""
+
 FILENAME_TRANSLATION_PROMPT = """
 You are an expert file name translator. Translate the following text to {target_language} to be used as a valid file name.
 **Critical Instructions:**
@@ -62,6 +125,18 @@ You are an expert file name translator. Translate the following text to {target_
 Translate the following text:
 """
 
+FILENAME_BATCH_TRANSLATION_PROMPT = """
+You are an expert file name translator. You will receive a JSON array of file names (without extensions). Translate each one to {target_language} to be used as a valid file name.
+**Critical Instructions:**
+1.  Output a JSON array of strings with exactly the same number of elements, in the same order. Element N must be the translation of input element N.
+2.  Provide concise and accurate translations.
+3.  Replace spaces with underscores (_).
+4.  Do not include any special characters that are invalid for file names (e.g., /\\:*?"<>|).
+5.  Output ONLY the JSON array. Do not wrap it in a code block or add any explanation.
+
+Translate the following JSON array:
+"""
+
 
 # ==============================================================================
 # Global Configuration and State Management
@@ -69,14 +144,103 @@ Translate the following text:
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
 os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-TASKS = {}
-TASKS_LOCK = threading.Lock()
-TRANSLATION_CACHE = {}
-TRANSLATION_CACHE_LOCK = threading.Lock()
+CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+
+# Persistent translation cache (SQLite), shared by all threads and worker processes
+TRANSLATION_CACHE_PATH = os.path.join(CACHE_DIR, 'translation_cache.sqlite3')
+TRANSLATION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Markdown -> HTML backend: 'pandoc' (one subprocess per conversion), 'pandoc-server' (a pool of
+# long-lived `pandoc server` processes per worker) or 'python-markdown' (in-process, pip install markdown).
+# 'pandoc-server' needs pandoc >= 2.18; with an older pandoc it falls back to 'pandoc' (logged once).
+MARKDOWN_BACKEND = 'pandoc'
+PANDOC_SERVER_POOL_SIZE = 2
+PANDOC_SERVER_MIN_VERSION = (2, 18)
+
+# Images are stored once by content hash under ASSET_DIR and referenced as file:// URLs. Raster images wider
+# than the text column at ASSET_TARGET_DPI are downscaled (0 disables); unused files are pruned after a while.
+ASSET_DIR = os.path.join(CACHE_DIR, 'assets')
+ASSET_TARGET_DPI = 200
+ASSET_JPEG_QUALITY = 85
+ASSET_STORE_MAX_AGE_DAYS = 30
+
+# Render cache: in-memory limits per process (each level), plus a shared on-disk PDF store (0 disables it)
+RENDER_CACHE_MAX_ENTRIES = 256
+RENDER_CACHE_MAX_BYTES = 128 * 1024 * 1024
+RENDER_CACHE_PATH = os.path.join(CACHE_DIR, 'render_cache.sqlite3')
+RENDER_CACHE_DISK_MAX_BYTES = 1024 * 1024 * 1024
+# WeasyPrint render contexts: each render worker process and preview thread keeps one font configuration and the
+# parsed stylesheets of its last RENDER_CONTEXT_MAX_STYLES styles, instead of rebuilding them for every PDF
+RENDER_CONTEXT_MAX_STYLES = 8
+# Image and overflow counts read WeasyPrint's internal box tree (no public API exposes it), so they are only taken on
+# these major versions (the Docker image pins one of them); other versions report page counts only
+WEASYPRINT_BOX_TREE_VERSIONS = ('70',)
+
+# Results are packaged on the fly by /download, straight from the task's result folder, so no second copy is kept on disk.
+# Files with these extensions are already compressed and are stored as they are; the rest are deflated. While the task
+# is running, the folder is rescanned every RESULT_STREAM_SCAN_SECONDS for newly finished files; the archive ends once
+# the task stops producing files (finished, queued, paused or stopping), so a download never waits on a parked task.
+RESULT_STORED_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.zip')
+RESULT_STREAM_CHUNK_BYTES = 1024 * 1024
+RESULT_STREAM_SCAN_SECONDS = 2
+
+# Pre-flight estimates (/estimate): AI and render speed are learned from past runs (recent runs count most), with
+# these defaults until there is history. Prices per 1000 tokens turn token counts into a cost (0 = no cost shown).
+THROUGHPUT_HISTORY_PATH = os.path.join(CACHE_DIR, 'throughput.sqlite3')
+ESTIMATE_DEFAULT_AI_SECONDS_PER_1K_TOKENS = 20
+ESTIMATE_DEFAULT_RENDER_SECONDS_PER_1K_CHARS = 0.5
+AI_PRICE_PER_1K_INPUT_TOKENS = 0
+AI_PRICE_PER_1K_OUTPUT_TOKENS = 0
+
+# Job scheduler: worker slots shared by batch tasks and previews; batch tasks may use at most MAX_CONCURRENT_TASKS of
+# them so previews always have room. Beyond MAX_QUEUED_JOBS waiting jobs, new work is rejected with 503.
+SCHEDULER_WORKERS = 4
+MAX_CONCURRENT_TASKS = 2
+MAX_QUEUED_JOBS = 100
+# Admission control: queued batch tasks don't start while memory use or the load average per CPU is above these,
+# and nothing new is accepted above ADMISSION_REJECT_MEMORY_PERCENT
+ADMISSION_MAX_MEMORY_PERCENT = 85
+ADMISSION_MAX_LOAD_PER_CPU = 1.5
+ADMISSION_REJECT_MEMORY_PERCENT = 95
+
+# What happens when a file still fails after FILE_MAX_RETRIES extra attempts: 'skip' records it and carries on with
+# the rest (the task can be resumed later to retry it), 'fail' stops the task. Finished files are checkpointed either way.
+FILE_ERROR_POLICY = 'skip'
+FILE_MAX_RETRIES = 2
+
+# Task state store shared by all workers: SQLite file by default, or a redis:// URL for a Redis-compatible server.
+# Every process writes a heartbeat to the store every TASK_HEARTBEAT_SECONDS; tasks whose owner has missed its
+# heartbeat for TASK_STALE_SECONDS (or whose owner is known to have exited) are taken over and resumed.
+TASK_STORE_URL = ""
+TASK_STORE_PATH = os.path.join(OUTPUT_DIR, 'tasks.sqlite3')
+TASK_HEARTBEAT_SECONDS = 15
+TASK_STALE_SECONDS = 60
+# Finished tasks (SUCCESS, PARTIAL, FAILURE, STOPPED) are deleted, with their upload and results, this long after
+# their last update (0 keeps them forever); checked every TASK_PRUNE_INTERVAL_SECONDS
+TASK_RETENTION_DAYS = 7
+TASK_PRUNE_INTERVAL_SECONDS = 3600
+
+# Per-task event log (/events SSE stream): events kept per task, the keep-alive interval for idle streams, and how
+# often a stream re-checks the store for events written by other workers
+TASK_EVENT_LOG_MAX_EVENTS = 5000
+TASK_EVENT_KEEPALIVE_SECONDS = 15
+TASK_EVENT_POLL_SECONDS = 1
+
+# When set, /admin/* endpoints require a matching X-Admin-Token header
+ADMIN_TOKEN = ""
+
+RENDER_POOL = None
+RENDER_POOL_LOCK = threading.Lock()
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
+UPLOAD_TMP_DIR = os.path.join(OUTPUT_DIR, '.uploads')
+
+# Limits applied when reading members of uploaded ZIPs (guards against zip bombs)
+ZIP_MAX_MEMBERS = 20000
+ZIP_MAX_MEMBER_BYTES = 256 * 1024 * 1024
+ZIP_MAX_UNCOMPRESSED_BYTES = 1024 * 1024 * 1024
+ZIP_MAX_COMPRESSION_RATIO = 200
 
 # ==============================================================================
 # Frontend HTML Template
@@ -212,6 +376,7 @@ HTML_TEMPLATE = """
                              <button type="button" id="convertBtn" class="btn btn-action fw-bold"><i class="bi bi-lightning-charge-fill me-2"></i>开始批量处理</button>
                         </div>
                     </div>
+                    <div id="batch-estimate" class="text-center text-muted mt-3"></div>
                 </div>
 
                 <div id="progress-area" class="mt-4" style="display: none;">
@@ -251,6 +416,7 @@ HTML_TEMPLATE = """
             conversionStarter: document.getElementById('conversion-starter'),
             exportMode: document.getElementById('export_mode'),
             convertBtn: document.getElementById('convertBtn'),
+            batchEstimate: document.getElementById('batch-estimate'),
             progressArea: document.getElementById('progress-area'),
             progressBar: document.getElementById('progress-bar'),
             taskControls: document.getElementById('task-controls'),
@@ -273,6 +439,7 @@ HTML_TEMPLATE = """
         }
 
         const debouncedPreview = debounce(generateSideBySidePreview, 500);
+        const debouncedEstimate = debounce(updateBatchEstimate, 500);
 
         const eventListeners = [
             [ui.zipRadio, 'change', toggleUploadMode],
@@ -284,7 +451,9 @@ HTML_TEMPLATE = """
             [ui.resumeBtn, 'click', () => controlTask('resume')],
             [ui.stopBtn, 'click', () => controlTask('stop')],
             [ui.previewFileSelect, 'change', debouncedPreview],
-            [ui.targetLanguage, 'change', debouncedPreview]
+            [ui.targetLanguage, 'change', debouncedPreview],
+            [ui.targetLanguage, 'change', debouncedEstimate],
+            [ui.exportMode, 'change', debouncedEstimate]
         ];
         eventListeners.forEach(([el, evt, handler]) => el.addEventListener(evt, handler));
         ui.styleOptions.querySelectorAll('select, input').forEach(el => el.addEventListener('change', debouncedPreview));
@@ -334,8 +503,12 @@ HTML_TEMPLATE = """
             const files = ui.fileInput.files;
             if (!files || files.length === 0) return;
 
+            // ZIPs are sent as the raw request body so the server can stream them straight to disk
+            let uploadBody = formData, uploadUrl = '/prepare_upload', uploadHeaders = {};
             if (ui.zipRadio.checked) {
-                formData.append('zipfile', files[0]);
+                uploadBody = files[0];
+                uploadUrl = '/prepare_upload?upload_type=zip';
+                uploadHeaders = { 'Content-Type': 'application/zip' };
             } else if (ui.folderRadio.checked) {
                 for (const file of files) { formData.append('files[]', file, file.webkitRelativePath); }
             } else { // Single file
@@ -347,7 +520,7 @@ HTML_TEMPLATE = """
             ui.conversionStarter.style.display = 'none';
 
             try {
-                const response = await fetch('/prepare_upload', { method: 'POST', body: formData });
+                const response = await fetch(uploadUrl, { method: 'POST', headers: uploadHeaders, body: uploadBody });
                 const data = await response.json();
                 if (!response.ok) throw new Error(data.error || '服务器准备文件失败');
 
@@ -369,6 +542,7 @@ HTML_TEMPLATE = """
                     ui.mainControls.style.display = 'block';
                     ui.conversionStarter.style.display = 'block';
                     generateSideBySidePreview();
+                    updateBatchEstimate();
                 } else {
                     ui.statusMessage.textContent = `⚠️ 上传成功，但未找到可预览的.md文件。`;
                     ui.statusMessage.className = 'alert alert-warning';
@@ -380,6 +554,7 @@ HTML_TEMPLATE = """
             }
         }
 
+        let previewGeneration = 0, previewAbort = null;
         async function generateSideBySidePreview() {
             if (!currentTaskId || !ui.previewFileSelect.value) return;
 
@@ -412,22 +587,72 @@ HTML_TEMPLATE = """
                 ui.previewOriginal.src = 'data:text/html;charset=utf-8,' + encodeURIComponent(errorHtml(err.message));
             });
 
-            // Generate Translated Preview
+            // Generate Translated Preview: the server streams a PDF of the part translated so far, then the full one
+            const generation = ++previewGeneration;
+            // Closing the superseded stream lets the server cancel its translation
+            if (previewAbort) previewAbort.abort();
+            previewAbort = new AbortController();
             fetch('/preview/translated', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload)
+                body: JSON.stringify({ ...payload, progressive: true }),
+                signal: previewAbort.signal
             }).then(async res => {
                 if (!res.ok) throw new Error('译文预览生成失败');
-                return res.blob();
-            }).then(blob => {
-                ui.previewTranslated.src = URL.createObjectURL(blob);
+                const reader = res.body.getReader();
+                let buffer = new Uint8Array(0);
+                while (generation === previewGeneration) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    const joined = new Uint8Array(buffer.length + value.length);
+                    joined.set(buffer); joined.set(value, buffer.length);
+                    buffer = joined;
+                    // Frames: kind byte ('P' = PDF, 'E' = error), 4-byte big-endian length, payload
+                    while (buffer.length >= 5) {
+                        const length = new DataView(buffer.buffer, buffer.byteOffset + 1, 4).getUint32(0);
+                        if (buffer.length < 5 + length) break;
+                        const kind = String.fromCharCode(buffer[0]), frame = buffer.slice(5, 5 + length);
+                        buffer = buffer.slice(5 + length);
+                        if (kind === 'E') throw new Error(new TextDecoder().decode(frame));
+                        const previousUrl = ui.previewTranslated.src;
+                        ui.previewTranslated.src = URL.createObjectURL(new Blob([frame], { type: 'application/pdf' }));
+                        if (previousUrl.startsWith('blob:')) URL.revokeObjectURL(previousUrl);
+                    }
+                }
+                if (generation !== previewGeneration) reader.cancel();
             }).catch(err => {
+                if (generation !== previewGeneration) return;
                 console.error("Translated preview error:", err);
                 ui.previewTranslated.src = 'data:text/html;charset=utf-8,' + encodeURIComponent(errorHtml(err.message));
             });
         }
         
+        async function updateBatchEstimate() {
+            if (!currentTaskId) return;
+            try {
+                const response = await fetch('/estimate', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        task_id: currentTaskId,
+                        style_options: getStyleOptions(),
+                        target_language: ui.targetLanguage.value,
+                        export_mode: ui.exportMode.value
+                    })
+                });
+                const data = await response.json();
+                if (!response.ok) throw new Error(data.error || '预估失败');
+                const minutes = Math.max(1, Math.round(data.estimated_seconds.total / 60));
+                const tokens = data.input_tokens + data.output_tokens;
+                let text = `预计处理 ${data.files_to_process} 个文件：约 ${data.api_calls} 次 AI 调用、${tokens.toLocaleString()} 个令牌`;
+                if (data.segments) text += `（${data.cached_segments}/${data.segments} 段已在翻译缓存中）`;
+                if (data.estimated_cost !== null) text += `，费用约 ${data.estimated_cost}`;
+                ui.batchEstimate.textContent = text + `，耗时约 ${minutes} 分钟。`;
+            } catch (error) {
+                ui.batchEstimate.textContent = '';
+            }
+        }
+
         function startConversion() {
             if (!currentTaskId) return;
             ui.convertBtn.disabled = true;
@@ -438,7 +663,7 @@ HTML_TEMPLATE = """
             ui.downloadArea.style.display = 'none';
             ui.progressBar.style.width = '0%';
             ui.progressBar.textContent = '0%';
-            ui.progressBar.classList.remove('bg-danger', 'bg-success');
+            ui.progressBar.classList.remove('bg-danger', 'bg-success', 'bg-warning');
             
             fetch('/start_conversion', {
                 method: 'POST',
@@ -453,7 +678,8 @@ HTML_TEMPLATE = """
             .then(res => res.json())
             .then(data => {
                 if (data.error) throw new Error(data.error);
-                pollStatus(data.task_id);
+                lastEventId = 0;
+                followTaskEvents(data.task_id);
             })
             .catch(error => {
                 alert(`开始任务失败: ${error.message}`);
@@ -469,47 +695,70 @@ HTML_TEMPLATE = """
                 .then(res => {
                     if (!res.ok) {
                         console.error(`Failed to ${action} task`);
+                    } else if (action === 'resume' && !taskEvents) {
+                        // A finished task restarted from its checkpoint: follow it again from the last event seen
+                        ui.convertBtn.disabled = true;
+                        ui.progressBar.classList.remove('bg-danger', 'bg-success', 'bg-warning');
+                        ui.downloadArea.style.display = 'none';
+                        followTaskEvents(currentTaskId);
                     }
                 });
         }
 
-        function pollStatus(taskId) {
-            const interval = setInterval(() => {
-                fetch(`/status/${taskId}`)
-                .then(res => res.json())
-                .then(statusData => {
-                    ui.progressBar.style.width = statusData.progress + '%';
-                    ui.progressBar.textContent = statusData.progress + '%';
-                    if (statusData.logs && statusData.logs.length > 0) {
-                         statusData.logs.forEach(logEntry => appendLog(logEntry));
-                    }
+        let taskEvents = null, lastEventId = 0;
+        function followTaskEvents(taskId) {
+            // EventSource reconnects on its own and resends Last-Event-ID, so no log line is lost or repeated
+            const source = taskEvents = new EventSource(`/events/${taskId}?cursor=${lastEventId}`);
+            source.addEventListener('log', e => { lastEventId = e.lastEventId; appendLog(JSON.parse(e.data)); });
+            source.addEventListener('status', e => {
+                lastEventId = e.lastEventId;
+                const statusData = JSON.parse(e.data);
+                ui.progressBar.style.width = statusData.progress + '%';
+                ui.progressBar.textContent = statusData.state === 'QUEUED' ? `排队中 (#${statusData.queue_position})` : statusData.progress + '%';
+
+                // Update task control buttons based on state
+                if (statusData.state === 'QUEUED') {
+                    ui.pauseBtn.style.display = 'none';
+                    ui.resumeBtn.style.display = 'none';
+                    ui.stopBtn.disabled = false;
+                } else if (statusData.state === 'RUNNING') {
+                    ui.pauseBtn.style.display = 'inline-block';
+                    ui.resumeBtn.style.display = 'none';
+                    ui.stopBtn.disabled = false;
+                } else if (statusData.state === 'PAUSED') {
+                    ui.pauseBtn.style.display = 'none';
+                    ui.resumeBtn.style.display = 'inline-block';
+                    ui.stopBtn.disabled = false;
+                }
 
-                    // Update task control buttons based on state
-                    if (statusData.state === 'RUNNING') {
-                        ui.pauseBtn.style.display = 'inline-block';
-                        ui.resumeBtn.style.display = 'none';
-                        ui.stopBtn.disabled = false;
-                    } else if (statusData.state === 'PAUSED') {
-                        ui.pauseBtn.style.display = 'none';
-                        ui.resumeBtn.style.display = 'inline-block';
-                        ui.stopBtn.disabled = false;
-                    }
+                // Files finished so far can be downloaded already; the download then keeps going until the task ends
+                if (['RUNNING', 'PROGRESS', 'PAUSED'].includes(statusData.state)) {
+                    ui.downloadLink.href = `/download/${taskId}`;
+                    ui.downloadLink.innerHTML = '<i class="bi bi-cloud-download me-2"></i>边处理边下载';
+                    ui.downloadArea.style.display = 'block';
+                }
 
-                    if (statusData.state === 'SUCCESS' || statusData.state === 'FAILURE' || statusData.state === 'STOPPED') {
-                        clearInterval(interval);
-                        ui.convertBtn.disabled = false;
-                        ui.convertBtn.innerHTML = '<i class="bi bi-lightning-charge-fill me-2"></i>开始批量处理';
-                        ui.taskControls.style.display = 'none';
-                        if (statusData.state === 'SUCCESS') {
-                            ui.progressBar.classList.add('bg-success');
-                            ui.downloadLink.href = statusData.result_url;
-                            ui.downloadArea.style.display = 'block';
-                        } else {
-                            ui.progressBar.classList.add('bg-danger');
-                        }
+                if (['SUCCESS', 'PARTIAL', 'FAILURE', 'STOPPED'].includes(statusData.state)) {
+                    ui.convertBtn.disabled = false;
+                    ui.convertBtn.innerHTML = '<i class="bi bi-lightning-charge-fill me-2"></i>开始批量处理';
+                    // Failed or stopped runs (and runs that skipped files) can be resumed from their checkpoint
+                    const resumable = statusData.state !== 'SUCCESS' || statusData.failed_files > 0;
+                    ui.taskControls.style.display = resumable ? 'block' : 'none';
+                    ui.pauseBtn.style.display = 'none';
+                    ui.resumeBtn.style.display = 'inline-block';
+                    ui.stopBtn.disabled = true;
+                    if (statusData.state === 'SUCCESS' || statusData.state === 'PARTIAL') {
+                        ui.progressBar.classList.add(statusData.state === 'SUCCESS' ? 'bg-success' : 'bg-warning');
+                        ui.downloadLink.href = statusData.result_url;
+                        ui.downloadLink.innerHTML = '<i class="bi bi-cloud-download me-2"></i>下载结果';
+                        ui.downloadArea.style.display = 'block';
+                    } else {
+                        ui.progressBar.classList.add('bg-danger');
+                        ui.downloadArea.style.display = 'none';
                     }
-                });
-            }, 1500);
+                }
+            });
+            source.addEventListener('end', () => { source.close(); taskEvents = null; });
         }
 
         function appendLog(logEntry) {
@@ -542,22 +791,264 @@ def favicon():
     # This prevents the 404 error for the icon in the browser tab.
     return send_file(os.path.join(BASE_DIR, 'static', 'favicon.ico'), mimetype='image/vnd.microsoft.icon')
 
-def update_task_status(task_id, state=None, progress=None, log=None, error=None, result_url=None, preview_files=None):
-    with TASKS_LOCK:
-        if task_id not in TASKS: TASKS[task_id] = {}
-        task = TASKS[task_id]
-        if state: task['state'] = state
-        if progress is not None: task['progress'] = progress
-        if log: task.setdefault('logs', []).append({'log': log})
-        if error: task.setdefault('logs', []).append({'log': f"❌ 任务失败: {error}"}); task['error'] = error
-        if result_url: task['result_url'] = result_url
-        if preview_files is not None: task['preview_files'] = preview_files
-
-def get_and_clear_logs(task_id):
-    with TASKS_LOCK:
-        logs = TASKS.get(task_id, {}).get('logs', [])
-        if logs: TASKS[task_id]['logs'] = []
-        return logs
+def update_task_status(task_id, state=None, progress=None, log=None, error=None, result_url=None, preview_files=None, **fields):
+    if state: fields['state'] = state
+    if progress is not None: fields['progress'] = progress
+    if error: fields['error'] = error
+    if result_url: fields['result_url'] = result_url
+    if preview_files is not None: fields['preview_files'] = preview_files
+    events = ([('log', {'log': log})] if log else []) + ([('log', {'log': f"❌ 任务失败: {error}"})] if error else [])
+    seq = TASK_STORE.update(task_id, fields, events, publish_status=bool(state or progress is not None or error or result_url or 'queue_position' in fields))
+    notify_task_changed(task_id, seq)
+    control_changed = TASK_CONTROL_EVENTS.get(task_id)
+    if state and control_changed: control_changed.set()
+
+# ==============================================================================
+# Task Store
+# ==============================================================================
+# Task state and each task's append-only event log live in a shared store (SQLite by default, or any Redis-compatible
+# server via TASK_STORE_URL), so every gunicorn worker sees the same tasks and they survive restarts. Readers of the
+# event log hold a cursor (the last event id they saw), so any number of tabs can follow the same task.
+# PARTIAL: the run finished but some files failed (skipped under FILE_ERROR_POLICY = 'skip'); Resume retries them
+TERMINAL_STATES = ('SUCCESS', 'PARTIAL', 'FAILURE', 'STOPPED')
+ACTIVE_STATES = ('QUEUED', 'RUNNING', 'PROGRESS', 'PAUSED', 'STOPPING')
+
+def task_snapshot(task):
+    return {'state': task.get('state', 'UNKNOWN'), 'progress': task.get('progress', 0), 'error': task.get('error'), 'result_url': task.get('result_url'),
+            'failed_files': len(task.get('failed_files') or ()), 'queue_position': task.get('queue_position') or 0}
+
+RUNNER_NONCES = {}
+
+def runner_id():
+    """host:pid:nonce of this process. The nonce, new for every process (forks included), tells a restarted service
+    apart from its predecessor when both get the same pid, as PID 1 does in a restarted container."""
+    pid = os.getpid()
+    if pid not in RUNNER_NONCES: RUNNER_NONCES[pid] = uuid.uuid4().hex[:12]
+    return f"{socket.gethostname()}:{pid}:{RUNNER_NONCES[pid]}"
+
+def runner_alive(runner, heartbeats):
+    """Whether the process that owns a task is still around, judged by its heartbeat in the task store.
+
+    A runner on this host is known to be gone without waiting for its heartbeat to go stale if its pid has exited,
+    or if its pid is ours under another nonce (a previous run of this service).
+    """
+    if runner == runner_id(): return True
+    host, pid, _ = ((runner or '').split(':') + ['', ''])[:3]
+    if host == socket.gethostname():
+        if pid == str(os.getpid()): return False
+        try: os.kill(int(pid), 0)
+        except (ValueError, ProcessLookupError): return False
+        except PermissionError: pass
+    return time.time() - heartbeats.get(runner, 0) < TASK_STALE_SECONDS
+
+class SQLiteTaskStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, event_seq INTEGER NOT NULL DEFAULT 0, runner TEXT, updated REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state)')
+            conn.execute('CREATE TABLE IF NOT EXISTS task_events (task_id TEXT NOT NULL, seq INTEGER NOT NULL, kind TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (task_id, seq))')
+            conn.execute('CREATE TABLE IF NOT EXISTS runners (runner TEXT PRIMARY KEY, heartbeat REAL NOT NULL)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def _row_to_task(self, row):
+        return {**json.loads(row[0]), 'event_seq': row[1], 'runner': row[2], 'updated': row[3]}
+
+    def create(self, task_id, **fields):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO tasks (task_id, state, data, runner, updated) VALUES (?, ?, ?, ?, ?)',
+                         (task_id, fields.get('state'), json.dumps(fields, ensure_ascii=False), runner_id(), time.time()))
+
+    def get(self, task_id):
+        row = self._connect().execute('SELECT data, event_seq, runner, updated FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return self._row_to_task(row) if row else None
+
+    def event_seq(self, task_id):
+        row = self._connect().execute('SELECT event_seq FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, task_id, fields, events=(), publish_status=False):
+        """Merges fields into the task and appends events (plus a status snapshot if asked); returns the last event id."""
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data, event_seq FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            task, seq = ({**json.loads(row[0]), **fields}, row[1]) if row else (dict(fields), 0)
+            events = list(events) + ([('status', task_snapshot(task))] if publish_status else [])
+            conn.executemany('INSERT INTO task_events (task_id, seq, kind, data) VALUES (?, ?, ?, ?)',
+                             [(task_id, seq + i, kind, json.dumps(data, ensure_ascii=False)) for i, (kind, data) in enumerate(events, 1)])
+            seq += len(events)
+            if events: conn.execute('DELETE FROM task_events WHERE task_id = ? AND seq <= ?', (task_id, seq - TASK_EVENT_LOG_MAX_EVENTS))
+            conn.execute('INSERT INTO tasks (task_id, state, data, event_seq, runner, updated) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (task_id) DO UPDATE SET '
+                         'state = excluded.state, data = excluded.data, event_seq = excluded.event_seq, updated = excluded.updated',
+                         (task_id, task.get('state'), json.dumps(task, ensure_ascii=False), seq, runner_id(), time.time()))
+        return seq
+
+    def events_since(self, task_id, cursor):
+        return [(seq, kind, json.loads(data)) for seq, kind, data in
+                self._connect().execute('SELECT seq, kind, data FROM task_events WHERE task_id = ? AND seq > ? ORDER BY seq', (task_id, cursor))]
+
+    def delete(self, task_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+            conn.execute('DELETE FROM task_events WHERE task_id = ?', (task_id,))
+
+    def find(self, states, updated_before=None):
+        """Tasks in any of states (last updated before updated_before, if given), looked up through the state index."""
+        rows = self._connect().execute(f'SELECT task_id, data, event_seq, runner, updated FROM tasks WHERE state IN ({",".join("?" * len(states))}) AND updated < ?',
+                                       (*states, updated_before if updated_before is not None else float('inf')))
+        return {row[0]: self._row_to_task(row[1:]) for row in rows}
+
+    def claim(self, task_id, expected_runner, expected_updated=None):
+        """Atomically takes ownership of a task from expected_runner (and, given expected_updated, only if the task is
+        unchanged since it was read); False if another process or request got there first."""
+        with self._connect() as conn:
+            return conn.execute('UPDATE tasks SET runner = ?, updated = ? WHERE task_id = ? AND runner IS ? AND (? IS NULL OR updated = ?)',
+                                (runner_id(), time.time(), task_id, expected_runner, expected_updated, expected_updated)).rowcount == 1
+
+    def heartbeat(self):
+        """Records that this process is alive, and forgets runners that have been silent for a day."""
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO runners (runner, heartbeat) VALUES (?, ?)', (runner_id(), time.time()))
+            conn.execute('DELETE FROM runners WHERE heartbeat < ?', (time.time() - 86400,))
+
+    def heartbeats(self):
+        return dict(self._connect().execute('SELECT runner, heartbeat FROM runners').fetchall())
+
+class RedisTaskStore:
+    """Same interface as SQLiteTaskStore on top of a Redis-compatible server (needs the `redis` package).
+
+    Each task is a hash plus an event list; a sorted set per state (scored by last update) indexes the tasks, so
+    find() only reads the tasks in the states it asks for.
+    """
+    def __init__(self, url, prefix='ai_translator:'):
+        import redis
+        self.client, self.prefix, self.watch_error = redis.Redis.from_url(url), prefix, redis.WatchError
+        self._index_legacy_tasks()
+
+    def _key(self, task_id, suffix=''): return f"{self.prefix}task:{task_id}{suffix}"
+    def _state_key(self, state): return f"{self.prefix}state:{state}"
+
+    def _index_legacy_tasks(self):
+        # Stores written before the state index kept one set of all task ids; index those tasks once, then drop it
+        legacy = f"{self.prefix}tasks"
+        for task_id in self.client.smembers(legacy):
+            task = self.get(task_id.decode())
+            if task and task.get('state'): self.client.zadd(self._state_key(task['state']), {task_id.decode(): task['updated']})
+            self.client.srem(legacy, task_id)
+
+    def create(self, task_id, **fields):
+        now = time.time()
+        with self.client.pipeline() as pipe:
+            pipe.delete(self._key(task_id, ':events'))
+            pipe.hset(self._key(task_id), mapping={'data': json.dumps(fields, ensure_ascii=False), 'event_seq': 0, 'runner': runner_id(), 'updated': now})
+            if fields.get('state'): pipe.zadd(self._state_key(fields['state']), {task_id: now})
+            pipe.execute()
+
+    def _decode(self, raw):
+        return {**json.loads(raw[b'data']), 'event_seq': int(raw[b'event_seq']), 'runner': raw.get(b'runner', b'').decode() or None, 'updated': float(raw[b'updated'])}
+
+    def get(self, task_id):
+        raw = self.client.hgetall(self._key(task_id))
+        return self._decode(raw) if raw else None
+
+    def event_seq(self, task_id):
+        seq = self.client.hget(self._key(task_id), 'event_seq')
+        return int(seq) if seq is not None else None
+
+    def _transaction(self, task_id, apply):
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._key(task_id))
+                    result = apply(pipe, pipe.hgetall(self._key(task_id)))
+                    pipe.execute()
+                    return result
+                except self.watch_error:
+                    continue
+
+    def update(self, task_id, fields, events=(), publish_status=False):
+        def apply(pipe, raw):
+            previous = json.loads(raw[b'data']) if raw else {}
+            task, seq, now = {**previous, **fields}, int(raw[b'event_seq']) if raw else 0, time.time()
+            all_events = list(events) + ([('status', task_snapshot(task))] if publish_status else [])
+            pipe.multi()
+            if all_events:
+                pipe.rpush(self._key(task_id, ':events'), *[json.dumps([seq + i, kind, data], ensure_ascii=False) for i, (kind, data) in enumerate(all_events, 1)])
+                pipe.ltrim(self._key(task_id, ':events'), -TASK_EVENT_LOG_MAX_EVENTS, -1)
+            pipe.hset(self._key(task_id), mapping={'data': json.dumps(task, ensure_ascii=False), 'event_seq': seq + len(all_events), 'updated': now})
+            if not raw: pipe.hset(self._key(task_id), 'runner', runner_id())
+            if previous.get('state') and previous['state'] != task.get('state'): pipe.zrem(self._state_key(previous['state']), task_id)
+            if task.get('state'): pipe.zadd(self._state_key(task['state']), {task_id: now})
+            return seq + len(all_events)
+        return self._transaction(task_id, apply)
+
+    def events_since(self, task_id, cursor):
+        events = [json.loads(raw) for raw in self.client.lrange(self._key(task_id, ':events'), 0, -1)]
+        return [tuple(event) for event in events if event[0] > cursor]
+
+    def delete(self, task_id):
+        task = self.get(task_id)
+        self.client.delete(self._key(task_id), self._key(task_id, ':events'))
+        if task and task.get('state'): self.client.zrem(self._state_key(task['state']), task_id)
+
+    def find(self, states, updated_before=None):
+        tasks = {}
+        for state in states:
+            for task_id in self.client.zrangebyscore(self._state_key(state), '-inf', f"({updated_before}" if updated_before is not None else '+inf'):
+                task = self.get(task_id.decode())
+                if task and task.get('state') == state: tasks[task_id.decode()] = task
+                elif not task: self.client.zrem(self._state_key(state), task_id)  # deleted by another worker meanwhile
+        return tasks
+
+    def claim(self, task_id, expected_runner, expected_updated=None):
+        def apply(pipe, raw):
+            if not raw or (raw.get(b'runner', b'').decode() or None) != expected_runner or \
+               (expected_updated is not None and float(raw[b'updated']) != expected_updated):
+                pipe.multi()
+                return False
+            pipe.multi()
+            pipe.hset(self._key(task_id), mapping={'runner': runner_id(), 'updated': time.time()})
+            return True
+        return self._transaction(task_id, apply)
+
+    def heartbeat(self):
+        now = time.time()
+        self.client.hset(f"{self.prefix}runners", runner_id(), now)
+        stale = [runner for runner, beat in self.client.hgetall(f"{self.prefix}runners").items() if float(beat) < now - 86400]
+        if stale: self.client.hdel(f"{self.prefix}runners", *stale)
+
+    def heartbeats(self):
+        return {runner.decode(): float(beat) for runner, beat in self.client.hgetall(f"{self.prefix}runners").items()}
+
+TASK_STORE = RedisTaskStore(TASK_STORE_URL) if TASK_STORE_URL.startswith(('redis://', 'rediss://', 'unix://')) else SQLiteTaskStore(TASK_STORE_PATH)
+
+# Streams in this process wait on a condition instead of re-reading the store; changes made by other workers are
+# picked up by re-checking the store's event counter every TASK_EVENT_POLL_SECONDS.
+TASK_EVENTS_CHANGED = threading.Condition()
+LOCAL_EVENT_SEQ = {}
+
+def notify_task_changed(task_id, seq):
+    with TASK_EVENTS_CHANGED:
+        LOCAL_EVENT_SEQ[task_id] = seq
+        TASK_EVENTS_CHANGED.notify_all()
+
+def wait_for_task_events(task_id, cursor, timeout):
+    """Blocks until the task has events after cursor (or timeout); returns the store's current event id."""
+    deadline = time.time() + timeout
+    while True:
+        with TASK_EVENTS_CHANGED:
+            TASK_EVENTS_CHANGED.wait_for(lambda: LOCAL_EVENT_SEQ.get(task_id, 0) > cursor, timeout=max(0, min(TASK_EVENT_POLL_SECONDS, deadline - time.time())))
+        seq = TASK_STORE.event_seq(task_id)
+        if seq is None or seq > cursor or time.time() >= deadline: return seq
 
 def read_file_with_fallback(file_path):
     try:
@@ -565,35 +1056,115 @@ def read_file_with_fallback(file_path):
     except UnicodeDecodeError:
         with open(file_path, 'r', encoding='gbk', errors='ignore') as f: return f.read()
 
-def get_pdf_page_count(pdf_file_path):
-    if not PdfReader: return 'N/A'
-    try:
-        with open(pdf_file_path, 'rb') as f: return len(PdfReader(f).pages)
-    except Exception: return 'N/A'
+def decode_text_with_fallback(data):
+    try: return data.decode('utf-8-sig')
+    except UnicodeDecodeError: return data.decode('gbk', errors='ignore')
 
-def preprocess_markdown_images(md_content, md_file_dir):
+def preprocess_markdown_images(md_content, source, md_rel_dir, style_options):
+    """Points local image links at deduplicated (and optionally downscaled) files in the asset store."""
+    max_width_px = image_max_width_px(style_options)
     def replacer(match):
         alt_text, link = match.group(1), match.group(2)
         if link.startswith(('http://', 'https://', 'data:image')): return match.group(0)
-        absolute_image_path = os.path.normpath(os.path.join(md_file_dir, link.split('?')[0]))
-        if os.path.exists(absolute_image_path):
-            mime_type, _ = mimetypes.guess_type(absolute_image_path)
-            if not mime_type: mime_type = 'application/octet-stream'
-            with open(absolute_image_path, 'rb') as f: img_data = f.read()
-            base64_data = base64.b64encode(img_data).decode('utf-8')
-            return f'![{alt_text}](data:{mime_type};base64,{base64_data})'
+        image_path = source.resolve(md_rel_dir, link.split('?')[0])
+        if image_path and not source.exists(image_path): image_path = source.resolve(md_rel_dir, urllib.parse.unquote(link.split('?')[0]))
+        if image_path and source.exists(image_path):
+            return f'![{alt_text}]({resolve_image_asset(source, image_path, max_width_px)})'
         return match.group(0)
     return re.sub(r'!\[(.*?)\]\((.*?)\)', replacer, md_content)
 
+# ==============================================================================
+# Image Asset Store
+# ==============================================================================
+ASSET_URLS = OrderedDict()
+ASSET_URLS_LOCK = threading.Lock()
+ASSET_STORE_PRUNED = False
+ASSET_STORE_PRUNE_LOCK = threading.Lock()
+
+def image_max_width_px(style_options):
+    """Pixel width at which an image fills the page's text column at ASSET_TARGET_DPI (None disables downscaling)."""
+    if not ASSET_TARGET_DPI: return None
+    page_width_mm = 297 if style_options.get('page_orientation', STYLE_DEFAULTS['page_orientation']) == 'landscape' else 210
+    margin = re.match(r'([\d.]+)\s*(cm|mm|in)?', style_options.get('page_margin', STYLE_DEFAULTS['page_margin']))
+    margin_mm = float(margin.group(1)) * {'cm': 10, 'mm': 1, 'in': 25.4}.get(margin.group(2) or 'cm') if margin else 25
+    return int((page_width_mm - 2 * margin_mm) / 25.4 * ASSET_TARGET_DPI)
+
+def downscale_image(data, ext, max_width_px):
+    """Returns a resized/recompressed copy of a raster image wider than max_width_px, or None to keep the original."""
+    if not max_width_px or ext not in ('.png', '.jpg', '.jpeg', '.webp'): return None
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width <= max_width_px: return None
+            resized = image.resize((max_width_px, max(1, round(image.height * max_width_px / image.width))), Image.LANCZOS)
+            out = io.BytesIO()
+            if ext in ('.jpg', '.jpeg'): resized.convert('RGB').save(out, 'JPEG', quality=ASSET_JPEG_QUALITY, optimize=True)
+            else: resized.save(out, image.format, optimize=True)
+            return out.getvalue() if out.tell() < len(data) else None
+    except Exception:
+        return None  # not a decodable image; let WeasyPrint deal with the original bytes
+
+def prune_asset_store():
+    cutoff = time.time() - ASSET_STORE_MAX_AGE_DAYS * 86400
+    for entry in os.scandir(ASSET_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            try: os.remove(entry.path)
+            except OSError: pass
+
+def prune_asset_store_once():
+    """Prunes the asset store the first time this process stores an image; concurrent callers prune only once."""
+    global ASSET_STORE_PRUNED
+    with ASSET_STORE_PRUNE_LOCK:
+        if ASSET_STORE_PRUNED: return
+        ASSET_STORE_PRUNED = True
+    prune_asset_store()
+
+def resolve_image_asset(source, image_path, max_width_px):
+    """Returns a file:// URL for an image, stored once under ASSET_DIR by content hash and target width."""
+    memo_key = (source.cache_id, image_path, max_width_px)
+    with ASSET_URLS_LOCK:
+        url = ASSET_URLS.get(memo_key)
+        if url and os.path.exists(url[len('file://'):]):
+            ASSET_URLS.move_to_end(memo_key)
+            return url
+    os.makedirs(ASSET_DIR, exist_ok=True)
+    prune_asset_store_once()
+    data = source.read_bytes(image_path)
+    ext = os.path.splitext(image_path)[1].lower()
+    asset_path = os.path.join(ASSET_DIR, hashlib.sha256(data).hexdigest()[:32] + (f'-w{max_width_px}' if max_width_px else '') + ext)
+    if os.path.exists(asset_path):
+        os.utime(asset_path)  # keeps it from being pruned
+    else:
+        fd, tmp_path = tempfile.mkstemp(dir=ASSET_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f: f.write(downscale_image(data, ext, max_width_px) or data)
+        os.replace(tmp_path, asset_path)
+    url = pathlib.Path(asset_path).as_uri()
+    with ASSET_URLS_LOCK:
+        ASSET_URLS[memo_key] = url
+        while len(ASSET_URLS) > 10000: ASSET_URLS.popitem(last=False)
+    return url
+
+def asset_url_fetcher(url, *args, **kwargs):
+    """WeasyPrint url_fetcher: local files may only be loaded from the asset store."""
+    if url.startswith('file:'):
+        path = os.path.realpath(urllib.request.url2pathname(urllib.parse.urlparse(url).path))
+        if not path.startswith(os.path.realpath(ASSET_DIR) + os.sep): raise ValueError(f"Refusing to load local file outside the asset store: {url}")
+    import weasyprint
+    return weasyprint.default_url_fetcher(url, *args, **kwargs)
+
+STYLE_DEFAULTS = {
+    'font_family': '"Times New Roman", "Microsoft YaHei", serif', 'font_size': '12pt', 
+    'page_margin': '2.5cm', 'line_height': '1.7', 'text_align': 'justify', 
+    'text_color': '#333333', 'heading_color': '#000000', 'link_color': '#0d6efd',
+    'page_orientation': 'portrait', 'heading_weight': '700', 'code_font_size': '85%',
+    'quote_bg_color': '#f9f9f9', 'quote_border_color': '#cccccc'
+}
+
 def get_css_style(style_options):
-    defaults = {
-        'font_family': '"Times New Roman", "Microsoft YaHei", serif', 'font_size': '12pt', 
-        'page_margin': '2.5cm', 'line_height': '1.7', 'text_align': 'justify', 
-        'text_color': '#333333', 'heading_color': '#000000', 'link_color': '#0d6efd',
-        'page_orientation': 'portrait', 'heading_weight': '700', 'code_font_size': '85%',
-        'quote_bg_color': '#f9f9f9', 'quote_border_color': '#cccccc'
-    }
-    def get_opt(key): return style_options.get(key, defaults[key])
+    def get_opt(key): return style_options.get(key, STYLE_DEFAULTS[key])
     return f"""
         @page {{ size: A4 {get_opt('page_orientation')}; margin: {get_opt('page_margin')}; }}
         html {{ font-size: {get_opt('font_size')}; }}
@@ -610,48 +1181,964 @@ def get_css_style(style_options):
         .bilingual-table td {{ width: 50%; vertical-align: top; padding: 5px 10px; border: 1px solid #eee; }}
     """
 
-def unzip_with_encoding_fix(zip_path, extract_dir):
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        for member in zip_ref.infolist():
-            try: filename_decoded = member.filename.encode('cp437').decode('utf-8')
-            except: filename_decoded = member.filename.encode('cp437').decode('gbk', errors='ignore')
-            if filename_decoded.startswith('__MACOSX/'): continue
-            member.filename = filename_decoded
-            target_path = os.path.join(extract_dir, member.filename)
-            if not os.path.realpath(target_path).startswith(os.path.realpath(extract_dir)): continue
-            if member.is_dir(): os.makedirs(target_path, exist_ok=True)
-            else:
-                os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                with zip_ref.open(member, 'r') as source, open(target_path, 'wb') as target:
-                    shutil.copyfileobj(source, target)
+def decode_zip_member_name(member):
+    if member.flag_bits & 0x800: return member.filename  # name is already flagged as UTF-8
+    try: return member.filename.encode('cp437').decode('utf-8')
+    except: return member.filename.encode('cp437').decode('gbk', errors='ignore')
+
+# ==============================================================================
+# Task Sources (uploaded folder or lazily-read ZIP)
+# ==============================================================================
+class DirectorySource:
+    """Markdown sources saved as plain files (folder and single-file uploads)."""
+    def __init__(self, root):
+        self.root = root
+
+    @property
+    def cache_id(self): return self.root
+
+    def resolve(self, md_rel_dir, link):
+        path = posixpath.normpath(posixpath.join(md_rel_dir, link))
+        return None if path.startswith('../') or posixpath.isabs(path) else path
+
+    def _path(self, rel_path):
+        path = os.path.realpath(os.path.join(self.root, rel_path))
+        if not path.startswith(os.path.realpath(self.root) + os.sep): raise PermissionError("Path traversal attempt detected.")
+        return path
+
+    def list_markdown(self):
+        return sorted(os.path.relpath(os.path.join(dp, f), self.root).replace(os.sep, '/')
+                      for dp, _, fn in os.walk(self.root) for f in fn if f.lower().endswith('.md') and not f.startswith('._'))
+
+    def exists(self, rel_path):
+        try: return os.path.isfile(self._path(rel_path))
+        except PermissionError: return False
+
+    def read_bytes(self, rel_path):
+        with open(self._path(rel_path), 'rb') as f: return f.read()
 
-def translate_text_via_api(task_id, content, target_language, prompt_template, log_id=""):
-    cache_key = hashlib.md5((content + target_language + prompt_template).encode('utf-8')).hexdigest()
-    with TRANSLATION_CACHE_LOCK:
-        if cache_key in TRANSLATION_CACHE:
-            return TRANSLATION_CACHE[cache_key]
+    def read_text(self, rel_path):
+        return read_file_with_fallback(self._path(rel_path))
+
+class ZipSource(DirectorySource):
+    """Read-only view of an uploaded ZIP served from its central directory; members are only decompressed when read.
+
+    Member names get the cp437 -> utf-8/gbk fix. The archive is rejected if it has more than ZIP_MAX_MEMBERS
+    entries or its members declare more than ZIP_MAX_UNCOMPRESSED_BYTES in total, and a member is refused if it
+    is larger than ZIP_MAX_MEMBER_BYTES or compressed more than ZIP_MAX_COMPRESSION_RATIO:1 (zip bombs). Reads
+    never return more than a member's declared size, so the total bounds everything the task can decompress.
+    Pickles as just its path, so render worker processes reopen it.
+    """
+    def __init__(self, zip_path):
+        self.zip_path, self._zip, self._members, self._lock = zip_path, None, None, threading.Lock()
+
+    @property
+    def cache_id(self): return self.zip_path
+
+    def __getstate__(self): return {'zip_path': self.zip_path}
+    def __setstate__(self, state): self.__init__(state['zip_path'])
+
+    def _index(self):
+        with self._lock:
+            if self._members is None:
+                zip_ref = zipfile.ZipFile(self.zip_path, 'r')
+                infos = zip_ref.infolist()
+                if len(infos) > ZIP_MAX_MEMBERS:
+                    zip_ref.close()
+                    raise ValueError(f"ZIP archive has {len(infos)} entries; the limit is {ZIP_MAX_MEMBERS}.")
+                total = sum(member.file_size for member in infos)
+                if total > ZIP_MAX_UNCOMPRESSED_BYTES:
+                    zip_ref.close()
+                    raise ValueError(f"ZIP contents ({total // (1024 * 1024)} MB) exceed the extraction limit of {ZIP_MAX_UNCOMPRESSED_BYTES // (1024 * 1024)} MB.")
+                members = {}
+                for member in infos:
+                    name = posixpath.normpath(decode_zip_member_name(member)).lstrip('/')
+                    if member.is_dir() or name.startswith(('__MACOSX/', '../')) or posixpath.basename(name).startswith('._'): continue
+                    members[name] = member
+                self._zip, self._members = zip_ref, members
+        return self._members
+
+    def list_markdown(self):
+        return sorted(name for name in self._index() if name.lower().endswith('.md'))
+
+    def exists(self, rel_path):
+        return rel_path in self._index()
+
+    def read_bytes(self, rel_path):
+        member = self._index().get(rel_path)
+        if member is None: raise FileNotFoundError(f"'{rel_path}' is not in the uploaded archive.")
+        if member.file_size > ZIP_MAX_MEMBER_BYTES: raise ValueError(f"ZIP member '{rel_path}' exceeds the size limit of {ZIP_MAX_MEMBER_BYTES // (1024 * 1024)} MB.")
+        if member.compress_size and member.file_size / member.compress_size > ZIP_MAX_COMPRESSION_RATIO:
+            raise ValueError(f"ZIP member '{rel_path}' has a suspicious compression ratio ({member.file_size // member.compress_size}:1).")
+        # Read one byte past the declared size so a forged size header can't smuggle in more data
+        with self._zip.open(member, 'r') as f: data = f.read(member.file_size + 1)
+        if len(data) > member.file_size: raise ValueError(f"ZIP member '{rel_path}' is larger than its declared size.")
+        return data
+
+    def read_text(self, rel_path):
+        return decode_text_with_fallback(self.read_bytes(rel_path))
+
+    def stats(self):
+        members = self._index()
+        return {'members': len(members), 'markdown_files': sum(1 for n in members if n.lower().endswith('.md')), 'bytes': sum(m.file_size for m in members.values())}
+
+TASK_SOURCES = OrderedDict()
+TASK_SOURCES_LOCK = threading.Lock()
+
+def get_task_source(task_dir):
+    """Returns the (cached) source of a task: its uploaded ZIP if one was kept, otherwise its source directory."""
+    with TASK_SOURCES_LOCK:
+        source = TASK_SOURCES.pop(task_dir, None)
+        if source is None:
+            zip_path = os.path.join(task_dir, 'source.zip')
+            source = ZipSource(zip_path) if os.path.exists(zip_path) else DirectorySource(os.path.join(task_dir, 'source'))
+        TASK_SOURCES[task_dir] = source
+        while len(TASK_SOURCES) > 64: TASK_SOURCES.popitem(last=False)
+    return source
+
+class StreamingUploadRequest(Request):
+    """Spools uploaded files straight to disk under OUTPUT_DIR, so saving them is a rename instead of a second copy."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+        stream = tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, prefix='upload-', delete=False)
+        self.__dict__.setdefault('upload_temp_files', []).append(stream)
+        return stream
+
+app.request_class = StreamingUploadRequest
+
+@app.teardown_request
+def remove_upload_temp_files(exc=None):
+    for stream in request.__dict__.get('upload_temp_files', []):
+        stream.close()
+        if os.path.exists(stream.name): os.remove(stream.name)
+
+def save_upload(file_storage, destination_path):
+    stream = file_storage.stream
+    if isinstance(getattr(stream, 'name', None), str) and os.path.dirname(stream.name) == UPLOAD_TMP_DIR:
+        stream.flush()
+        os.replace(stream.name, destination_path)
+    else:
+        file_storage.save(destination_path)
+
+# ==============================================================================
+# Persistent Caches
+# ==============================================================================
+class PersistentCache:
+    """SQLite-backed cache with LRU eviction once the stored values exceed max_bytes.
+
+    Used for translations (text, grouped by target language) and rendered PDFs (bytes). Every thread
+    and process opens its own connection; WAL mode and a busy timeout make concurrent access from
+    several Flask/gunicorn workers and render processes safe. Hit/miss/byte counters live in the
+    database too, so the admin endpoints report totals across all workers.
+    """
+    COUNTERS = ('hits', 'misses', 'bytes_read', 'bytes_written', 'evictions')
+
+    def __init__(self, path, max_bytes, table='translations'):
+        self.path, self.max_bytes, self.table = path, max_bytes, table
+        self._local = threading.local()
+
+    def _connect(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, language TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_lru ON {self.table} (last_access)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_language ON {self.table} (language)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.executemany('INSERT OR IGNORE INTO cache_stats (name, value) VALUES (?, 0)', [(c,) for c in self.COUNTERS + ('total_bytes',)])
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    @staticmethod
+    def make_key(content, target_language, prompt_template):
+        return hashlib.md5((content + target_language + prompt_template).encode('utf-8')).hexdigest()
+
+    def _bump(self, conn, **deltas):
+        conn.executemany('UPDATE cache_stats SET value = value + ? WHERE name = ?', [(v, k) for k, v in deltas.items() if v])
+
+    def get(self, key):
+        conn = self._connect()
+        with conn:
+            row = conn.execute(f'SELECT value, size FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._bump(conn, misses=1)
+                return None
+            conn.execute(f'UPDATE {self.table} SET last_access = ?, hits = hits + 1 WHERE key = ?', (time.time(), key))
+            self._bump(conn, hits=1, bytes_read=row[1])
+            return row[0]
+
+    def contains(self, keys):
+        """Returns the subset of keys that are cached, without counting lookups or refreshing their LRU position."""
+        conn, keys, found = self._connect(), list(keys), set()
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            found.update(row[0] for row in conn.execute(f'SELECT key FROM {self.table} WHERE key IN ({",".join("?" * len(batch))})', batch))
+        return found
+
+    def set(self, key, language, value):
+        conn, size, now = self._connect(), len(value if isinstance(value, bytes) else value.encode('utf-8')), time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            old = conn.execute(f'SELECT size FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            conn.execute(f'INSERT OR REPLACE INTO {self.table} (key, language, value, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?)', (key, language, value, size, now, now))
+            self._bump(conn, bytes_written=size, total_bytes=size - (old[0] if old else 0))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT value FROM cache_stats WHERE name = 'total_bytes'").fetchone()[0]
+        if total <= self.max_bytes: return
+        # Evict down to 90% of the limit so a full cache doesn't run an eviction on every insert
+        excess, freed, evicted = total - int(self.max_bytes * 0.9), 0, []
+        for key, size in conn.execute(f'SELECT key, size FROM {self.table} ORDER BY last_access'):
+            if freed >= excess: break
+            evicted.append((key,)); freed += size
+        conn.executemany(f'DELETE FROM {self.table} WHERE key = ?', evicted)
+        self._bump(conn, total_bytes=-freed, evictions=len(evicted))
+
+    def purge(self, language=None):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            where, args = ('WHERE language = ?', (language,)) if language else ('', ())
+            count, size = conn.execute(f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table} {where}', args).fetchone()
+            conn.execute(f'DELETE FROM {self.table} {where}', args)
+            self._bump(conn, total_bytes=-size)
+        return {'purged_entries': count, 'purged_bytes': size}
+
+    def stats(self):
+        conn = self._connect()
+        counters = dict(conn.execute('SELECT name, value FROM cache_stats').fetchall())
+        languages = {lang: {'entries': count, 'bytes': size} for lang, count, size in conn.execute(f'SELECT language, COUNT(*), SUM(size) FROM {self.table} GROUP BY language')}
+        lookups = counters['hits'] + counters['misses']
+        return {'path': self.path, 'max_bytes': self.max_bytes, 'entries': sum(l['entries'] for l in languages.values()), 'total_bytes': counters.pop('total_bytes'),
+                'hit_ratio': round(counters['hits'] / lookups, 4) if lookups else None, 'counters': counters, 'languages': languages}
+
+TRANSLATION_CACHE = PersistentCache(TRANSLATION_CACHE_PATH, TRANSLATION_CACHE_MAX_BYTES)
+
+class ThroughputHistory:
+    """Measured AI and render speed for the pre-flight estimates, shared by all workers and render processes.
+
+    Each metric keeps exponentially decayed totals of work units and seconds, so its rate follows recent runs.
+    Recording is best effort: a locked or unwritable database never fails the work being measured.
+    """
+    DECAY = 0.99
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS throughput (metric TEXT PRIMARY KEY, units REAL NOT NULL, seconds REAL NOT NULL, samples INTEGER NOT NULL)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def record(self, metric, units, seconds):
+        if units <= 0: return
+        try:
+            with self._connect() as conn:
+                conn.execute('INSERT INTO throughput (metric, units, seconds, samples) VALUES (?, ?, ?, 1) ON CONFLICT (metric) DO UPDATE SET '
+                             'units = units * ? + excluded.units, seconds = seconds * ? + excluded.seconds, samples = samples + 1',
+                             (metric, units, seconds, self.DECAY, self.DECAY))
+        except sqlite3.Error: pass
 
-    is_preview = not threading.current_thread().name.startswith("conversion_thread")
+    def rate(self, metric):
+        """Seconds per unit of work, or None if nothing has been measured yet."""
+        try: row = self._connect().execute('SELECT units, seconds FROM throughput WHERE metric = ?', (metric,)).fetchone()
+        except sqlite3.Error: return None
+        return row[1] / row[0] if row and row[0] > 0 else None
+
+THROUGHPUT_HISTORY = ThroughputHistory(THROUGHPUT_HISTORY_PATH)
+
+# ==============================================================================
+# Metrics & Stage Timing
+# ==============================================================================
+class MetricsRegistry:
+    """Process-local counters and histograms, rendered in the Prometheus text format by /metrics.
+
+    Render worker processes don't export anything themselves: their stage spans travel back with the render
+    result and are observed here. With several web workers, each one serves its own numbers.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics = {}  # name -> (type, help, {label tuple: value or [bucket counts, sum, count]})
+
+    def _series(self, kind, name, help_text, labels):
+        _, _, series = self.metrics.setdefault(name, (kind, help_text, {}))
+        return series, tuple(sorted(labels.items()))
+
+    def inc(self, name, help_text, amount=1, **labels):
+        with self._lock:
+            series, key = self._series('counter', name, help_text, labels)
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, help_text, value, **labels):
+        with self._lock:
+            series, key = self._series('histogram', name, help_text, labels)
+            buckets, total, count = series.get(key) or ([0] * len(self.BUCKETS), 0.0, 0)
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound: buckets[i] += 1
+            series[key] = (buckets, total + value, count + 1)
+
+    def totals(self, name):
+        """(sum, count) of each series of a histogram, by label dict."""
+        with self._lock:
+            _, _, series = self.metrics.get(name, (None, None, {}))
+            return [(dict(key), total, count) for key, (_, total, count) in series.items()]
+
+    @staticmethod
+    def _labels(pairs):
+        escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}' if pairs else ''
+
+    def render(self, gauges=()):
+        """Prometheus exposition text; `gauges` are (name, help, [(labels dict, value)]) read at scrape time."""
+        lines = []
+        for name, help_text, samples in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            lines += [f'{name}{self._labels(sorted(labels.items()))} {value}' for labels, value in samples if value is not None]
+        with self._lock:
+            for name, (kind, help_text, series) in sorted(self.metrics.items()):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                for key, value in sorted(series.items()):
+                    if kind == 'counter':
+                        lines.append(f'{name}{self._labels(key)} {value}')
+                        continue
+                    buckets, total, count = value
+                    lines += [f'{name}_bucket{self._labels(key + (("le", bound),))} {n}' for bound, n in zip(self.BUCKETS, buckets)]
+                    lines += [f'{name}_bucket{self._labels(key + (("le", "+Inf"),))} {count}', f'{name}_sum{self._labels(key)} {total}', f'{name}_count{self._labels(key)} {count}']
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+STAGE_SPANS = threading.local()
+
+@contextlib.contextmanager
+def stage_span(stage, **labels):
+    """Times one pipeline stage. The caller may set span['bytes'] to the size of what the stage produced.
+
+    Every span feeds the stage histograms (with any extra labels); inside `recording_spans()` it is also kept for the
+    current file's report.
+    """
+    span = {'stage': stage, 'labels': labels, 'seconds': 0.0, 'bytes': None}
+    started = time.perf_counter()
+    try: yield span
+    finally:
+        span['seconds'] = time.perf_counter() - started
+        observe_span(span)
+        recording = getattr(STAGE_SPANS, 'spans', None)
+        if recording is not None: recording.append(span)
+
+def observe_span(span):
+    METRICS.observe('md2pdf_stage_seconds', 'Time spent in each pipeline stage.', span['seconds'], stage=span['stage'], **span['labels'])
+    if span['bytes'] is not None: METRICS.inc('md2pdf_stage_bytes_total', 'Bytes produced by each pipeline stage.', span['bytes'], stage=span['stage'])
+
+@contextlib.contextmanager
+def recording_spans():
+    """Collects the spans finished by this thread (not by threads it starts) into the yielded list."""
+    previous, STAGE_SPANS.spans = getattr(STAGE_SPANS, 'spans', None), []
+    try: yield STAGE_SPANS.spans
+    finally: STAGE_SPANS.spans = previous
+
+# Per-stage columns of translation_summary.csv: stage -> column title
+STAGE_REPORT_COLUMNS = {'read': 'Read (s)', 'translate': 'Translate (s)', 'images': 'Images (s)', 'markdown': 'Markdown (s)', 'weasyprint': 'PDF Render (s)',
+                        'render_context': 'Render Context (s)', 'write_pdf': 'Write PDF (s)', 'filenames': 'File Names (s)'}
+
+def span_report(spans):
+    """Sums spans per stage into summary-report columns, plus the bytes of PDF written."""
+    report = {}
+    for span in spans:
+        column = STAGE_REPORT_COLUMNS.get(span['stage'])
+        if column: report[column] = round(report.get(column, 0) + span['seconds'], 3)
+        # A span that ended on an error path never had its bytes set
+        if span['stage'] == 'write_pdf': report['PDF Bytes'] = report.get('PDF Bytes', 0) + (span.get('bytes') or 0)
+    return report
+
+def is_batch_thread():
+    return threading.current_thread().name.startswith("conversion_thread")
+
+# ==============================================================================
+# AI Client
+# ==============================================================================
+def estimate_tokens(text):
+    """Rough token count for rate limiting: one per CJK character, one per four other characters."""
+    cjk = len(re.findall(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]', text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+class TokenBucket:
+    """Allows rate_per_minute units a minute, with bursts of up to a minute's worth (0 = unlimited).
+
+    acquire() reserves its units straight away and sleeps off any shortfall outside the lock, so concurrent
+    callers queue up behind each other instead of all waking at once.
+    """
+    def __init__(self, rate_per_minute):
+        self.capacity, self.rate = rate_per_minute, rate_per_minute / 60.0
+        self.level, self.stamp = float(rate_per_minute), time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        """Blocks until amount units are available; returns the seconds waited."""
+        if self.rate <= 0: return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.level -= min(amount, self.capacity)
+            delay = max(0.0, -self.level / self.rate)
+        if delay: time.sleep(delay)
+        return delay
+
+    def adjust(self, amount):
+        """Corrects an earlier reservation once the real cost is known (positive amount = it cost more)."""
+        if self.rate <= 0: return
+        with self._lock: self.level -= amount
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date); None if absent or invalid."""
+    if not value: return None
+    try: return max(0.0, float(value))
+    except ValueError: pass
+    try: return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError): return None
+
+class RetryableAIError(Exception):
+    """A failed attempt that is worth retrying (on another endpoint if there is one)."""
+    def __init__(self, error, retry_after=None, rate_limited=False):
+        super().__init__(error)
+        self.retry_after, self.rate_limited = retry_after, rate_limited
+
+class AIEndpoint:
+    """One OpenAI-compatible backend from AI_BACKENDS, with its own limits, health and statistics.
+
+    url, key and model fall back to AI_API_URL, AI_API_KEY and AI_MODEL when the entry doesn't set them.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.weight = float(config.get('weight', 1)) or 1.0
+        self.max_concurrency = int(config.get('max_concurrency') or AI_MAX_CONNECTIONS)
+        self.request_bucket = TokenBucket(config.get('requests_per_minute', AI_REQUESTS_PER_MINUTE))
+        self.token_bucket = TokenBucket(config.get('tokens_per_minute', AI_TOKENS_PER_MINUTE))
+        self.outstanding, self.consecutive_failures, self.ejections = 0, 0, 0
+        self.ejected_until, self.blocked_until = 0.0, 0.0
+        self.latencies = deque(maxlen=1000)
+        self.counters = {'requests': 0, 'succeeded': 0, 'failed': 0, 'rate_limited': 0, 'throttled_seconds': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    url = property(lambda self: self.config.get('url') or AI_API_URL)
+    key = property(lambda self: self.config.get('key') or AI_API_KEY)
+    model = property(lambda self: self.config.get('model') or AI_MODEL)
+
+    def stats(self, now):
+        latencies = sorted(self.latencies)
+        percentile = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+        return {'url': self.url, 'model': self.model, 'weight': self.weight, 'max_concurrency': self.max_concurrency, 'outstanding': self.outstanding,
+                'healthy': now >= self.ejected_until, 'ejected_for_seconds': round(max(0.0, self.ejected_until - now), 1),
+                'consecutive_failures': self.consecutive_failures, 'ejections': self.ejections,
+                'requests_per_minute': self.request_bucket.capacity, 'tokens_per_minute': self.token_bucket.capacity,
+                'counters': {**self.counters, 'throttled_seconds': round(self.counters['throttled_seconds'], 2)},
+                'latency_seconds': {'samples': len(latencies), 'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                                    'p50': percentile(0.5), 'p95': percentile(0.95), 'max': percentile(1)}}
+
+class AIClient:
+    """Shared client for one or more OpenAI-compatible chat completion endpoints.
+
+    Each call goes to the healthy endpoint with the fewest outstanding requests relative to its weight, waiting
+    if every endpoint is at its concurrency cap. Calls share one keep-alive session per process, wait for the
+    endpoint's per-minute request and token budgets, and are retried with exponential backoff (plus jitter) on 429,
+    5xx and connection errors, preferring a different endpoint. A Retry-After from a server holds back that
+    endpoint for every caller. An endpoint that keeps failing is ejected for a while (longer each time), then
+    gets live traffic again; if all endpoints are ejected, the one due back first is used. With
+    AI_HEDGE_AFTER_SECONDS, a request still unanswered after that long is also sent to another endpoint and the
+    first reply wins.
+    """
+    RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+
+    def __init__(self, backends):
+        self.endpoints = [AIEndpoint(config) for config in backends or [{}]]
+        self.session_, self.pid, self.hedge_executor = None, None, None
+        self.counters = {'requests': 0, 'retries': 0, 'hedged': 0, 'hedge_wins': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._capacity = threading.Condition(self._lock)
+
+    def session(self):
+        # Created per process: a session (and its sockets) inherited through fork must not be shared
+        with self._lock:
+            if self.pid != os.getpid():
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=max(4, len(self.endpoints)), pool_maxsize=AI_MAX_CONNECTIONS, max_retries=0)
+                session.mount('http://', adapter); session.mount('https://', adapter)
+                self.session_, self.pid = session, os.getpid()
+                self.hedge_executor = ThreadPoolExecutor(max_workers=AI_MAX_CONNECTIONS, thread_name_prefix='ai_hedge') if AI_HEDGE_AFTER_SECONDS else None
+            return self.session_
+
+    def _count(self, counters, **amounts):
+        with self._lock:
+            for name, amount in amounts.items(): counters[name] += amount
+
+    def _choose(self, exclude=()):
+        """The best endpoint that has a free slot, or None; call with the lock held."""
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e.outstanding < e.max_concurrency and e not in exclude] or \
+                     [e for e in self.endpoints if e.outstanding < e.max_concurrency]
+        healthy = [e for e in candidates if now >= e.ejected_until]
+        if not healthy and candidates and all(now < e.ejected_until for e in self.endpoints):
+            healthy = [min(candidates, key=lambda e: e.ejected_until)]
+        # Endpoints told to back off (Retry-After) are only used when nothing else is free
+        ready = [e for e in healthy if now >= e.blocked_until] or healthy
+        return min(ready, key=lambda e: ((e.outstanding + 1) / e.weight, e.blocked_until)) if ready else None
+
+    def acquire(self, exclude=(), block=True):
+        """Reserves a slot on an endpoint (released by release()); None if block is False and nothing is free."""
+        with self._capacity:
+            while True:
+                endpoint = self._choose(exclude)
+                if endpoint or not block: break
+                self._capacity.wait(timeout=1)
+            if endpoint: endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint):
+        with self._capacity:
+            endpoint.outstanding -= 1
+            self._capacity.notify_all()
+
+    def _record_health(self, endpoint, ok):
+        with self._lock:
+            if ok:
+                endpoint.consecutive_failures, endpoint.ejections = 0, 0
+                return
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= AI_EJECT_AFTER_FAILURES and len(self.endpoints) > 1:
+                endpoint.ejected_until = time.monotonic() + min(AI_EJECT_SECONDS * 2 ** endpoint.ejections, AI_EJECT_MAX_SECONDS)
+                endpoint.ejections += 1
+                endpoint.consecutive_failures = 0
+
+    def _throttle(self, endpoint, tokens):
+        waited = max(0.0, endpoint.blocked_until - time.monotonic())
+        if waited: time.sleep(waited)
+        waited += endpoint.request_bucket.acquire(1) + endpoint.token_bucket.acquire(tokens)
+        if waited: self._count(endpoint.counters, throttled_seconds=waited)
+
+    def _attempt(self, endpoint, messages, timeout, on_text, estimated_tokens):
+        """One request to an endpoint whose slot the caller has acquired; the slot is released here."""
+        try:
+            self._throttle(endpoint, estimated_tokens)
+            payload = {"model": endpoint.model, "messages": messages, **({"stream": True} if on_text else {})}
+            headers = {"Authorization": endpoint.key, "Content-Type": "application/json"}
+            started = time.monotonic()
+            self._count(endpoint.counters, requests=1)
+            try:
+                response = self.session().post(endpoint.url, headers=headers, json=payload, timeout=timeout or AI_REQUEST_TIMEOUT, stream=bool(on_text))
+                if response.status_code in self.RETRY_STATUSES:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if response.status_code == 429: self._count(endpoint.counters, rate_limited=1)
+                    if retry_after is not None:
+                        with self._lock: endpoint.blocked_until = max(endpoint.blocked_until, time.monotonic() + retry_after)
+                    raise RetryableAIError(f"HTTP {response.status_code} {response.reason}", retry_after, rate_limited=response.status_code == 429)
+                response.raise_for_status()
+                if on_text and response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                    content = self._read_stream(endpoint, response, on_text, estimated_tokens, started)
+                else:
+                    content = self._parse_reply(endpoint, response, estimated_tokens, time.monotonic() - started)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                raise RetryableAIError(e)
+            except requests.exceptions.RequestException as e:
+                raise ConnectionError(f"AI service connection failed: {e}")
+        except RetryableAIError as e:
+            # A 429 means the endpoint is up but busy; Retry-After already steers traffic away from it
+            self._record_health(endpoint, ok=e.rate_limited)
+            self._count(endpoint.counters, failed=1)
+            METRICS.inc('md2pdf_ai_requests_total', 'AI requests by endpoint and outcome.', endpoint=endpoint.url, outcome='rate_limited' if e.rate_limited else 'error')
+            raise
+        except TaskStopped: raise  # on_text abandoned the reply; not the endpoint's fault
+        except Exception:
+            self._count(endpoint.counters, failed=1)
+            METRICS.inc('md2pdf_ai_requests_total', 'AI requests by endpoint and outcome.', endpoint=endpoint.url, outcome='error')
+            raise
+        finally:
+            self.release(endpoint)
+        self._record_health(endpoint, ok=True)
+        return content
+
+    def _hedged(self, endpoint, call):
+        """Runs call(endpoint); if it is still running after AI_HEDGE_AFTER_SECONDS, races it against another endpoint."""
+        first = self.hedge_executor.submit(call, endpoint)
+        if futures_wait([first], timeout=AI_HEDGE_AFTER_SECONDS).done: return first.result()
+        backup = self.acquire(exclude=(endpoint,), block=False)
+        if backup is None or backup is endpoint:
+            if backup: self.release(backup)
+            return first.result()
+        self._count(self.counters, hedged=1)
+        second = self.hedge_executor.submit(call, backup)
+        pending, errors = {first, second}, []
+        while pending:
+            done, pending = futures_wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second: self._count(self.counters, hedge_wins=1)
+                    return future.result()
+                errors.append(future.exception())
+        raise errors[0]
+
+    def chat(self, messages, timeout=None, on_retry=None, on_text=None):
+        """Sends a chat completion and returns the reply text.
+
+        Raises ConnectionError once the retries are used up (or on a non-retryable HTTP error) and ValueError if
+        the reply can't be parsed. on_retry(attempt, error, delay) is called before each retry. With on_text the
+        reply is streamed, and on_text(text_so_far) is called as it grows (starting over if a retry is needed).
+        """
+        # A translation's reply is about as long as its input
+        estimated_tokens = 2 * estimate_tokens(''.join(message['content'] for message in messages))
+        call = lambda endpoint: self._attempt(endpoint, messages, timeout, on_text, estimated_tokens)
+        self.session()  # sets up this process's session and hedge executor
+        self._count(self.counters, requests=1)
+        failed = ()
+        for attempt in range(AI_MAX_RETRIES + 1):
+            endpoint = self.acquire(exclude=failed)
+            try:
+                if self.hedge_executor and not on_text and len(self.endpoints) > 1: return self._hedged(endpoint, call)
+                return call(endpoint)
+            except RetryableAIError as e:
+                error, retry_after, failed = e, e.retry_after, (endpoint,)
+            except TaskStopped: raise
+            except Exception:
+                self._count(self.counters, failed=1)
+                raise
+            if attempt == AI_MAX_RETRIES:
+                self._count(self.counters, failed=1)
+                raise ConnectionError(f"AI service connection failed after {attempt + 1} attempts: {error}")
+            # The next attempt goes elsewhere if possible, so only back off when this is the only endpoint
+            delay = 0.0 if len(self.endpoints) > 1 else retry_after if retry_after is not None else \
+                    min(AI_RETRY_MAX_SECONDS, AI_RETRY_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1)
+            self._count(self.counters, retries=1)
+            if on_retry: on_retry(attempt + 1, error, delay)
+            if delay: time.sleep(delay)
+
+    def _read_stream(self, endpoint, response, on_text, estimated_tokens, started):
+        """Collects a server-sent chat completion stream; the latency recorded is the time to the first token."""
+        parts, usage, first_token = [], {}, None
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'): continue
+                data = line[5:].strip()
+                if data == '[DONE]': break
+                try:
+                    event = json.loads(data)
+                    usage = event.get('usage') or usage
+                    delta = (event['choices'][0].get('delta') or {}).get('content') if event.get('choices') else None
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                    raise ValueError(f"Could not parse AI service stream: {e}")
+                if not delta: continue
+                if first_token is None: first_token = time.monotonic() - started
+                parts.append(delta)
+                on_text(''.join(parts))
+        elapsed = time.monotonic() - started
+        return self._record_reply(endpoint, ''.join(parts).strip(), usage, estimated_tokens, first_token if first_token is not None else elapsed, elapsed)
+
+    def _parse_reply(self, endpoint, response, estimated_tokens, latency):
+        try:
+            data = response.json()
+            content = data['choices'][0]['message']['content'].strip()
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            raise ValueError(f"Could not parse AI service response: {e}")
+        return self._record_reply(endpoint, content, data.get('usage'), estimated_tokens, latency, latency)
+
+    def _record_reply(self, endpoint, content, usage, estimated_tokens, latency, elapsed):
+        usage = usage or {}
+        prompt_tokens, completion_tokens = usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0
+        if prompt_tokens or completion_tokens: endpoint.token_bucket.adjust(prompt_tokens + completion_tokens - estimated_tokens)
+        THROUGHPUT_HISTORY.record('ai_tokens', prompt_tokens + completion_tokens or estimated_tokens, elapsed)
+        METRICS.observe('md2pdf_ai_request_seconds', 'AI request latency until the whole reply has arrived.', elapsed, endpoint=endpoint.url)
+        METRICS.inc('md2pdf_ai_requests_total', 'AI requests by endpoint and outcome.', endpoint=endpoint.url, outcome='success')
+        METRICS.inc('md2pdf_ai_tokens_total', 'AI tokens used, as reported by the endpoints.', prompt_tokens, endpoint=endpoint.url, kind='prompt')
+        METRICS.inc('md2pdf_ai_tokens_total', 'AI tokens used, as reported by the endpoints.', completion_tokens, endpoint=endpoint.url, kind='completion')
+        with self._lock:
+            endpoint.latencies.append(latency)
+            endpoint.counters['succeeded'] += 1
+            endpoint.counters['prompt_tokens'] += prompt_tokens
+            endpoint.counters['completion_tokens'] += completion_tokens
+        return content
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {'max_connections': AI_MAX_CONNECTIONS, 'hedge_after_seconds': AI_HEDGE_AFTER_SECONDS, 'counters': dict(self.counters),
+                    'endpoints': [endpoint.stats(now) for endpoint in self.endpoints]}
+
+AI_CLIENT = AIClient(AI_BACKENDS)
+
+def call_translation_api(task_id, content, target_language, prompt_template, log_id="", on_text=None):
+    is_preview = not is_batch_thread()
     if not is_preview:
         update_task_status(task_id, log=f"  -> [AI] Calling API for '{log_id}' (Lang: {target_language})...")
-    
-    headers = {"Authorization": AI_API_KEY, "Content-Type": "application/json"}
-    prompt = prompt_template.format(target_language=target_language)
-    payload = { "model": AI_MODEL, "messages": [{"role": "system", "content": prompt}, {"role": "user", "content": content}] }
-    
-    try:
-        response = requests.post(AI_API_URL, headers=headers, json=payload, timeout=180)
-        response.raise_for_status()
-        translated_content = response.json()['choices'][0]['message']['content'].strip()
-        with TRANSLATION_CACHE_LOCK:
-            TRANSLATION_CACHE[cache_key] = translated_content
+
+    def log_retry(attempt, error, delay):
         if not is_preview:
-            update_task_status(task_id, log=f"  -> [AI] Successfully received translation for '{log_id}'")
-        return translated_content
-    except requests.exceptions.RequestException as e:
-        raise ConnectionError(f"AI service connection failed: {e}")
-    except (KeyError, IndexError) as e:
-        raise ValueError(f"Could not parse AI service response: {e}")
+            update_task_status(task_id, log=f"  -> [AI] Request for '{log_id}' failed ({error}); retry {attempt}/{AI_MAX_RETRIES} in {delay:.1f}s...")
+
+    prompt = prompt_template.format(target_language=target_language)
+    translated_content = AI_CLIENT.chat([{"role": "system", "content": prompt}, {"role": "user", "content": content}], on_retry=log_retry, on_text=on_text)
+    if not is_preview:
+        update_task_status(task_id, log=f"  -> [AI] Successfully received translation for '{log_id}'")
+    return translated_content
+
+def translate_text_via_api(task_id, content, target_language, prompt_template, log_id="", on_text=None):
+    """Translates one text through the translation cache; with on_text the reply is streamed (see AIClient.chat)."""
+    cache_key = PersistentCache.make_key(content, target_language, prompt_template)
+    cached = TRANSLATION_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    translated_content = call_translation_api(task_id, content, target_language, prompt_template, log_id=log_id, on_text=on_text)
+    TRANSLATION_CACHE.set(cache_key, target_language, translated_content)
+    return translated_content
+
+def parse_json_string_list(text, expected_count):
+    """Parses a model reply that should be a JSON array of expected_count strings; raises ValueError otherwise."""
+    text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip())
+    try: items = json.loads(text)
+    except json.JSONDecodeError as e: raise ValueError(f"Response is not valid JSON: {e}")
+    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+        raise ValueError("Response is not a JSON array of strings.")
+    if len(items) != expected_count:
+        raise ValueError(f"Expected {expected_count} items but got {len(items)}.")
+    return items
+
+def parse_partial_json_string_list(text):
+    """Returns the strings completed so far in a JSON array that is still being streamed."""
+    text = re.sub(r'^```(?:json)?\s*', '', text.lstrip())
+    if not text.startswith('['): return []
+    decoder, items, pos = json.JSONDecoder(), [], 1
+    while True:
+        while pos < len(text) and text[pos] in ' \t\r\n,': pos += 1
+        try: item, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError: return items
+        if not isinstance(item, str): return items
+        items.append(item)
+
+def translate_segments_via_api(task_id, segments, target_language, prompt_template, fallback_prompt_template, log_id="", validator=None, on_partial=None):
+    """Translates a list of strings in one structured request (JSON array in, JSON array out).
+
+    Each segment is cached on its own, so only segments missing from the cache are sent. A reply of the wrong
+    shape is retried SEGMENT_BATCH_RETRIES times, then the batch is sent again as two halves (recursively). Single
+    segments, and segments whose translation validator(source, translation) rejects, are translated one by one
+    with fallback_prompt_template. With on_partial the replies are streamed, and on_partial(translations) gets
+    the translations of the leading segments as they become known.
+    """
+    key_of = lambda segment: PersistentCache.make_key(segment, target_language, prompt_template)
+    keys = [key_of(segment) for segment in segments]
+    results = {key: TRANSLATION_CACHE.get(key) for key in dict.fromkeys(keys)}
+    pending = list(dict.fromkeys(segment for segment, key in zip(segments, keys) if results[key] is None))
+
+    def report_partial(batch, text):
+        streamed = dict(zip(map(key_of, batch), parse_partial_json_string_list(text)))
+        on_partial(list(itertools.takewhile(lambda t: t is not None, (results[key] if results[key] is not None else streamed.get(key) for key in keys))))
+
+    def translate_batch(batch, retries):
+        """Sends batch as one request; returns the segments left to translate one by one."""
+        if len(batch) == 1: return batch
+        try:
+            reply = call_translation_api(task_id, json.dumps(batch, ensure_ascii=False), target_language, prompt_template, log_id=log_id,
+                                         on_text=(lambda text: report_partial(batch, text)) if on_partial else None)
+            translations = parse_json_string_list(reply, len(batch))
+        except ValueError as e:
+            if is_batch_thread():
+                update_task_status(task_id, log=f"  -> [AI] Batched reply for '{log_id}' rejected ({e}); " + ("retrying." if retries else f"splitting its {len(batch)} items in two."))
+            if retries: return translate_batch(batch, retries - 1)
+            half = len(batch) // 2
+            return translate_batch(batch[:half], 0) + translate_batch(batch[half:], 0)
+        rejected = []
+        for segment, translation in zip(batch, translations):
+            if validator and not validator(segment, translation): rejected.append(segment); continue
+            results[key_of(segment)] = translation.strip()
+            TRANSLATION_CACHE.set(key_of(segment), target_language, results[key_of(segment)])
+        return rejected
+
+    for segment in translate_batch(pending, SEGMENT_BATCH_RETRIES) if pending else ():
+        key = key_of(segment)
+        results[key] = translate_text_via_api(task_id, segment, target_language, fallback_prompt_template, log_id=log_id)
+        if not validator or validator(segment, results[key]): TRANSLATION_CACHE.set(key, target_language, results[key])
+    return [results[key] for key in keys]
+
+# ==============================================================================
+# Markdown Structure-Aware Chunking
+# ==============================================================================
+FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+HEADING_RE = re.compile(r'^ {0,3}#{1,6}(\s|$)')
+LIST_ITEM_RE = re.compile(r'^ {0,3}([-*+]|\d{1,9}[.)])(\s|$)')
+TABLE_DELIMITER_RE = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+
+def _consume_fence(lines, i):
+    """Returns the index just past the fenced block opening at lines[i]."""
+    opener = FENCE_RE.match(lines[i].lstrip()).group(1)
+    j = i + 1
+    while j < len(lines):
+        stripped = lines[j].strip()
+        if stripped.startswith(opener[0] * len(opener)) and not stripped.strip(opener[0]): return j + 1
+        j += 1
+    return j
+
+def _table_cell_count(row):
+    row = row.strip()
+    if row.startswith('|'): row = row[1:]
+    if row.endswith('|') and not row.endswith('\\|'): row = row[:-1]
+    return len(re.split(r'(?<!\\)\|', row))
+
+def _starts_table(header, delimiter):
+    """Whether header and delimiter open a pipe table; a delimiter without a pipe (e.g. ---) underlines a setext heading."""
+    return '|' in header and '|' in delimiter and bool(TABLE_DELIMITER_RE.match(delimiter)) and _table_cell_count(header) == _table_cell_count(delimiter)
+
+def split_markdown_blocks(md_content):
+    """Splits Markdown into top-level (kind, text) blocks; joining the texts reproduces the input exactly."""
+    lines = md_content.splitlines(keepends=True)
+    blocks, i, n = [], 0, len(lines)
+    while i < n:
+        line = lines[i]
+        if not line.strip():
+            j = i
+            while j < n and not lines[j].strip(): j += 1
+            blocks.append(('blank', ''.join(lines[i:j]))); i = j
+        elif FENCE_RE.match(line):
+            j = _consume_fence(lines, i)
+            blocks.append(('code', ''.join(lines[i:j]))); i = j
+        elif line.strip() == '$$':
+            j = i + 1
+            while j < n and '$$' not in lines[j]: j += 1
+            j = min(j + 1, n)
+            blocks.append(('math', ''.join(lines[i:j]))); i = j
+        elif line.startswith(('    ', '\t')) and (not blocks or blocks[-1][0] == 'blank'):
+            j = i
+            while j < n and (lines[j].startswith(('    ', '\t')) or not lines[j].strip()): j += 1
+            while j > i and not lines[j - 1].strip(): j -= 1
+            blocks.append(('code', ''.join(lines[i:j]))); i = j
+        elif HEADING_RE.match(line):
+            blocks.append(('heading', line)); i += 1
+        elif i + 1 < n and _starts_table(line, lines[i + 1]):
+            j = i + 2
+            while j < n and lines[j].strip() and '|' in lines[j]: j += 1
+            blocks.append(('table', ''.join(lines[i:j]))); i = j
+        elif LIST_ITEM_RE.match(line):
+            j = i + 1
+            while j < n:
+                if FENCE_RE.match(lines[j].lstrip()) and lines[j][:1].isspace(): j = _consume_fence(lines, j); continue
+                if lines[j].strip():
+                    if HEADING_RE.match(lines[j]) or (not lines[j][:1].isspace() and not LIST_ITEM_RE.match(lines[j]) and not lines[j - 1].strip()): break
+                    j += 1; continue
+                k = j
+                while k < n and not lines[k].strip(): k += 1
+                if k < n and (lines[k][:1].isspace() or LIST_ITEM_RE.match(lines[k])): j = k; continue
+                break
+            blocks.append(('list', ''.join(lines[i:j]))); i = j
+        else:
+            # A paragraph runs until a blank line or a block that can interrupt it (heading, fence, display math, table)
+            j = i + 1
+            while j < n and lines[j].strip() and not HEADING_RE.match(lines[j]) and not FENCE_RE.match(lines[j]) and lines[j].strip() != '$$' \
+                    and not (j + 1 < n and _starts_table(lines[j], lines[j + 1])): j += 1
+            blocks.append(('quote' if line.lstrip().startswith('>') else 'paragraph', ''.join(lines[i:j]))); i = j
+    return blocks
+
+def chunk_markdown(md_content, max_chars=TRANSLATION_CHUNK_MAX_CHARS):
+    """Groups top-level blocks into chunks of at most max_chars, breaking only between blocks and preferring headings."""
+    chunks, current, size = [], [], 0
+    for kind, text in split_markdown_blocks(md_content):
+        starts_section = kind == 'heading' and size > max_chars // 2
+        if current and kind != 'blank' and (size + len(text) > max_chars or starts_section):
+            chunks.append(current); current, size = [], 0
+        current.append((kind, text)); size += len(text)
+    if current: chunks.append(current)
+    return chunks
+
+def split_block_segments(kind, text):
+    """Splits a list into items and a table into rows; other blocks are a single segment.
+
+    Code fenced inside a list item is a segment of its own, and the item's text after it starts another one.
+    """
+    if kind not in ('list', 'table'): return [text]
+    lines = text.splitlines(keepends=True)
+    if kind == 'table': return lines
+    segments, i, after_fence = [], 0, False
+    while i < len(lines):
+        if FENCE_RE.match(lines[i].lstrip()):
+            j = _consume_fence(lines, i)
+            segments.append(''.join(lines[i:j]))
+            i, after_fence = j, True; continue
+        if LIST_ITEM_RE.match(lines[i].lstrip()) or not segments or after_fence: segments.append(lines[i])
+        else: segments[-1] += lines[i]
+        i, after_fence = i + 1, False
+    return segments
+
+def split_translation_segments(blocks):
+    """Returns (translatable, text) segments for a list of blocks; code (also when fenced inside a list item), math, blank
+    lines and table delimiter rows are not translatable."""
+    segments = []
+    for kind, text in blocks:
+        for segment in split_block_segments(kind, text):
+            translatable = kind not in ('blank', 'code', 'math') and bool(segment.strip()) and not (kind == 'table' and TABLE_DELIMITER_RE.match(segment)) \
+                           and not (kind == 'list' and FENCE_RE.match(segment.lstrip()))
+            segments.append((translatable, segment))
+    return segments
+
+def translate_markdown_document(task_id, md_content, target_language, log_id="", on_progress=None, cancel=None):
+    """Translates a Markdown document through the segment-level translation memory.
+
+    Paragraphs, headings, list items and table rows are looked up in the translation cache one by one,
+    so an edited document only sends its new or changed segments to the API. Missing segments are
+    sent per structure-aware chunk, at most TRANSLATION_MAX_CONCURRENCY chunks in flight.
+
+    With on_progress, replies are streamed and on_progress(markdown) is called with the translated
+    beginning of the document each time it grows. Once the cancel event is set, chunks not started yet are
+    skipped, streamed replies are abandoned and TaskStopped is raised.
+    """
+    chunks = [split_translation_segments(blocks) for blocks in chunk_markdown(md_content)]
+    segment_count = sum(1 for chunk in chunks for translatable, _ in chunk if translatable)
+    partial, progress_lock = [[] for _ in chunks], threading.Lock()
+
+    def assemble(index, translations):
+        out, translations = [], iter(translations)
+        for translatable, text in chunks[index]:
+            if not translatable: out.append(text); continue
+            translation = next(translations, None)
+            if translation is None: break
+            leading, trailing = text[:len(text) - len(text.lstrip())], text[len(text.rstrip()):]
+            out.append(leading + translation + trailing)
+        return out
+
+    def report_progress(index, out):
+        with progress_lock:
+            partial[index] = out
+            prefix = []
+            for chunk, done in zip(chunks, partial):
+                prefix.extend(done)
+                if len(done) < len(chunk): break
+            on_progress(''.join(prefix).strip())
+
+    def check_cancelled(*_):
+        if cancel is not None and cancel.is_set(): raise TaskStopped("Translation was cancelled")
+
+    def translate_chunk(index):
+        check_cancelled()
+        cores = [text.strip() for translatable, text in chunks[index] if translatable]
+        if not cores: out = [text for _, text in chunks[index]]
+        else:
+            chunk_log_id = log_id if len(chunks) == 1 else f"{log_id} [{index + 1}/{len(chunks)}]"
+            on_partial = (lambda translations: check_cancelled() or report_progress(index, assemble(index, translations))) if on_progress else None
+            out = assemble(index, translate_segments_via_api(task_id, cores, target_language, SEGMENT_TRANSLATION_PROMPT, TRANSLATION_PROMPT,
+                                                             log_id=chunk_log_id, on_partial=on_partial))
+        if on_progress: report_progress(index, out)
+        return out
+
+    if len(chunks) <= 1:
+        translated_chunks = [translate_chunk(0)] if chunks else []
+    else:
+        with ThreadPoolExecutor(max_workers=TRANSLATION_MAX_CONCURRENCY, thread_name_prefix=threading.current_thread().name) as executor:
+            translated_chunks = list(executor.map(translate_chunk, range(len(chunks))))
+    if is_batch_thread():
+        update_task_status(task_id, log=f"  -> [TM] '{log_id}': {segment_count} segments in {len(chunks)} chunk(s)")
+    return ''.join(text for chunk in translated_chunks for text in chunk).strip()
 
 def sanitize_filename(name):
     """Removes invalid characters and replaces spaces for use as a filename."""
@@ -659,112 +2146,965 @@ def sanitize_filename(name):
     name = re.sub(r'\s+', '_', name)
     return name
 
+def is_valid_translated_filename(source, translation):
+    name = sanitize_filename(translation.strip())
+    return bool(name.strip('._')) and len(name) <= 150 and '\n' not in translation.strip()
+
+def translate_filenames(task_id, stems, target_language):
+    """Translates file stems in batched JSON requests; returns {stem: sanitized translated stem}."""
+    unique_stems = list(dict.fromkeys(stems))
+    batches = [unique_stems[i:i + FILENAME_BATCH_SIZE] for i in range(0, len(unique_stems), FILENAME_BATCH_SIZE)]
+
+    def translate_batch(index):
+        return translate_segments_via_api(task_id, batches[index], target_language, FILENAME_BATCH_TRANSLATION_PROMPT, FILENAME_TRANSLATION_PROMPT,
+                                          log_id=f"filenames [{index + 1}/{len(batches)}]", validator=is_valid_translated_filename)
+
+    with ThreadPoolExecutor(max_workers=TRANSLATION_MAX_CONCURRENCY, thread_name_prefix=threading.current_thread().name) as executor:
+        translations = [name for batch in executor.map(translate_batch, range(len(batches))) for name in batch]
+    # A reply that is still unusable after the per-name fallback keeps the original stem
+    return {stem: sanitize_filename(name) if is_valid_translated_filename(stem, name) else stem for stem, name in zip(unique_stems, translations)}
+
+# A task running in this process has an event that is set whenever its state changes, so pause, resume and stop
+# wake it at once; a control request handled by another worker is seen on the next re-check of the store.
+TASK_CONTROL_EVENTS = {}
+
+class TaskStopped(Exception):
+    pass
+
+class TaskConflict(RuntimeError):
+    """The task changed (e.g. another request started it) between being checked and being claimed."""
+
+def task_control_event(task_id):
+    return TASK_CONTROL_EVENTS.setdefault(task_id, threading.Event())
+
+def wait_while_paused(task_id):
+    """Blocks while the task is paused; returns False if a stop has been requested or the task has been deleted."""
+    changed = task_control_event(task_id)
+    while True:
+        changed.clear()
+        task = TASK_STORE.get(task_id)
+        task_state = task.get('state') if task else 'STOPPED'
+        if task_state in ('STOPPING', 'STOPPED'): return False
+        if task_state != 'PAUSED': return True
+        changed.wait(TASK_EVENT_POLL_SECONDS)
+
+def check_task_control(task_id):
+    """Blocks while the task is paused; returns False once a stop has been requested, marking the task stopped."""
+    if wait_while_paused(task_id): return True
+    if (TASK_STORE.get(task_id) or {}).get('state') == 'STOPPING': update_task_status(task_id, state='STOPPED', log='任务已被用户手动结束。')
+    return False
+
+# ==============================================================================
+# Markdown Conversion Backends
+# ==============================================================================
+class PandocServerPool:
+    """Long-lived `pandoc server` processes, so conversions don't pay pandoc's start-up cost each time."""
+    def __init__(self, size):
+        self.size, self.servers, self.pid = size, [], None
+        self._lock, self._counter = threading.Lock(), itertools.count()
+        self.session = requests.Session()
+        self._supported = None
+
+    def supported(self):
+        """Whether the installed pandoc has `pandoc server` (>= PANDOC_SERVER_MIN_VERSION); checked once, logged if not."""
+        if self._supported is None:
+            import pypandoc
+            version = pypandoc.get_pandoc_version()
+            self._supported = tuple(int(n) for n in re.findall(r'\d+', version)[:2]) >= PANDOC_SERVER_MIN_VERSION
+            if not self._supported:
+                print(f"[⚠️] pandoc {version} has no `pandoc server` (needs >= {'.'.join(map(str, PANDOC_SERVER_MIN_VERSION))}); "
+                      "the pandoc-server backend falls back to one pandoc process per conversion.")
+        return self._supported
+
+    def _start_server(self):
+        import pypandoc
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0)); port = sock.getsockname()[1]
+        process = subprocess.Popen([pypandoc.get_pandoc_path(), 'server', f'--port={port}', '--timeout=300'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f'http://127.0.0.1:{port}'
+        for _ in range(100):
+            if process.poll() is not None: raise RuntimeError("pandoc server exited on start-up (pandoc >= 2.18 built with server support is required).")
+            try:
+                if self.session.get(f'{url}/version', timeout=1).ok: return {'process': process, 'url': url}
+            except requests.exceptions.ConnectionError: time.sleep(0.1)
+        process.kill()
+        raise RuntimeError("pandoc server did not become ready.")
+
+    def _ensure_started(self):
+        with self._lock:
+            if self.pid != os.getpid(): self.servers, self.pid = [], os.getpid()  # never reuse a parent process's servers
+            while len(self.servers) < self.size: self.servers.append(self._start_server())
+
+    def convert(self, text, from_format, to_format, highlight_style):
+        self._ensure_started()
+        index = next(self._counter) % self.size
+        payload = {'text': text, 'from': from_format, 'to': to_format, 'highlight-style': highlight_style}
+        for attempt in range(2):
+            server = self.servers[index]
+            try:
+                response = self.session.post(server['url'], json=payload, headers={'Accept': 'application/json'}, timeout=300)
+                response.raise_for_status()
+                result = response.json()
+                if 'output' not in result: raise RuntimeError(f"pandoc server error: {result.get('error', result)}")
+                return result['output']
+            except requests.exceptions.ConnectionError:
+                if attempt: raise
+                with self._lock:
+                    if server is self.servers[index]:  # another thread may already have restarted it
+                        server['process'].kill()
+                        self.servers[index] = self._start_server()
+
+    def shutdown(self):
+        with self._lock:
+            if self.pid == os.getpid():
+                for server in self.servers: server['process'].terminate()
+            self.servers = []
+
+PANDOC_SERVER_POOL = PandocServerPool(PANDOC_SERVER_POOL_SIZE)
+atexit.register(PANDOC_SERVER_POOL.shutdown)
+
+def convert_markdown(md_content, highlight_style, backend=None):
+    """Converts Markdown to an HTML fragment with the configured MARKDOWN_BACKEND."""
+    backend = backend or MARKDOWN_BACKEND
+    if backend == 'pandoc-server' and PANDOC_SERVER_POOL.supported():
+        return PANDOC_SERVER_POOL.convert(md_content, 'markdown+latex_macros', 'html', highlight_style)
+    if backend == 'python-markdown':
+        import markdown
+        return markdown.markdown(md_content, extensions=['extra', 'sane_lists', 'toc', 'codehilite'], extension_configs={'codehilite': {'css_class': 'sourceCode', 'guess_lang': False}})
+    import pypandoc
+    return pypandoc.convert_text(md_content, 'html', format='markdown+latex_macros', extra_args=[f'--highlight-style={highlight_style}'])
+
+# ==============================================================================
+# Render Cache
+# ==============================================================================
+class MemoryLRUCache:
+    """Thread-safe in-process LRU cache bounded by both entry count and total value size."""
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self._entries, self._bytes, self._lock = OrderedDict(), 0, threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes: return
+        with self._lock:
+            if key in self._entries: self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock: self._entries.clear(); self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_entries': self.max_entries, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+# Level 1: markdown (image links resolved to the asset store) + backend + highlight style -> HTML, per process.
+# Level 2: HTML + CSS -> PDF bytes, per process and in a SQLite store shared with the render workers.
+HTML_RENDER_CACHE = MemoryLRUCache(RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_MAX_BYTES)
+PDF_RENDER_CACHE = MemoryLRUCache(RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_MAX_BYTES)
+PDF_RENDER_STORE = PersistentCache(RENDER_CACHE_PATH, RENDER_CACHE_DISK_MAX_BYTES, table='pdfs')
+
+def markdown_to_html(md_content, source, md_rel_dir, style_options, store=True):
+    highlight_style = style_options.get("code_theme", "kate")
+    with stage_span('images'): processed_md = preprocess_markdown_images(md_content, source, md_rel_dir, style_options)
+    cache_key = hashlib.md5((MARKDOWN_BACKEND + '\0' + highlight_style + '\0' + processed_md).encode('utf-8')).hexdigest()
+    html = HTML_RENDER_CACHE.get(cache_key)
+    if html is None:
+        with stage_span('markdown') as span:
+            html = convert_markdown(processed_md, highlight_style)
+            span['bytes'] = len(html.encode('utf-8'))
+        if store: HTML_RENDER_CACHE.set(cache_key, html)
+    return html
+
+def layout_stats(document):
+    """Figures from a WeasyPrint layout: pages, images placed, and elements running past the right edge of the text column.
+
+    Only the page count is public API. The image and overflow counts walk WeasyPrint's internal box tree, so they are
+    taken only on the versions in WEASYPRINT_BOX_TREE_VERSIONS (the one the Docker image pins) and are None otherwise.
+    """
+    import weasyprint
+    stats = {'pages': len(document.pages), 'images': None, 'overflowing': None}
+    if weasyprint.__version__.split('.')[0] not in WEASYPRINT_BOX_TREE_VERSIONS: return stats
+    from weasyprint.formatting_structure.boxes import MarginBox, ReplacedBox
+    def count_overflowing(box, right):
+        # Only the outermost overflowing box counts, not every line or cell inside a table that is too wide
+        if box.position_x + box.margin_width() > right + 1: return 1
+        return sum(count_overflowing(child, right) for child in getattr(box, 'children', ()))
+    stats['images'] = stats['overflowing'] = 0
+    for page in document.pages:
+        page_box = page._page_box
+        stats['images'] += sum(isinstance(box, ReplacedBox) for box in page_box.descendants())
+        right = page_box.content_box_x() + page_box.width
+        stats['overflowing'] += sum(count_overflowing(box, right) for box in page_box.children if not isinstance(box, MarginBox))
+    return stats
+
+RENDER_CONTEXTS = threading.local()
+
+def render_context(css_text):
+    """Returns ({'css', 'font_config'}, reused) for rendering with css_text in this thread.
+
+    The thread's FontConfiguration is shared by all its styles, so fonts resolved for one PDF (the CJK fonts are
+    large) stay loaded for the next; each style's CSS is parsed once and kept for the thread's recent styles.
+    """
+    import weasyprint
+    from weasyprint.text.fonts import FontConfiguration
+    if not hasattr(RENDER_CONTEXTS, 'contexts'): RENDER_CONTEXTS.contexts = OrderedDict()
+    contexts, key = RENDER_CONTEXTS.contexts, hashlib.md5(css_text.encode('utf-8')).hexdigest()
+    if key in contexts:
+        contexts.move_to_end(key)
+        return contexts[key], True
+    with stage_span('render_context'):
+        if not hasattr(RENDER_CONTEXTS, 'font_config'): RENDER_CONTEXTS.font_config = FontConfiguration()
+        contexts[key] = {'css': weasyprint.CSS(string=css_text, font_config=RENDER_CONTEXTS.font_config), 'font_config': RENDER_CONTEXTS.font_config}
+    while len(contexts) > RENDER_CONTEXT_MAX_STYLES: contexts.popitem(last=False)
+    return contexts[key], False
+
+def render_context_savings():
+    """What reusing render contexts saved, from the WeasyPrint spans of this process and its render workers."""
+    spans = {(labels['stage'], labels.get('context')): (total, count) for labels, total, count in METRICS.totals('md2pdf_stage_seconds')}
+    mean = lambda stage, context=None: spans[(stage, context)][0] / spans[(stage, context)][1] if (stage, context) in spans else None
+    built, cold, warm = mean('render_context'), mean('weasyprint', 'cold'), mean('weasyprint', 'warm')
+    reused = spans.get(('weasyprint', 'warm'), (0, 0))[1]
+    # A reused context skips the build and renders with warm fonts: the difference to a fresh context, per render
+    saved = built + cold - warm if None not in (built, cold, warm) else None
+    return {'built': spans.get(('render_context', None), (0, 0))[1], 'reused': reused, 'build_seconds_mean': built and round(built, 4),
+            'render_seconds_mean': {'new_context': cold and round(cold, 4), 'reused_context': warm and round(warm, 4)},
+            'saved_seconds_per_render': saved and round(saved, 4), 'saved_seconds_total': saved and round(saved * reused, 2)}
+
+def render_pdf(html_document, css_text, lookup=True, store=True):
+    """Renders a full HTML document with WeasyPrint and returns (PDF bytes, layout stats), reusing cached output for identical HTML + CSS.
+
+    lookup=False renders without consulting the caches and store=False keeps the result out of them, for PDFs that
+    are not worth a cache slot (e.g. the transient frames of a progressive preview).
+    """
+    # The layout stats are stored in front of the PDF, so cache hits need no second look at the PDF to count its pages
+    cache_key = hashlib.md5(html_document.encode('utf-8')).hexdigest() + hashlib.md5(css_text.encode('utf-8')).hexdigest() + '-layout'
+    cached = PDF_RENDER_CACHE.get(cache_key) if lookup else None
+    if cached is None and lookup and RENDER_CACHE_DISK_MAX_BYTES:
+        cached = PDF_RENDER_STORE.get(cache_key)
+        if cached is not None and store: PDF_RENDER_CACHE.set(cache_key, cached)
+    if cached is not None:
+        header_size = int.from_bytes(cached[:4], 'big')
+        return cached[4 + header_size:], json.loads(cached[4:4 + header_size])
+    import weasyprint
+    context, reused = render_context(css_text)
+    with stage_span('weasyprint', context='warm' if reused else 'cold') as span:
+        document = weasyprint.HTML(string=html_document, url_fetcher=asset_url_fetcher).render(stylesheets=[context['css']], font_config=context['font_config'])
+        layout = layout_stats(document)
+        pdf_bytes = document.write_pdf()
+        span['bytes'] = len(pdf_bytes)
+    if not store: return pdf_bytes, layout
+    header = json.dumps(layout).encode('utf-8')
+    cached = len(header).to_bytes(4, 'big') + header + pdf_bytes
+    PDF_RENDER_CACHE.set(cache_key, cached)
+    if RENDER_CACHE_DISK_MAX_BYTES: PDF_RENDER_STORE.set(cache_key, 'pdf', cached)
+    return pdf_bytes, layout
+
+def html_to_pdf(html_document, css_text, lookup=True, store=True):
+    return render_pdf(html_document, css_text, lookup, store)[0]
+
+def write_pdf_file(pdf_path, html_document, css_text):
+    """Renders and writes one PDF; returns its layout stats (see layout_stats).
+
+    The written file is the result, so it is not copied into the render caches as well; a PDF already cached by a
+    preview of the same file and style is still reused.
+    """
+    os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    pdf_bytes, layout = render_pdf(html_document, css_text, store=False)
+    # Written under a temporary name first so an interrupted run never leaves a truncated PDF behind
+    with stage_span('write_pdf') as span:
+        with open(pdf_path + '.part', 'wb') as f: f.write(pdf_bytes)
+        os.replace(pdf_path + '.part', pdf_path)
+        span['bytes'] = len(pdf_bytes)
+    return layout
+
+BILINGUAL_BLOCK_MARKER = '<!-- bilingual-block -->'
+
+def align_markdown_blocks(original_blocks, translated_blocks):
+    """Pairs the top-level blocks of a document and its translation by matching their sequence of block kinds."""
+    matcher = difflib.SequenceMatcher(None, [k for k, _ in original_blocks], [k for k, _ in translated_blocks], autojunk=False)
+    pairs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        for offset in range(max(i2 - i1, j2 - j1)):
+            pairs.append((original_blocks[i1 + offset][1] if i1 + offset < i2 else "", translated_blocks[j1 + offset][1] if j1 + offset < j2 else ""))
+    return pairs
+
+def blocks_to_html_cells(blocks, source, md_rel_dir, style_options):
+    """Converts a list of Markdown blocks with one conversion of the whole document, split back on marker comments."""
+    joined = f'\n\n{BILINGUAL_BLOCK_MARKER}\n\n'.join(block.strip('\n') for block in blocks)
+    cells = [cell.strip() for cell in markdown_to_html(joined, source, md_rel_dir, style_options).split(BILINGUAL_BLOCK_MARKER)]
+    if len(cells) != len(blocks):  # the converter did not keep the markers; convert block by block instead
+        cells = [markdown_to_html(block, source, md_rel_dir, style_options) if block.strip() else "" for block in blocks]
+    return cells
+
+def build_bilingual_rows(original_md, translated_md, source, md_rel_dir, style_options):
+    original_blocks = [(k, t) for k, t in split_markdown_blocks(original_md) if k != 'blank']
+    translated_blocks = [(k, t) for k, t in split_markdown_blocks(translated_md) if k != 'blank']
+    pairs = align_markdown_blocks(original_blocks, translated_blocks)
+    if not pairs: return ""
+    original_cells = blocks_to_html_cells([o for o, _ in pairs], source, md_rel_dir, style_options)
+    translated_cells = blocks_to_html_cells([t for _, t in pairs], source, md_rel_dir, style_options)
+    return ''.join(f"<tr><td>{o}</td><td>{t}</td></tr>" for o, t in zip(original_cells, translated_cells))
+
+def render_file_outputs(job):
+    """Render stage of the batch pipeline: runs pandoc and WeasyPrint for one file inside a render worker process.
+
+    Returns the page counts and layout stats WeasyPrint measured, with the stage spans timed along the way, which
+    the task thread reports and observes.
+    """
+    style_options, source, result_dir, rel_path = job['style_options'], job['source'], job['result_dir'], job['rel_path']
+    md_rel_dir = posixpath.dirname(rel_path)
+    css_text = get_css_style(style_options)
+    report, layouts, started, rendered_chars = {}, [], time.monotonic(), 0
+    with recording_spans() as spans:
+        # --- Generate Original PDF ---
+        if job['export_mode'] in ['original', 'bilingual']:
+            original_pdf_path = os.path.join(result_dir, 'original_pdfs', os.path.splitext(rel_path)[0] + '.pdf')
+            html = markdown_to_html(job['md_content'], source, md_rel_dir, style_options)
+            layouts.append(write_pdf_file(original_pdf_path, f'<html><body>{html}</body></html>', css_text))
+            report["Original Pages"] = layouts[-1]['pages']
+            rendered_chars += len(job['md_content'])
+
+        # --- Generate Translated PDF ---
+        if job['export_mode'] in ['translated', 'bilingual']:
+            translated_pdf_path = os.path.join(result_dir, 'translated_pdfs', os.path.dirname(rel_path), job['translated_filename_stem'] + '.pdf')
+            html = markdown_to_html(job['translated_md'], source, md_rel_dir, style_options)
+            layouts.append(write_pdf_file(translated_pdf_path, f'<html><body>{html}</body></html>', css_text))
+            report["Translated Pages"] = layouts[-1]['pages']
+            rendered_chars += len(job['translated_md'])
+
+        # --- Generate Bilingual PDF ---
+        if job['export_mode'] == 'bilingual':
+            bilingual_pdf_path = os.path.join(result_dir, 'bilingual_pdfs', os.path.dirname(rel_path), job['translated_filename_stem'] + '.pdf')
+
+            bilingual_html_rows = build_bilingual_rows(job['md_content'], job['translated_md'], source, md_rel_dir, style_options)
+            full_bilingual_html = f'<html><body><table class="bilingual-table">{bilingual_html_rows}</table></body></html>'
+            layouts.append(write_pdf_file(bilingual_pdf_path, full_bilingual_html, css_text))
+            report["Bilingual Pages"] = layouts[-1]['pages']
+            rendered_chars += len(job['md_content']) + len(job['translated_md'])
+
+        # Every output shows the same images, so the first one's count stands for the file; overflow is summed
+        if layouts:
+            report["Images"] = layouts[0]['images']
+            report["Overflowing Elements"] = None if layouts[0]['overflowing'] is None else sum(layout['overflowing'] for layout in layouts)
+
+        THROUGHPUT_HISTORY.record('render_chars', rendered_chars, time.monotonic() - started)
+    return {'report': report, 'spans': spans, 'pid': os.getpid()}
+
+def get_render_pool():
+    """Returns the shared WeasyPrint process pool, or None when RENDER_WORKERS is 0 (render in the task thread)."""
+    global RENDER_POOL
+    with RENDER_POOL_LOCK:
+        if RENDER_POOL is None and RENDER_WORKERS > 0:
+            RENDER_POOL = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return RENDER_POOL
+
+def submit_render_job(job):
+    global RENDER_POOL
+    pool = get_render_pool()
+    if pool is None:
+        future = Future()
+        try: future.set_result(render_file_outputs(job))
+        except Exception as e: future.set_exception(e)
+        return future
+    try:
+        return pool.submit(render_file_outputs, job)
+    except BrokenProcessPool:
+        with RENDER_POOL_LOCK: RENDER_POOL = None
+        return get_render_pool().submit(render_file_outputs, job)
+
+# ==============================================================================
+# Job Scheduler
+# ==============================================================================
+class SchedulerBusy(RuntimeError):
+    pass
+
+def client_id():
+    """Identifies the user for fair scheduling (first X-Forwarded-For hop, else the peer address)."""
+    return (request.headers.get('X-Forwarded-For') or request.remote_addr or 'anonymous').split(',')[0].strip()
+
+SYSTEM_LOAD_CACHE = {'at': 0, 'value': (0.0, 0.0)}
+
+def system_load():
+    """Returns (memory used %, 1-minute load average per CPU), sampled at most once a second."""
+    if time.time() - SYSTEM_LOAD_CACHE['at'] < 1: return SYSTEM_LOAD_CACHE['value']
+    try:
+        import psutil
+        memory_percent = psutil.virtual_memory().percent
+    except ImportError:
+        try:
+            with open('/proc/meminfo') as f: meminfo = {line.split(':')[0]: int(line.split()[1]) for line in f}
+            memory_percent = 100.0 * (1 - meminfo['MemAvailable'] / meminfo['MemTotal'])
+        except (OSError, KeyError, ValueError):
+            memory_percent = 0.0
+    load_per_cpu = os.getloadavg()[0] / (os.cpu_count() or 1) if hasattr(os, 'getloadavg') else 0.0
+    SYSTEM_LOAD_CACHE.update(at=time.time(), value=(memory_percent, load_per_cpu))
+    return memory_percent, load_per_cpu
+
+class JobScheduler:
+    """Runs batch tasks and previews on a bounded set of worker threads, in priority order.
+
+    Previews are queued ahead of batch tasks. Within one priority users take turns (round-robin), so a user
+    with fifty uploads doesn't hold up everyone else. Queued batch tasks are told their position whenever it
+    changes, and only start while the machine is below the admission limits.
+    """
+    PRIORITIES = ('preview', 'batch')
+
+    def __init__(self, workers, max_batch, max_queued):
+        self.workers, self.max_batch, self.max_queued = workers, max_batch, max_queued
+        self.queues = {kind: OrderedDict() for kind in self.PRIORITIES}  # kind -> user -> deque of jobs, in turn order
+        self.running = {kind: 0 for kind in self.PRIORITIES}
+        self.counters = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'cancelled': 0}
+        self.cond = threading.Condition()
+        self.executor, self.dispatcher, self.positions = None, None, {}
+
+    def queued(self, kind):
+        """Jobs of one kind in the order they will start: one per user per turn."""
+        return [job for round_ in itertools.zip_longest(*self.queues[kind].values()) for job in round_ if job]
+
+    def admission_error(self, kind):
+        memory_percent, _ = system_load()
+        if memory_percent >= ADMISSION_REJECT_MEMORY_PERCENT: return f"Server is low on memory ({memory_percent:.0f}% used); try again later."
+        if sum(len(q) for queues in self.queues.values() for q in queues.values()) >= self.max_queued: return "Server is busy: too many queued jobs; try again later."
+        return None
+
+    def submit(self, kind, user, fn, job_id=None, on_position=None):
+        reason = self.admission_error(kind)
+        with self.cond:
+            if reason:
+                self.counters['rejected'] += 1
+                raise SchedulerBusy(reason)
+            job = {'kind': kind, 'user': user, 'fn': fn, 'id': job_id, 'future': Future(), 'on_position': on_position}
+            self.queues[kind].setdefault(user, deque()).append(job)
+            self.counters['submitted'] += 1
+            # Started on first use (and again in a forked worker, where the parent's threads don't exist)
+            if self.dispatcher is None or not self.dispatcher.is_alive():
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scheduler')
+                self.dispatcher = threading.Thread(target=self._dispatch_loop, name='scheduler_dispatch', daemon=True)
+                self.dispatcher.start()
+            self.cond.notify_all()
+        self._report_positions()
+        return job['future']
+
+    def run(self, kind, user, fn):
+        return self.submit(kind, user, fn).result()
+
+    def cancel(self, job_id):
+        """Removes a job that hasn't started yet; False if it is unknown here or already running."""
+        with self.cond:
+            found = next(((queues, user, job) for queues in self.queues.values() for user, queue in queues.items() for job in queue if job['id'] == job_id), None)
+            if found is None: return False
+            queues, user, job = found
+            queues[user].remove(job)
+            if not queues[user]: del queues[user]
+            job['future'].cancel()
+            self.counters['cancelled'] += 1
+        self._report_positions()
+        return True
+
+    def _can_start(self, kind):
+        if sum(self.running.values()) >= self.workers: return False
+        if kind != 'batch': return True
+        memory_percent, load_per_cpu = system_load()
+        return self.running['batch'] < self.max_batch and memory_percent < ADMISSION_MAX_MEMORY_PERCENT and load_per_cpu < ADMISSION_MAX_LOAD_PER_CPU
+
+    def _next_job(self):
+        for kind in self.PRIORITIES:
+            queues = self.queues[kind]
+            if not queues or not self._can_start(kind): continue
+            user, queue = next(iter(queues.items()))
+            job = queue.popleft()
+            # The user goes to the back of the line for their next job
+            del queues[user]
+            if queue: queues[user] = queue
+            return job
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self.cond:
+                job = self._next_job()
+                # Waiting jobs held back by admission control are re-checked every second
+                if job is None: self.cond.wait(timeout=1); continue
+                self.running[job['kind']] += 1
+            if job['future'].set_running_or_notify_cancel(): self.executor.submit(self._run, job)
+            else: self._finished(job, 'cancelled')
+            self._report_positions()
+
+    def _run(self, job):
+        thread, name = threading.current_thread(), threading.current_thread().name
+        try:
+            job['future'].set_result(job['fn']())
+            outcome = 'completed'
+        except BaseException as e:
+            job['future'].set_exception(e)
+            outcome = 'failed'
+        finally:
+            thread.name = name  # batch runs rename their thread
+        self._finished(job, outcome)
+
+    def _finished(self, job, outcome):
+        with self.cond:
+            self.running[job['kind']] -= 1
+            self.counters[outcome] += 1
+            self.cond.notify_all()
+
+    def _report_positions(self):
+        with self.cond:
+            positions = {job['id']: (position, job['on_position']) for position, job in enumerate(self.queued('batch'), 1) if job['on_position']}
+            changed = [(callback, position) for job_id, (position, callback) in positions.items() if self.positions.get(job_id) != position]
+            self.positions = {job_id: position for job_id, (position, _) in positions.items()}
+        for callback, position in changed: callback(position)
+
+    def stats(self):
+        memory_percent, load_per_cpu = system_load()
+        with self.cond:
+            return {'workers': self.workers, 'max_concurrent_tasks': self.max_batch, 'running': dict(self.running),
+                    'queued': {kind: len(self.queued(kind)) for kind in self.PRIORITIES}, 'counters': dict(self.counters),
+                    'memory_percent': round(memory_percent, 1), 'load_per_cpu': round(load_per_cpu, 2)}
+
+JOB_SCHEDULER = JobScheduler(SCHEDULER_WORKERS, MAX_CONCURRENT_TASKS, MAX_QUEUED_JOBS)
+
+# ==============================================================================
+# Task Checkpoints
+# ==============================================================================
+class TaskCheckpoint:
+    """Per-file progress of a batch run, kept in the task directory so a failed, stopped or interrupted run can resume.
+
+    checkpoint.jsonl is append-only (one JSON record per finished or failed file, plus the translated file
+    names); translated Markdown is kept next to it so a file whose render failed isn't translated again.
+    Records written with different run parameters are ignored.
+    """
+    def __init__(self, task_dir, params):
+        self.path = os.path.join(task_dir, 'checkpoint.jsonl')
+        self.key = hashlib.md5(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+        self.translations_dir = os.path.join(task_dir, 'checkpoint', self.key)
+        self.completed, self.failed, self.filenames = {}, {}, None
+        self._lock = threading.Lock()
+        if not os.path.exists(self.path): return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try: record = json.loads(line)
+                except json.JSONDecodeError: continue  # a line cut short by a crash
+                if record.get('key') != self.key: continue
+                if record['kind'] == 'filenames': self.filenames = record['stems']
+                elif record['kind'] == 'done': self.completed[record['rel_path']] = record['report']; self.failed.pop(record['rel_path'], None)
+                elif record['kind'] == 'failed': self.failed[record['rel_path']] = record['error']
+
+    def _append(self, record):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'key': self.key, **record}, ensure_ascii=False) + '\n')
+            f.flush(); os.fsync(f.fileno())
+
+    def save_filenames(self, stems):
+        self.filenames = stems
+        self._append({'kind': 'filenames', 'stems': stems})
+
+    def mark_done(self, rel_path, report):
+        self.completed[rel_path] = report; self.failed.pop(rel_path, None)
+        self._append({'kind': 'done', 'rel_path': rel_path, 'report': report})
+
+    def mark_failed(self, rel_path, error):
+        self.failed[rel_path] = error
+        self._append({'kind': 'failed', 'rel_path': rel_path, 'error': error})
+
+    def save_translation(self, rel_path, translated_md):
+        path = os.path.join(self.translations_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.part', 'w', encoding='utf-8') as f: f.write(translated_md)
+        os.replace(path + '.part', path)
+
+    def load_translation(self, rel_path):
+        path = os.path.join(self.translations_dir, rel_path)
+        if not os.path.exists(path): return None
+        with open(path, encoding='utf-8') as f: return f.read()
+
+# ==============================================================================
+# Batch Estimates
+# ==============================================================================
+def estimate_translation_calls(segments, target_language, prompt_template, fallback_prompt_template):
+    """Predicts the API traffic of translate_segments_via_api for these segments: (segments cached, calls, input tokens, output tokens)."""
+    keys = {PersistentCache.make_key(segment, target_language, prompt_template): segment for segment in segments}
+    cached = TRANSLATION_CACHE.contains(keys)
+    pending = [segment for key, segment in keys.items() if key not in cached]
+    if not pending: return len(segments), 0, 0, 0
+    if len(pending) == 1:
+        request_text, prompt = pending[0], fallback_prompt_template.format(target_language=target_language)
+    else:
+        request_text, prompt = json.dumps(pending, ensure_ascii=False), prompt_template.format(target_language=target_language)
+    # A translation is about as long as its source
+    return len(segments) - len(pending), 1, estimate_tokens(prompt) + estimate_tokens(request_text), estimate_tokens(request_text)
+
+def estimate_batch(task_dir, params):
+    """Pre-flight analysis of a batch run: the work left after the checkpoint and translation cache, and its cost and duration."""
+    source = get_task_source(task_dir)
+    files = source.list_markdown()
+    checkpoint = TaskCheckpoint(task_dir, params)
+    target_language, export_mode = params['target_language'] or '', params['export_mode']
+    translate = export_mode in ('translated', 'bilingual')
+    per_file, totals = [], {'segments': 0, 'cached_segments': 0, 'api_calls': 0, 'input_tokens': 0, 'output_tokens': 0}
+    render_chars = 0
+    for rel_path in files:
+        if rel_path in checkpoint.completed: continue
+        md_content = source.read_text(rel_path)
+        entry = {'file': rel_path, 'chars': len(md_content), 'tokens': estimate_tokens(md_content), 'chunks': 0,
+                 'segments': 0, 'cached_segments': 0, 'api_calls': 0, 'input_tokens': 0, 'output_tokens': 0}
+        if translate and checkpoint.load_translation(rel_path) is None:
+            for blocks in chunk_markdown(md_content):
+                cores = list(dict.fromkeys(text.strip() for translatable, text in split_translation_segments(blocks) if translatable))
+                if not cores: continue
+                cached, calls, input_tokens, output_tokens = estimate_translation_calls(cores, target_language, SEGMENT_TRANSLATION_PROMPT, TRANSLATION_PROMPT)
+                entry['chunks'] += 1
+                entry['segments'] += len(cores); entry['cached_segments'] += cached
+                entry['api_calls'] += calls; entry['input_tokens'] += input_tokens; entry['output_tokens'] += output_tokens
+        for name in totals: totals[name] += entry[name]
+        render_chars += len(md_content) * {'original': 1, 'translated': 1, 'bilingual': 4}.get(export_mode, 1)
+        per_file.append(entry)
+
+    filename_calls = 0
+    if translate and per_file and checkpoint.filenames is None:
+        stems = list(dict.fromkeys(pathlib.PurePosixPath(f).stem for f in files))
+        for i in range(0, len(stems), FILENAME_BATCH_SIZE):
+            _, calls, input_tokens, output_tokens = estimate_translation_calls(stems[i:i + FILENAME_BATCH_SIZE], target_language, FILENAME_BATCH_TRANSLATION_PROMPT, FILENAME_TRANSLATION_PROMPT)
+            filename_calls += calls; totals['input_tokens'] += input_tokens; totals['output_tokens'] += output_tokens
+    totals['api_calls'] += filename_calls
+
+    ai_rate, render_rate = THROUGHPUT_HISTORY.rate('ai_tokens'), THROUGHPUT_HISTORY.rate('render_chars')
+    seconds_per_token = ai_rate if ai_rate is not None else ESTIMATE_DEFAULT_AI_SECONDS_PER_1K_TOKENS / 1000
+    seconds_per_char = render_rate if render_rate is not None else ESTIMATE_DEFAULT_RENDER_SECONDS_PER_1K_CHARS / 1000
+    # Calls in flight: chunks of several files at once, up to what the AI backends accept; per-minute budgets may cap it further
+    concurrency = max(1, min(TRANSLATION_WORKERS * TRANSLATION_MAX_CONCURRENCY, sum(e.max_concurrency for e in AI_CLIENT.endpoints), totals['api_calls'] or 1))
+    translation_seconds = (totals['input_tokens'] + totals['output_tokens']) * seconds_per_token / concurrency
+    requests_per_minute = sum(e.request_bucket.capacity for e in AI_CLIENT.endpoints) if all(e.request_bucket.capacity for e in AI_CLIENT.endpoints) else 0
+    tokens_per_minute = sum(e.token_bucket.capacity for e in AI_CLIENT.endpoints) if all(e.token_bucket.capacity for e in AI_CLIENT.endpoints) else 0
+    if requests_per_minute: translation_seconds = max(translation_seconds, 60 * totals['api_calls'] / requests_per_minute)
+    if tokens_per_minute: translation_seconds = max(translation_seconds, 60 * (totals['input_tokens'] + totals['output_tokens']) / tokens_per_minute)
+    render_seconds = render_chars * seconds_per_char / max(RENDER_WORKERS, 1)
+    cost = None
+    if AI_PRICE_PER_1K_INPUT_TOKENS or AI_PRICE_PER_1K_OUTPUT_TOKENS:
+        cost = round((totals['input_tokens'] * AI_PRICE_PER_1K_INPUT_TOKENS + totals['output_tokens'] * AI_PRICE_PER_1K_OUTPUT_TOKENS) / 1000, 4)
+    return {'files': len(files), 'files_to_process': len(per_file), 'files_done': len(files) - len(per_file), **totals, 'filename_api_calls': filename_calls,
+            'estimated_cost': cost, 'concurrency': concurrency,
+            # Translation and rendering overlap in the pipeline, so the slower stage sets the pace
+            'estimated_seconds': {'translation': round(translation_seconds, 1), 'render': round(render_seconds, 1), 'total': round(max(translation_seconds, render_seconds), 1)},
+            'rates': {'ai_seconds_per_1k_tokens': round(seconds_per_token * 1000, 3), 'render_seconds_per_1k_chars': round(seconds_per_char * 1000, 3),
+                      'measured': {'ai': ai_rate is not None, 'render': render_rate is not None}},
+            'per_file': per_file}
+
+class ZipStreamSink:
+    """Write-only file for zipfile that collects the archive's bytes until the response takes them."""
+    def __init__(self): self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self): pass
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+def stream_result_zip(task_id, result_dir):
+    """Yields a ZIP of the task's result folder, adding each file once it is complete, while the task is running.
+
+    Output files are written under a temporary name and renamed when done, so every file found is whole. zipfile
+    writes to the unseekable response using data descriptors, so nothing is buffered beyond one chunk.
+    """
+    sink, sent = ZipStreamSink(), set()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        while True:
+            # The state is read before the folder, so once the task has ended the last scan sees all of its files
+            running = (TASK_STORE.get(task_id) or {}).get('state') in ('RUNNING', 'PROGRESS')
+            found = {os.path.join(root, name) for root, _, names in os.walk(result_dir) for name in names if not name.endswith('.part')}
+            for path in sorted(found - sent):
+                sent.add(path)
+                info = zipfile.ZipInfo.from_file(path, os.path.relpath(path, result_dir))
+                info.compress_type = zipfile.ZIP_STORED if info.filename.lower().endswith(RESULT_STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+                with stage_span('download') as span, open(path, 'rb') as source, archive.open(info, 'w') as entry:
+                    while chunk := source.read(RESULT_STREAM_CHUNK_BYTES):
+                        entry.write(chunk)
+                        yield sink.take()
+                    span['bytes'] = info.file_size
+            if not running: break
+            time.sleep(RESULT_STREAM_SCAN_SECONDS)
+    yield sink.take()
+
 def run_conversion_thread(task_id, style_options, target_language, export_mode):
     threading.current_thread().name = f"conversion_thread_{task_id}"
     import pandas as pd
-    import pypandoc
-    import weasyprint
 
-    with TASKS_LOCK: task_dir = TASKS.get(task_id, {}).get('task_dir')
+    task_dir = (TASK_STORE.get(task_id) or {}).get('task_dir')
     if not task_dir: return
 
+    translate_executor = ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS, thread_name_prefix=f"conversion_thread_{task_id}_translate")
+    control_changed = task_control_event(task_id)
     try:
-        source_dir = os.path.join(task_dir, 'source')
+        source = get_task_source(task_dir)
         result_dir = os.path.join(task_dir, 'result')
-        files = [os.path.join(dp, f) for dp, dn, fn in os.walk(source_dir) for f in fn if f.lower().endswith('.md') and not f.startswith('._')]
+        files = source.list_markdown()
         if not files: raise ValueError("No .md files found.")
 
-        total_files, report_results = len(files), []
-        custom_css = weasyprint.CSS(string=get_css_style(style_options))
-        pypandoc_args = [f'--highlight-style={style_options.get("code_theme", "kate")}']
-
-        for i, file_path in enumerate(sorted(files)):
-            # --- Task Control Check ---
-            with TASKS_LOCK:
-                task_state = TASKS[task_id].get('state')
-                if task_state == 'STOPPING':
-                    update_task_status(task_id, state='STOPPED', log='任务已被用户手动结束。')
-                    return
-                while task_state == 'PAUSED':
-                    time.sleep(1)
-                    task_state = TASKS[task_id].get('state')
-            # --- End Task Control Check ---
-
-            rel_path = os.path.relpath(file_path, source_dir)
-            progress = 10 + int((i / total_files) * 80)
-            update_task_status(task_id, 'RUNNING', progress=progress, log=f"({i+1}/{total_files}) Processing: {rel_path}")
-
-            md_content = read_file_with_fallback(file_path)
-            original_filename_stem = pathlib.Path(file_path).stem
-            file_report = {"Original Filename": pathlib.Path(file_path).name, "Translated Filename": "N/A", "Original Pages": "N/A", "Translated Pages": "N/A", "Bilingual Pages": "N/A"}
+        total_files, reports, failed_files = len(files), {}, []
+        os.makedirs(result_dir, exist_ok=True)
+        checkpoint = TaskCheckpoint(task_dir, {'style_options': style_options, 'target_language': target_language, 'export_mode': export_mode})
+        pending = [i for i, rel_path in enumerate(files) if rel_path not in checkpoint.completed]
+        for i, rel_path in enumerate(files):
+            if rel_path in checkpoint.completed: reports[i] = checkpoint.completed[rel_path]
+        if reports: update_task_status(task_id, log=f"Resuming from checkpoint: {len(reports)} of {total_files} files already done.")
+
+        translated_stems, task_spans = {}, []
+        if export_mode in ['translated', 'bilingual'] and pending:
+            if checkpoint.filenames is not None and all(rel_path in checkpoint.filenames for rel_path in files):
+                translated_stems = checkpoint.filenames
+            else:
+                update_task_status(task_id, log=f"Translating {total_files} file names in batches...")
+                with stage_span('filenames') as span:
+                    stem_translations = translate_filenames(task_id, [pathlib.PurePosixPath(f).stem for f in files], target_language)
+                task_spans.append(span)
+                # Two files in one folder must not end up with the same translated name
+                used_names = set()
+                for rel_path in files:
+                    folder, base_name = posixpath.dirname(rel_path), stem_translations[pathlib.PurePosixPath(rel_path).stem]
+                    name, n = base_name, 2
+                    while (folder, name.lower()) in used_names: name, n = f"{base_name}_{n}", n + 1
+                    used_names.add((folder, name.lower()))
+                    translated_stems[rel_path] = name
+                checkpoint.save_filenames(translated_stems)
+
+        def with_retries(rel_path, stage, fn):
+            for attempt in range(FILE_MAX_RETRIES + 1):
+                try: return fn()
+                except Exception as e:
+                    if attempt == FILE_MAX_RETRIES: raise
+                    update_task_status(task_id, log=f"  -> ⚠️ {stage} of '{rel_path}' failed ({e}); retrying ({attempt + 1}/{FILE_MAX_RETRIES})...")
+
+        def wait_for_stage(future):
+            """Waits for a pipeline stage while honouring pause and stop; False once the task has been stopped."""
+            future.add_done_callback(lambda _: control_changed.set())
+            while not future.done():
+                if not check_task_control(task_id): return False
+                control_changed.wait(TASK_EVENT_POLL_SECONDS)
+            return True
+
+        def translate_stage(i):
+            # Queued translations hold off while the task is paused and are dropped once it is stopped
+            if not wait_while_paused(task_id): raise TaskStopped("Task was stopped")
+            rel_path = files[i]
+            update_task_status(task_id, log=f"({i+1}/{total_files}) Processing: {rel_path}")
+
+            with recording_spans() as spans:
+                job, file_report = translate_file(rel_path)
+            file_report.update(span_report(spans))
+            return job, file_report
+
+        def translate_file(rel_path):
+            with stage_span('read') as span:
+                md_content = source.read_text(rel_path)
+                span['bytes'] = len(md_content.encode('utf-8'))
+            original_filename_stem = pathlib.PurePosixPath(rel_path).stem
+            file_report = {"Original Filename": pathlib.PurePosixPath(rel_path).name, "Translated Filename": "N/A", "Original Pages": "N/A", "Translated Pages": "N/A", "Bilingual Pages": "N/A"}
 
             translated_md = ""
             translated_filename_stem = original_filename_stem
-            
+
             if export_mode in ['translated', 'bilingual']:
-                translated_md = translate_text_via_api(task_id, md_content, target_language, TRANSLATION_PROMPT, log_id=rel_path)
-                translated_filename_stem_raw = translate_text_via_api(task_id, original_filename_stem, target_language, FILENAME_TRANSLATION_PROMPT, log_id=f"filename: {original_filename_stem}")
-                translated_filename_stem = sanitize_filename(translated_filename_stem_raw)
+                translated_md = checkpoint.load_translation(rel_path)
+                if translated_md is None:
+                    with stage_span('translate') as span:
+                        translated_md = with_retries(rel_path, "Translation", lambda: translate_markdown_document(task_id, md_content, target_language, log_id=rel_path))
+                        span['bytes'] = len(translated_md.encode('utf-8'))
+                    checkpoint.save_translation(rel_path, translated_md)
+                translated_filename_stem = translated_stems[rel_path]
                 file_report["Translated Filename"] = translated_filename_stem + ".pdf"
-            
-            # --- Generate Original PDF ---
-            if export_mode in ['original', 'bilingual']:
-                original_pdf_path = os.path.join(result_dir, 'original_pdfs', os.path.splitext(rel_path)[0] + '.pdf')
-                os.makedirs(os.path.dirname(original_pdf_path), exist_ok=True)
-                html = pypandoc.convert_text(preprocess_markdown_images(md_content, os.path.dirname(file_path)), 'html', format='markdown+latex_macros', extra_args=pypandoc_args)
-                weasyprint.HTML(string=f'<html><body>{html}</body></html>').write_pdf(original_pdf_path, stylesheets=[custom_css])
-                file_report["Original Pages"] = get_pdf_page_count(original_pdf_path)
-
-            # --- Generate Translated PDF ---
-            if export_mode in ['translated', 'bilingual']:
-                translated_pdf_path = os.path.join(result_dir, 'translated_pdfs', os.path.dirname(rel_path), translated_filename_stem + '.pdf')
-                os.makedirs(os.path.dirname(translated_pdf_path), exist_ok=True)
-                html = pypandoc.convert_text(preprocess_markdown_images(translated_md, os.path.dirname(file_path)), 'html', format='markdown+latex_macros', extra_args=pypandoc_args)
-                weasyprint.HTML(string=f'<html><body>{html}</body></html>').write_pdf(translated_pdf_path, stylesheets=[custom_css])
-                file_report["Translated Pages"] = get_pdf_page_count(translated_pdf_path)
-
-            # --- Generate Bilingual PDF ---
-            if export_mode == 'bilingual':
-                bilingual_pdf_path = os.path.join(result_dir, 'bilingual_pdfs', os.path.dirname(rel_path), translated_filename_stem + '.pdf')
-                os.makedirs(os.path.dirname(bilingual_pdf_path), exist_ok=True)
-                
-                original_paras = md_content.split('\n\n')
-                translated_paras = translated_md.split('\n\n')
-                
-                bilingual_html_rows = ""
-                num_paras = max(len(original_paras), len(translated_paras))
-                for para_idx in range(num_paras):
-                    original_para = original_paras[para_idx] if para_idx < len(original_paras) else ""
-                    translated_para = translated_paras[para_idx] if para_idx < len(translated_paras) else ""
 
-                    if not original_para.strip() and not translated_para.strip(): continue
-                    
-                    original_html = pypandoc.convert_text(preprocess_markdown_images(original_para, os.path.dirname(file_path)), 'html', format='markdown+latex_macros', extra_args=pypandoc_args)
-                    translated_html = pypandoc.convert_text(preprocess_markdown_images(translated_para, os.path.dirname(file_path)), 'html', format='markdown+latex_macros', extra_args=pypandoc_args)
-                    bilingual_html_rows += f"<tr><td>{original_html}</td><td>{translated_html}</td></tr>"
-                
-                full_bilingual_html = f'<html><body><table class="bilingual-table">{bilingual_html_rows}</table></body></html>'
-                weasyprint.HTML(string=full_bilingual_html).write_pdf(bilingual_pdf_path, stylesheets=[custom_css])
-                file_report["Bilingual Pages"] = get_pdf_page_count(bilingual_pdf_path)
+            job = {'source': source, 'rel_path': rel_path, 'result_dir': result_dir, 'export_mode': export_mode, 'style_options': style_options,
+                   'md_content': md_content, 'translated_md': translated_md, 'translated_filename_stem': translated_filename_stem}
+            return job, file_report
+
+        def file_finished(i, file_report):
+            reports[i] = file_report
+            checkpoint.mark_done(files[i], file_report)
+            update_task_status(task_id, progress=10 + int((len(reports) / total_files) * 80))
+
+        def file_failed(i, error):
+            if FILE_ERROR_POLICY != 'skip': raise error
+            rel_path = files[i]
+            reports[i] = {"Original Filename": pathlib.PurePosixPath(rel_path).name, "Error": str(error)}
+            failed_files.append(rel_path)
+            checkpoint.mark_failed(rel_path, str(error))
+            update_task_status(task_id, progress=10 + int((len(reports) / total_files) * 80), log=f"  -> ❌ '{rel_path}' failed and was skipped: {error}")
+
+        # Translations run up to `window` files ahead of the file currently handed to the render stage
+        window = TRANSLATION_WORKERS + max(RENDER_WORKERS, 1)
+        translation_futures, render_futures, next_to_translate = {}, deque(), 0
+
+        def collect_render_result(block):
+            future, i, job, file_report, attempt = render_futures[0]
+            if block and not wait_for_stage(future): return False
+            if not future.done(): return True
+            render_futures.popleft()
+            if future.exception() is None:
+                rendered = future.result()
+                # Spans timed in a render worker process were not seen by this process's metrics yet
+                if rendered['pid'] != os.getpid():
+                    for span in rendered['spans']: observe_span(span)
+                file_report.update(rendered['report'])
+                if rendered['report'].get("Overflowing Elements"):
+                    update_task_status(task_id, log=f"  -> ⚠️ '{files[i]}': {rendered['report']['Overflowing Elements']} element(s) run past the right page edge.")
+                for column, value in span_report(rendered['spans']).items(): file_report[column] = round(file_report.get(column, 0) + value, 3)
+                file_finished(i, file_report)
+            elif attempt < FILE_MAX_RETRIES:
+                update_task_status(task_id, log=f"  -> ⚠️ Rendering of '{files[i]}' failed ({future.exception()}); retrying ({attempt + 1}/{FILE_MAX_RETRIES})...")
+                render_futures.appendleft((submit_render_job(job), i, job, file_report, attempt + 1))
+            else:
+                file_failed(i, future.exception())
+            return True
 
-            report_results.append(file_report)
+        for position, i in enumerate(pending):
+            # --- Task Control Check ---
+            if not check_task_control(task_id): return
+            while next_to_translate < len(pending) and next_to_translate < position + window:
+                translation_futures[next_to_translate] = translate_executor.submit(translate_stage, pending[next_to_translate])
+                next_to_translate += 1
+
+            if not wait_for_stage(translation_futures[position]): return
+            try: job, file_report = translation_futures.pop(position).result()
+            except Exception as e:
+                if not check_task_control(task_id): return
+                file_failed(i, e)
+                continue
+            if not check_task_control(task_id): return
+            render_futures.append((submit_render_job(job), i, job, file_report, 0))
+
+            while render_futures and render_futures[0][0].done():
+                collect_render_result(block=False)
+
+        while render_futures:
+            if not collect_render_result(block=True): return
 
         update_task_status(task_id, 'PROGRESS', progress=95, log="Generating summary report...")
-        pd.DataFrame(report_results).to_csv(os.path.join(result_dir, "translation_summary.csv"), index=False, encoding='utf_8_sig')
-
-        update_task_status(task_id, 'PROGRESS', progress=98, log="Compressing results...")
-        zip_filename = f"Translated_Results_{task_id[:8]}.zip"
-        zip_path = os.path.join(task_dir, zip_filename)
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk(result_dir):
-                for file in files:
-                    zipf.write(os.path.join(root, file), os.path.relpath(os.path.join(root, file), result_dir))
-        
-        update_task_status(task_id, 'SUCCESS', progress=100, log="🎉 Task complete! Your download is ready.", result_url=f"/download/{task_id}")
+        summary = [reports[i] for i in sorted(reports)]
+        # The last row totals the task: pages, layout stats and stage times summed over the files, plus the task-level stages
+        timings = span_report(task_spans)
+        for report in summary:
+            for column in [*STAGE_REPORT_COLUMNS.values(), 'PDF Bytes']:
+                if column in report: timings[column] = round(timings.get(column, 0) + report[column], 3)
+        totals = {column: sum(r[column] for r in summary if isinstance(r.get(column), int)) for column in ("Original Pages", "Translated Pages", "Bilingual Pages", "Images", "Overflowing Elements")
+                 if any(isinstance(r.get(column), int) for r in summary)}
+        summary_path = os.path.join(result_dir, "translation_summary.csv")
+        pd.DataFrame(summary + [{"Original Filename": "TOTAL", **totals, **timings}]).to_csv(summary_path + '.part', index=False, encoding='utf_8_sig')
+        os.replace(summary_path + '.part', summary_path)
+
+        if len(failed_files) == total_files:
+            update_task_status(task_id, 'FAILURE', progress=100, error=f"All {total_files} file(s) failed; see translation_summary.csv. Use Resume to retry them.", failed_files=failed_files, timings=timings)
+        elif failed_files:
+            update_task_status(task_id, 'PARTIAL', progress=100, log=f"⚠️ Task finished, but {len(failed_files)} of {total_files} file(s) failed and are missing from the results; use Resume to retry only those files.",
+                               result_url=f"/download/{task_id}", failed_files=failed_files, timings=timings)
+        else:
+            update_task_status(task_id, 'SUCCESS', progress=100, log="🎉 Task complete! Your download is ready.", result_url=f"/download/{task_id}", failed_files=failed_files, timings=timings)
 
     except Exception as e:
         traceback.print_exc()
         update_task_status(task_id, 'FAILURE', error=str(e))
+    finally:
+        translate_executor.shutdown(wait=False, cancel_futures=True)
+        TASK_CONTROL_EVENTS.pop(task_id, None)
+
+def start_task_thread(task_id, params, log=None, state='QUEUED', expected=None, progress=None):
+    """Queues a (re)start of a batch run in this process; files already in the task's checkpoint are skipped.
+
+    expected is the task as the caller read it when deciding to start it. Raises SchedulerBusy if the scheduler
+    refuses new work, and TaskConflict if the task has changed since (e.g. a second /resume got there first);
+    neither touches the task.
+    """
+    reason = JOB_SCHEDULER.admission_error('batch')
+    if reason: raise SchedulerBusy(reason)
+    task = expected or TASK_STORE.get(task_id)
+    # No runner means nobody is running it; the claim is what makes a start exclusive
+    if not TASK_STORE.claim(task_id, task.get('runner'), task.get('updated')): raise TaskConflict("Task is already being started or run.")
+    TASK_STORE.update(task_id, {'error': None, 'result_url': None, 'failed_files': [], 'timings': None})
+    update_task_status(task_id, state, progress=progress, log=log, params=params)
+
+    def run():
+        state = TASK_STORE.get(task_id).get('state')
+        if state == 'STOPPING': return update_task_status(task_id, state='STOPPED', log='任务已被用户手动结束。')
+        if state == 'QUEUED': update_task_status(task_id, 'RUNNING', queue_position=0)
+        run_conversion_thread(task_id, params['style_options'], params['target_language'], params['export_mode'])
+
+    def report_position(position):
+        update_task_status(task_id, queue_position=position, log=f"Queued: position {position} in line.")
+
+    try: JOB_SCHEDULER.submit('batch', task.get('user', 'anonymous'), run, job_id=task_id, on_position=report_position)
+    except SchedulerBusy as e:
+        update_task_status(task_id, 'FAILURE', error=str(e))
+        raise
+
+def recover_interrupted_tasks():
+    """Takes over tasks whose owning process has died (e.g. a restart) and resumes them with their stored parameters."""
+    heartbeats = TASK_STORE.heartbeats()
+    for task_id, task in TASK_STORE.find(ACTIVE_STATES).items():
+        if runner_alive(task.get('runner'), heartbeats) or not TASK_STORE.claim(task_id, task.get('runner')): continue
+        params = task.get('params')
+        if task['state'] == 'STOPPING':
+            update_task_status(task_id, state='STOPPED', log='任务已被用户手动结束。')
+        elif not params or not os.path.isdir(task.get('task_dir') or ''):
+            update_task_status(task_id, state='FAILURE', error='The service restarted and the task could not be resumed.')
+        else:
+            # A paused task gets its thread back but stays paused until the user resumes it
+            try: start_task_thread(task_id, params, log='Service restarted; resuming the interrupted task.', state='PAUSED' if task['state'] == 'PAUSED' else 'QUEUED')
+            except (SchedulerBusy, TaskConflict): pass  # left as it is; it can be resumed by hand
+
+TASK_RECOVERY_PID = None
+TASK_RECOVERY_LOCK = threading.Lock()
+
+def prune_finished_tasks():
+    """Deletes tasks that finished more than TASK_RETENTION_DAYS ago, together with their upload and results."""
+    if not TASK_RETENTION_DAYS: return
+    output_dir = os.path.realpath(OUTPUT_DIR)
+    for task_id, task in TASK_STORE.find(TERMINAL_STATES, updated_before=time.time() - TASK_RETENTION_DAYS * 86400).items():
+        TASK_STORE.delete(task_id)
+        task_dir = os.path.realpath(task.get('task_dir') or output_dir)
+        if os.path.dirname(task_dir) == output_dir: shutil.rmtree(task_dir, ignore_errors=True)
+
+def heartbeat_loop():
+    """Keeps this process's heartbeat fresh, takes over tasks of owners whose heartbeat has gone stale meanwhile,
+    and every TASK_PRUNE_INTERVAL_SECONDS drops finished tasks past their retention."""
+    pruned = 0
+    while True:
+        time.sleep(TASK_HEARTBEAT_SECONDS)
+        try:
+            TASK_STORE.heartbeat()
+            recover_interrupted_tasks()
+            if time.time() - pruned >= TASK_PRUNE_INTERVAL_SECONDS: prune_finished_tasks(); pruned = time.time()
+        except Exception: traceback.print_exc()
+
+@app.before_request
+def recover_tasks_once():
+    # Runs in each worker process on its first request, so it also works under gunicorn without __main__
+    global TASK_RECOVERY_PID
+    if TASK_RECOVERY_PID == os.getpid(): return
+    with TASK_RECOVERY_LOCK:
+        if TASK_RECOVERY_PID == os.getpid(): return
+        TASK_RECOVERY_PID = os.getpid()
+        TASK_STORE.heartbeat()
+        recover_interrupted_tasks()
+        threading.Thread(target=heartbeat_loop, name='task_heartbeat', daemon=True).start()
 
 @app.route('/')
 def index():
@@ -776,10 +3116,12 @@ def prepare_upload():
     task_dir = os.path.join(OUTPUT_DIR, task_id)
     source_dir = os.path.join(task_dir, 'source')
     os.makedirs(source_dir, exist_ok=True)
-    with TASKS_LOCK: TASKS[task_id] = {'task_dir': task_dir, 'state': 'PREPARING'}
+    TASK_STORE.create(task_id, task_dir=task_dir, state='PREPARING', user=client_id())
     preview_files = []
     
-    upload_type = request.form.get('upload_type')
+    # ZIPs may be posted as the raw request body (streamed straight to disk) or as a multipart field
+    raw_zip = request.mimetype in ('application/zip', 'application/x-zip-compressed', 'application/octet-stream')
+    upload_type = request.args.get('upload_type', 'zip') if raw_zip else request.form.get('upload_type')
     if upload_type == 'folder':
         files = request.files.getlist("files[]")
         if not files: return jsonify({'error': 'No folder content selected'}), 400
@@ -789,55 +3131,100 @@ def prepare_upload():
             destination_path = os.path.join(source_dir, safe_relative_path)
             if not os.path.abspath(destination_path).startswith(os.path.abspath(source_dir)): continue
             os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-            file.save(destination_path)
+            save_upload(file, destination_path)
     elif upload_type == 'file':
         file = request.files.get('file')
         if not file or not file.filename.lower().endswith('.md'): return jsonify({'error': 'Please upload a single .md file'}), 400
         filename = secure_filename(file.filename)
         destination_path = os.path.join(source_dir, filename)
-        file.save(destination_path)
+        save_upload(file, destination_path)
         preview_files.append(filename) # Explicitly add the single file
     else: # zip
-        file = request.files.get('zipfile')
-        if not file or not file.filename.lower().endswith('.zip'): return jsonify({'error': 'Please upload a ZIP file'}), 400
         zip_path = os.path.join(task_dir, 'source.zip')
-        file.save(zip_path)
-        unzip_with_encoding_fix(zip_path, source_dir)
+        if raw_zip:
+            with open(zip_path, 'wb') as f: shutil.copyfileobj(request.stream, f, 1024 * 1024)
+        else:
+            file = request.files.get('zipfile')
+            if not file or not file.filename.lower().endswith('.zip'): return jsonify({'error': 'Please upload a ZIP file'}), 400
+            save_upload(file, zip_path)
+        # The archive is kept and read lazily; nothing is extracted up front
+        started = time.time()
+        try:
+            stats = get_task_source(task_dir).stats()
+        except (ValueError, zipfile.BadZipFile) as e:
+            shutil.rmtree(task_dir, ignore_errors=True)
+            TASK_STORE.delete(task_id)
+            return jsonify({'error': f'Invalid ZIP archive: {e}'}), 400
+        update_task_status(task_id, log=f"Indexed ZIP archive: {stats['markdown_files']} Markdown files among {stats['members']} entries "
+                                        f"({stats['bytes'] / (1024 * 1024):.1f} MB uncompressed) in {(time.time() - started) * 1000:.0f} ms")
     
     # If preview_files is not already populated (i.e., not a single file upload)
     if not preview_files:
-        preview_files = [os.path.relpath(os.path.join(dp, f), source_dir) for dp, _, fn in os.walk(source_dir) for f in sorted(fn) if f.lower().endswith('.md') and not f.startswith('._')]
+        preview_files = get_task_source(task_dir).list_markdown()
     
     update_task_status(task_id, 'READY', preview_files=preview_files)
     return jsonify({'task_id': task_id, 'preview_files': preview_files})
 
 def generate_preview_pdf(task_id, rel_path, style_options, content_modifier=None):
-    import pypandoc
-    import weasyprint
-
-    with TASKS_LOCK: task_dir = TASKS.get(task_id, {}).get('task_dir')
+    task_dir = (TASK_STORE.get(task_id) or {}).get('task_dir')
     if not task_dir: raise FileNotFoundError("Invalid task ID.")
     
-    source_file_abs = os.path.join(task_dir, 'source', rel_path)
-    if not os.path.normpath(source_file_abs).startswith(os.path.normpath(os.path.join(task_dir, 'source'))):
-        raise PermissionError("Path traversal attempt detected.")
-
-    md_content = read_file_with_fallback(source_file_abs)
+    source = get_task_source(task_dir)
+    md_content = source.read_text(rel_path)
     
     if content_modifier: # For translation
         md_content = content_modifier(md_content)
 
-    processed_md = preprocess_markdown_images(md_content, os.path.dirname(source_file_abs))
-    html_body = pypandoc.convert_text(source=processed_md, to='html', format='markdown+latex_macros', extra_args=[f'--highlight-style={style_options.get("code_theme", "kate")}'])
-    css = weasyprint.CSS(string=get_css_style(style_options))
-    return weasyprint.HTML(string=f'<html><body>{html_body}</body></html>').write_pdf(stylesheets=[css])
+    html_body = markdown_to_html(md_content, source, posixpath.dirname(rel_path), style_options)
+    return html_to_pdf(f'<html><body>{html_body}</body></html>', get_css_style(style_options))
+
+def generate_progressive_preview(task_id, rel_path, style_options, target_language, emit, cancel=None):
+    """Renders the translated preview as it is translated: emit(pdf_bytes) gets a PDF of the translated beginning
+    of the document whenever it has grown (at most once per PREVIEW_REFRESH_SECONDS), then the finished PDF.
+    Setting cancel (the client went away, or asked for a newer preview) stops the translation and raises TaskStopped."""
+    task_dir = (TASK_STORE.get(task_id) or {}).get('task_dir')
+    if not task_dir: raise FileNotFoundError("Invalid task ID.")
+    source = get_task_source(task_dir)
+    md_content = source.read_text(rel_path)
+    css = get_css_style(style_options)
+
+    def render(md, partial=False):
+        html = markdown_to_html(md, source, posixpath.dirname(rel_path), style_options, store=not partial)
+        return html_to_pdf(f'<html><body>{html}</body></html>', css, lookup=not partial, store=not partial)
+
+    latest, changed = [None], threading.Event()
+    def on_progress(markdown): latest[0] = markdown; changed.set()
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview_translate') as executor:
+        future = executor.submit(translate_markdown_document, task_id, md_content, target_language, log_id=rel_path, on_progress=on_progress, cancel=cancel)
+        future.add_done_callback(lambda _: changed.set())
+        rendered = None
+        while not future.done():
+            changed.wait(); changed.clear()
+            if future.done() or (cancel is not None and cancel.is_set()) or not latest[0] or latest[0] == rendered: continue
+            rendered = latest[0]
+            # Partial frames are rendered once and thrown away, so they stay out of the render caches. A half-translated
+            # document may not render (e.g. a table cut short); the next update will
+            try: emit(render(rendered, partial=True))
+            except Exception: traceback.print_exc()
+            futures_wait([future], timeout=PREVIEW_REFRESH_SECONDS)
+        emit(render(future.result()))
+
+PREVIEW_CANCELS = {}  # (client, task_id) -> cancel event of that client's running progressive preview
+PREVIEW_CANCELS_LOCK = threading.Lock()
+
+def preview_frame(kind, payload):
+    """One frame of a progressive preview stream: a kind byte (b'P' = PDF, b'E' = error text), a 4-byte length, the payload."""
+    return kind + len(payload).to_bytes(4, 'big') + payload
 
 @app.route('/preview/original', methods=['POST'])
 def preview_original():
     try:
         data = request.get_json()
-        pdf_bytes = generate_preview_pdf(data['task_id'], data['preview_file'], data['style_options'])
+        pdf_bytes = JOB_SCHEDULER.run('preview', client_id(), lambda: generate_preview_pdf(data['task_id'], data['preview_file'], data['style_options']))
         return Response(pdf_bytes, mimetype='application/pdf')
+    except SchedulerBusy as e:
+        return Response(str(e), status=503, mimetype='text/plain', headers={'Retry-After': '10'})
     except Exception as e:
         traceback.print_exc()
         return Response(f"Error: {e}", status=500, mimetype='text/plain')
@@ -848,39 +3235,83 @@ def preview_translated():
         data = request.get_json()
         
         def translate_modifier(content):
-            return translate_text_via_api(data['task_id'], content, data['target_language'], TRANSLATION_PROMPT, log_id=data['preview_file'])
-
-        pdf_bytes = generate_preview_pdf(data['task_id'], data['preview_file'], data['style_options'], content_modifier=translate_modifier)
+            return translate_markdown_document(data['task_id'], content, data['target_language'], log_id=data['preview_file'])
+
+        if data.get('progressive'):
+            # Streams a PDF frame for each rendered update; the last PDF frame is the finished preview
+            frames, cancel, key = queue.Queue(), threading.Event(), (client_id(), data['task_id'])
+            job = JOB_SCHEDULER.submit('preview', key[0], lambda: generate_progressive_preview(
+                data['task_id'], data['preview_file'], data['style_options'], data['target_language'], lambda pdf: frames.put(preview_frame(b'P', pdf)), cancel=cancel))
+            job.add_done_callback(lambda _: frames.put(None))
+            # A newer preview of the same task supersedes this client's older one, which is then cancelled
+            with PREVIEW_CANCELS_LOCK: previous, PREVIEW_CANCELS[key] = PREVIEW_CANCELS.get(key), cancel
+            if previous: previous.set()
+
+            def stream():
+                try:
+                    while (frame := frames.get()) is not None: yield frame
+                    if not job.cancelled() and job.exception() and not cancel.is_set(): yield preview_frame(b'E', str(job.exception()).encode('utf-8'))
+                finally:  # also runs when the client disconnects and the server closes the stream
+                    cancel.set()
+                    with PREVIEW_CANCELS_LOCK:
+                        if PREVIEW_CANCELS.get(key) is cancel: del PREVIEW_CANCELS[key]
+
+            return Response(stream(), mimetype='application/octet-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        pdf_bytes = JOB_SCHEDULER.run('preview', client_id(), lambda: generate_preview_pdf(data['task_id'], data['preview_file'], data['style_options'], content_modifier=translate_modifier))
         return Response(pdf_bytes, mimetype='application/pdf')
+    except SchedulerBusy as e:
+        return Response(str(e), status=503, mimetype='text/plain', headers={'Retry-After': '10'})
     except Exception as e:
         traceback.print_exc()
         return Response(f"Error: {e}", status=500, mimetype='text/plain')
 
+@app.route('/estimate', methods=['POST'])
+def estimate_conversion():
+    data = request.get_json()
+    task = TASK_STORE.get(data.get('task_id') or '')
+    if not task or not task.get('task_dir'): return jsonify({'error': 'Invalid Task ID'}), 404
+    params = {'style_options': data.get('style_options', {}), 'target_language': data.get('target_language'), 'export_mode': data.get('export_mode', 'translated')}
+    return jsonify(estimate_batch(task['task_dir'], params))
+
 @app.route('/start_conversion', methods=['POST'])
 def start_conversion():
     data = request.get_json()
     task_id = data.get('task_id')
-    if not task_id or task_id not in TASKS: return jsonify({'error': 'Invalid Task ID'}), 404
+    task = TASK_STORE.get(task_id) if task_id else None
+    if not task: return jsonify({'error': 'Invalid Task ID'}), 404
     
-    mode_text = {'translated': '仅译文', 'original': '仅原文', 'bilingual': '双语对照 + 单独译文'}.get(data.get('export_mode'), '未知')
+    export_mode = data.get('export_mode', 'translated')
+    mode_text = {'translated': '仅译文', 'original': '仅原文', 'bilingual': '双语对照 + 单独译文'}.get(export_mode)
+    if not mode_text: return jsonify({'error': f"Unknown export mode: {export_mode!r}"}), 400
     log_message = f"任务已启动 (ID: {task_id}, 模式: {mode_text})"
-    update_task_status(task_id, 'RUNNING', progress=0, log=log_message)
-    
-    threading.Thread(target=run_conversion_thread, args=(
-        task_id, 
-        data.get('style_options', {}), 
-        data.get('target_language'),
-        data.get('export_mode', 'translated')
-    )).start()
+    # The parameters are stored with the task so it can be resumed if this process goes away
+    params = {'style_options': data.get('style_options', {}), 'target_language': data.get('target_language'), 'export_mode': export_mode}
+    if task.get('state') in ACTIVE_STATES: return jsonify({'error': 'Task is already running'}), 409
+    try: start_task_thread(task_id, params, log=log_message, expected=task, progress=0)
+    except SchedulerBusy as e: return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+    except TaskConflict as e: return jsonify({'error': str(e)}), 409
     return jsonify({'task_id': task_id, 'message': 'Process started.'})
 
 @app.route('/<action>/<task_id>', methods=['POST'])
 def control_task_endpoint(action, task_id):
-    if task_id not in TASKS:
+    task = TASK_STORE.get(task_id)
+    if not task:
         return jsonify({'error': 'Invalid Task ID'}), 404
     
-    if action == 'pause':
+    if task.get('state') == 'QUEUED' and action in ('pause', 'resume'):
+        return jsonify({'error': 'Task is still queued; stop it instead'}), 409
+    elif task.get('state') == 'QUEUED' and action == 'stop' and JOB_SCHEDULER.cancel(task_id):
+        update_task_status(task_id, state='STOPPED', log='任务已被用户手动结束。')
+    elif action == 'pause':
         update_task_status(task_id, state='PAUSED', log='任务已暂停。')
+    elif action == 'resume' and task.get('state') in ('FAILURE', 'STOPPED', 'PARTIAL', 'SUCCESS'):
+        # A finished run is restarted from its checkpoint: completed files are skipped, failed ones retried
+        if not task.get('params'): return jsonify({'error': 'Task has not been started yet'}), 409
+        if task['state'] == 'SUCCESS' and not task.get('failed_files'): return jsonify({'error': 'Task already completed'}), 409
+        try: start_task_thread(task_id, task['params'], log='任务已从检查点恢复，将跳过已完成的文件。', expected=task)
+        except SchedulerBusy as e: return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+        except TaskConflict as e: return jsonify({'error': str(e)}), 409
     elif action == 'resume':
         update_task_status(task_id, state='RUNNING', log='任务已恢复。')
     elif action == 'stop':
@@ -892,31 +3323,127 @@ def control_task_endpoint(action, task_id):
 
 @app.route('/status/<task_id>')
 def task_status(task_id):
-    logs = get_and_clear_logs(task_id)
-    with TASKS_LOCK: task = TASKS.get(task_id, {})
-    return jsonify({'state': task.get('state', 'UNKNOWN'), 'progress': task.get('progress', 0), 'logs': logs, 'error': task.get('error'), 'result_url': task.get('result_url')})
+    # Non-destructive: returns the log lines after ?cursor= along with the cursor to send next time
+    cursor = request.args.get('cursor', 0, type=int)
+    task = TASK_STORE.get(task_id) or {}
+    events = TASK_STORE.events_since(task_id, cursor)
+    return jsonify({**task_snapshot(task), 'timings': task.get('timings'), 'logs': [data for _, kind, data in events if kind == 'log'], 'cursor': events[-1][0] if events else max(cursor, task.get('event_seq', 0))})
+
+@app.route('/events/<task_id>')
+def task_events(task_id):
+    """Server-Sent Events stream of a task's status and log events, resumable via Last-Event-ID."""
+    if not TASK_STORE.get(task_id): return jsonify({'error': 'Invalid Task ID'}), 404
+    cursor = request.headers.get('Last-Event-ID', type=int) or request.args.get('cursor', 0, type=int)
+
+    def stream():
+        nonlocal cursor
+        yield "retry: 3000\n\n"
+        while True:
+            task = TASK_STORE.get(task_id)
+            if task is None: return
+            for event_id, kind, data in TASK_STORE.events_since(task_id, cursor):
+                yield f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                cursor = event_id
+            # The state was read before the events, so everything up to the final status has been sent
+            if task.get('state') in TERMINAL_STATES and cursor >= task['event_seq']:
+                yield "event: end\ndata: {}\n\n"
+                return
+            seq = wait_for_task_events(task_id, cursor, TASK_EVENT_KEEPALIVE_SECONDS)
+            if seq is not None and seq <= cursor: yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/download/<task_id>')
 def download_result(task_id):
-    with TASKS_LOCK: task_info = TASKS.get(task_id)
-    if not task_info or task_info.get('state') != 'SUCCESS': return "Task not found or not completed.", 404
-    task_dir = task_info.get('task_dir')
-    zip_filename = f"Translated_Results_{task_id[:8]}.zip"
-    return send_from_directory(task_dir, zip_filename, as_attachment=True)
+    task_info = TASK_STORE.get(task_id)
+    # A running task can be downloaded too: the ZIP is built while it is sent and grows until the task ends
+    if not task_info or task_info.get('state') not in ('SUCCESS', 'PARTIAL') + ACTIVE_STATES: return "Task not found or not started.", 404
+    result_dir = os.path.join(task_info.get('task_dir'), 'result')
+    headers = {'Content-Disposition': f'attachment; filename="Translated_Results_{task_id[:8]}.zip"', 'X-Accel-Buffering': 'no'}
+    return Response(stream_result_zip(task_id, result_dir), mimetype='application/zip', headers=headers)
+
+def admin_authorized():
+    # Prometheus scrapers can only send the token as a bearer credential
+    return not ADMIN_TOKEN or ADMIN_TOKEN in (request.headers.get('X-Admin-Token'), request.headers.get('Authorization', '').removeprefix('Bearer '))
+
+def metrics_gauges():
+    """Point-in-time values for /metrics: scheduler queues, tasks by state, cache hit ratios and AI endpoint health."""
+    scheduler, ai_client = JOB_SCHEDULER.stats(), AI_CLIENT.stats()
+    tasks_by_state = {}
+    for task in TASK_STORE.find(ACTIVE_STATES).values():
+        tasks_by_state[task.get('state')] = tasks_by_state.get(task.get('state'), 0) + 1
+    ratio = lambda stats: round(stats['hits'] / (stats['hits'] + stats['misses']), 4) if stats['hits'] + stats['misses'] else None
+    cache_ratios = [({'cache': 'translation'}, TRANSLATION_CACHE.stats()['hit_ratio']), ({'cache': 'html'}, ratio(HTML_RENDER_CACHE.stats())), ({'cache': 'pdf'}, ratio(PDF_RENDER_CACHE.stats()))]
+    if RENDER_CACHE_DISK_MAX_BYTES: cache_ratios.append(({'cache': 'pdf_store'}, PDF_RENDER_STORE.stats()['hit_ratio']))
+    return [('md2pdf_scheduler_queued_jobs', 'Jobs waiting for a scheduler slot.', [({'kind': kind}, n) for kind, n in scheduler['queued'].items()]),
+            ('md2pdf_scheduler_running_jobs', 'Jobs holding a scheduler slot.', [({'kind': kind}, n) for kind, n in scheduler['running'].items()]),
+            ('md2pdf_active_tasks', 'Unfinished batch tasks in the task store, by state.', [({'state': state}, n) for state, n in sorted(tasks_by_state.items())]),
+            ('md2pdf_cache_hit_ratio', 'Share of cache lookups that were hits (persistent caches count all workers).', cache_ratios),
+            ('md2pdf_ai_outstanding_requests', 'AI requests in flight per endpoint.', [({'endpoint': e['url']}, e['outstanding']) for e in ai_client['endpoints']]),
+            ('md2pdf_ai_endpoint_healthy', 'Whether an AI endpoint is in rotation (0 while ejected).', [({'endpoint': e['url']}, int(e['healthy'])) for e in ai_client['endpoints']]),
+            ('md2pdf_system_memory_percent', 'Memory in use on this host.', [({}, scheduler['memory_percent'])])]
+
+@app.route('/metrics')
+def metrics():
+    if not admin_authorized(): return jsonify({'error': 'Forbidden'}), 403
+    return Response(METRICS.render(metrics_gauges()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/cache')
+def admin_cache_stats():
+    if not admin_authorized(): return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(TRANSLATION_CACHE.stats())
+
+@app.route('/admin/cache/purge', methods=['POST'])
+def admin_cache_purge():
+    if not admin_authorized(): return jsonify({'error': 'Forbidden'}), 403
+    data = request.get_json(silent=True) or {}
+    language = data.get('language') or request.args.get('language')
+    if not language and not data.get('all'): return jsonify({'error': 'Specify a language, or "all": true to purge the whole cache'}), 400
+    return jsonify(TRANSLATION_CACHE.purge(language))
+
+@app.route('/admin/ai_client')
+def admin_ai_client_stats():
+    if not admin_authorized(): return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(AI_CLIENT.stats())
+
+@app.route('/admin/scheduler')
+def admin_scheduler_stats():
+    if not admin_authorized(): return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(JOB_SCHEDULER.stats())
+
+@app.route('/admin/render_cache')
+def admin_render_cache_stats():
+    if not admin_authorized(): return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({'html': HTML_RENDER_CACHE.stats(), 'pdf': PDF_RENDER_CACHE.stats(), 'pdf_store': PDF_RENDER_STORE.stats() if RENDER_CACHE_DISK_MAX_BYTES else None,
+                    'render_contexts': render_context_savings()})
+
+@app.route('/admin/render_cache/purge', methods=['POST'])
+def admin_render_cache_purge():
+    if not admin_authorized(): return jsonify({'error': 'Forbidden'}), 403
+    HTML_RENDER_CACHE.clear(); PDF_RENDER_CACHE.clear()
+    return jsonify(PDF_RENDER_STORE.purge() if RENDER_CACHE_DISK_MAX_BYTES else {'purged_entries': 0, 'purged_bytes': 0})
 
 def check_dependencies():
     print("="*20 + " Performing Startup Environment Check " + "="*20)
     all_ok = True
-    try:
-        import pypandoc
-        pypandoc.get_pandoc_version()
-        print("[✔] Pandoc dependency found.")
-    except (OSError, ImportError):
-        print("[❌] ERROR: Pandoc installation not found!")
-        print("    Please install it from: https://pandoc.org/installing.html")
-        all_ok = False
-    
-    for module in ['weasyprint', 'pandas']:
+    if MARKDOWN_BACKEND != 'python-markdown':
+        try:
+            import pypandoc
+            pypandoc.get_pandoc_version()
+            print("[✔] Pandoc dependency found.")
+        except (OSError, ImportError):
+            print("[❌] ERROR: Pandoc installation not found!")
+            print("    Please install it from: https://pandoc.org/installing.html")
+            all_ok = False
+    if MARKDOWN_BACKEND == 'pandoc-server' and all_ok and PANDOC_SERVER_POOL.supported():
+        try:
+            convert_markdown('ok', 'kate')
+            print(f"[✔] pandoc server pool started ({PANDOC_SERVER_POOL_SIZE} processes).")
+        except (RuntimeError, requests.exceptions.RequestException) as e:
+            print(f"[❌] ERROR: Could not start pandoc server: {e}")
+            all_ok = False
+
+    for module in ['weasyprint', 'pandas'] + (['markdown'] if MARKDOWN_BACKEND == 'python-markdown' else []):
         try:
             __import__(module)
             print(f"[✔] {module.capitalize()} dependency found.")
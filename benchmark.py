@@ -0,0 +1,335 @@
+"""Benchmark for the conversion pipeline, run against a local mock OpenAI-compatible AI server.
+
+    python benchmark.py                                   # every corpus in every export mode
+    python benchmark.py --corpus many_small --mode translated --ai-latency 0.5
+    python benchmark.py --output new.json --compare old.json
+
+Synthetic Markdown corpora (many small files, one huge file, image-heavy, table/code-heavy, CJK/Arabic) are
+generated once per run. Each (corpus, export mode) case then runs run_conversion_thread in its own process, on a
+fresh copy of ai_translator.py in a temporary directory, so every case starts with empty caches, peak RSS is
+measured per case, and the real caches and task store are never touched. Each case downloads its result ZIP once
+and also times generate_preview_pdf (original and translated) on its first file, and one extra case measures
+translate_text_via_api calls per second.
+
+Reported per case: wall time, files/sec, cumulative seconds per stage (read, translate, filenames, images, markdown,
+render_context, weasyprint, write_pdf, download) taken from the app's own stage spans, AI requests served by the mock,
+and peak RSS of the case process and of its render workers. Stage times are summed over threads and render workers,
+so with concurrency they can exceed the wall time; cache hits skip a stage and don't count towards it.
+Results are written as JSON; --compare prints the change against an earlier results file.
+"""
+import argparse
+import datetime
+import http.server
+import json
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPORT_MODES = ('original', 'translated', 'bilingual')
+STAGES = ('read', 'translate', 'filenames', 'images', 'markdown', 'render_context', 'weasyprint', 'write_pdf', 'download')
+
+# ==============================================================================
+# Synthetic Corpora
+# ==============================================================================
+WORDS = ('pipeline throughput latency document render translate segment cache worker process '
+         'markdown table image chapter section result archive queue thread budget').split()
+CJK_SENTENCES = ('这是一个用于测试中文排版的段落，包含常见的标点符号。', '机器翻译需要保留原文的格式，例如列表、表格和代码块。',
+                 '批量处理大量文件时，吞吐量和内存占用同样重要。')
+ARABIC_SENTENCES = ('هذه فقرة لاختبار النص العربي من اليمين إلى اليسار.', 'يجب أن تحافظ الترجمة على تنسيق المستند الأصلي.',
+                    'تتم معالجة الملفات على دفعات لتحسين الأداء.')
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def paragraph(rng, sentences=5):
+    return ' '.join(sentence(rng, rng.randint(8, 16)) for _ in range(sentences))
+
+def prose_document(rng, sections):
+    parts = [f"# {sentence(rng, 4)[:-1]}\n"]
+    for i in range(sections):
+        parts.append(f"## {i + 1}. {sentence(rng, 3)[:-1]}\n")
+        parts.extend(paragraph(rng) + '\n' for _ in range(3))
+        parts.append('\n'.join(f"- {sentence(rng, 6)}" for _ in range(4)) + '\n')
+    return '\n'.join(parts)
+
+def png_bytes(width, height, seed):
+    """A gradient PNG (no imaging library needed), large enough to exercise the image downscaling path."""
+    row = bytearray(3 * width)
+    row[0::3] = bytes((x * 255 // width + seed * 40) % 256 for x in range(width))
+    row[2::3] = bytes((x * 3 + seed * 7) % 256 for x in range(width))
+    rows = bytearray()
+    for y in range(height):
+        row[1::3] = bytes([y * 255 // height]) * width
+        rows += b'\x00' + row
+    def chunk(kind, data): return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + chunk(b'IDAT', zlib.compress(bytes(rows), 6)) + chunk(b'IEND', b'')
+
+def write_corpus_many_small(root, rng, scale):
+    for i in range(int(200 * scale)):
+        folder = os.path.join(root, f"part_{i // 50}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"note_{i:04d}.md"), 'w', encoding='utf-8') as f: f.write(prose_document(rng, 1))
+
+def write_corpus_huge(root, rng, scale):
+    with open(os.path.join(root, 'handbook.md'), 'w', encoding='utf-8') as f: f.write(prose_document(rng, int(300 * scale)))
+
+def write_corpus_images(root, rng, scale):
+    os.makedirs(os.path.join(root, 'images'), exist_ok=True)
+    images = [f"images/figure_{i}.png" for i in range(8)]
+    for i, name in enumerate(images):
+        with open(os.path.join(root, name), 'wb') as f: f.write(png_bytes(1600, 900, i))
+    for i in range(int(20 * scale)):
+        body = [f"# Figures {i}\n"]
+        for j in range(6):
+            body.append(paragraph(rng, 2) + '\n')
+            body.append(f"![Figure {j}]({images[(i + j) % len(images)]})\n")
+        with open(os.path.join(root, f"figures_{i:03d}.md"), 'w', encoding='utf-8') as f: f.write('\n'.join(body))
+
+def write_corpus_tables_code(root, rng, scale):
+    for i in range(int(30 * scale)):
+        body = [f"# Reference {i}\n", paragraph(rng, 2) + '\n', '| Name | Value | Description |', '|---|---:|---|']
+        body += [f"| {rng.choice(WORDS)}_{k} | {rng.randint(1, 10000)} | {sentence(rng, 6)} |" for k in range(40)]
+        body.append('')
+        for k in range(4):
+            body.append(paragraph(rng, 1) + '\n')
+            body.append('```python\n' + '\n'.join(f"def {rng.choice(WORDS)}_{k}_{n}(value):\n    return value * {n}" for n in range(12)) + '\n```\n')
+        with open(os.path.join(root, f"reference_{i:03d}.md"), 'w', encoding='utf-8') as f: f.write('\n'.join(body))
+
+def write_corpus_cjk_arabic(root, rng, scale):
+    for i in range(int(30 * scale)):
+        body = [f"# 文档 {i} / وثيقة {i}\n"]
+        for _ in range(8):
+            body.append(''.join(rng.choice(CJK_SENTENCES) for _ in range(6)) + '\n')
+            body.append(' '.join(rng.choice(ARABIC_SENTENCES) for _ in range(4)) + '\n')
+        with open(os.path.join(root, f"multilingual_{i:03d}.md"), 'w', encoding='utf-8') as f: f.write('\n'.join(body))
+
+CORPORA = {'many_small': write_corpus_many_small, 'huge': write_corpus_huge, 'images': write_corpus_images,
+           'tables_code': write_corpus_tables_code, 'cjk_arabic': write_corpus_cjk_arabic}
+
+# ==============================================================================
+# Mock AI Server
+# ==============================================================================
+def mock_translation(text):
+    """What the mock 'translates' text to: a JSON array keeps its shape, anything else gets a marker prepended."""
+    try: items = json.loads(text)
+    except ValueError: items = None
+    if isinstance(items, list) and all(isinstance(item, str) for item in items):
+        return json.dumps([f"[T] {item}" if item.strip() else item for item in items], ensure_ascii=False)
+    return f"[T] {text}"
+
+class MockAIHandler(http.server.BaseHTTPRequestHandler):
+    """OpenAI-compatible /chat/completions: waits latency + latency_per_1k_tokens per 1000 tokens, fails error_rate of requests with 503."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        with server.lock: server.requests += 1
+        if server.error_rate and server.rng.random() < server.error_rate:
+            return self._send(503, b'', 'text/plain', {'Retry-After': '0'})
+        content = payload['messages'][-1]['content']
+        reply = mock_translation(content)
+        tokens = (len(content) + len(reply)) // 4
+        time.sleep(server.latency + server.latency_per_1k_tokens * tokens / 1000)
+        usage = {'prompt_tokens': len(content) // 4, 'completion_tokens': len(reply) // 4}
+        if payload.get('stream'):
+            events = [{'choices': [{'delta': {'content': reply[i:i + 64]}}]} for i in range(0, len(reply), 64)] + [{'choices': [], 'usage': usage}]
+            body = ''.join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events) + 'data: [DONE]\n\n'
+            return self._send(200, body.encode('utf-8'), 'text/event-stream')
+        body = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': reply}}], 'usage': usage}, ensure_ascii=False)
+        self._send(200, body.encode('utf-8'), 'application/json')
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items(): self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+def start_mock_ai_server(latency, latency_per_1k_tokens, error_rate, port=0):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), MockAIHandler)
+    server.daemon_threads = True
+    server.latency, server.latency_per_1k_tokens, server.error_rate = latency, latency_per_1k_tokens, error_rate
+    server.rng, server.lock, server.requests = random.Random(0), threading.Lock(), 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ==============================================================================
+# One Case (runs in its own process)
+# ==============================================================================
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished child processes, in MB (None where unsupported)."""
+    try: import resource
+    except ImportError: return None, None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1), round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1))
+
+def load_isolated_app(workdir):
+    """Imports a copy of ai_translator.py living in workdir, so its output, caches and task store start empty there."""
+    shutil.copy(os.path.join(BASE_DIR, 'ai_translator.py'), workdir)
+    sys.path.insert(0, workdir)  # also inherited by spawned render workers
+    import ai_translator
+    return ai_translator
+
+def stage_seconds(app):
+    """Seconds per stage so far, summed from the app's stage spans (spans from render workers included)."""
+    totals = dict.fromkeys(STAGES, 0.0)
+    for labels, total, _ in app.METRICS.totals('md2pdf_stage_seconds'):
+        if labels['stage'] in totals: totals[labels['stage']] += total
+    return {stage: round(seconds, 3) for stage, seconds in totals.items()}
+
+def run_case(args):
+    workdir = tempfile.mkdtemp(prefix='md2pdf_bench_')
+    try:
+        app = load_isolated_app(workdir)
+        app.AI_API_URL, app.AI_API_KEY, app.AI_MODEL = args.ai_url, 'Bearer benchmark', 'mock-model'
+        app.RENDER_WORKERS = args.render_workers
+        if args.mode == 'api': return run_api_case(app, args)
+
+        task_id = f"bench-{args.corpus}-{args.mode}"
+        task_dir = os.path.join(app.OUTPUT_DIR, task_id)
+        shutil.copytree(args.corpus_dir, os.path.join(task_dir, 'source'))
+        app.TASK_STORE.create(task_id, task_dir=task_dir, state='READY')
+        files = app.get_task_source(task_dir).list_markdown()
+
+        started = time.perf_counter()
+        # run_conversion_thread names the current thread after the task, as a batch thread; it is put back afterwards
+        name = threading.current_thread().name
+        app.run_conversion_thread(task_id, {}, args.language, args.mode)
+        threading.current_thread().name = name
+        wall = time.perf_counter() - started
+        task = app.TASK_STORE.get(task_id)
+        # The result ZIP is only built when downloaded: fetch it once so the download stage is measured too
+        download_bytes = sum(len(chunk) for chunk in app.app.test_client().get(f'/download/{task_id}', buffered=False).response)
+        if app.RENDER_POOL: app.RENDER_POOL.shutdown()
+        stages = stage_seconds(app)
+
+        preview = {}
+        for label, modifier in (('original', None), ('translated', lambda md: app.translate_markdown_document('preview', md, args.language))):
+            preview_started = time.perf_counter()
+            try:
+                app.generate_preview_pdf(task_id, files[0], {}, content_modifier=modifier)
+                preview[label] = round(time.perf_counter() - preview_started, 3)
+            except Exception as e:
+                preview[label] = f"error: {e}"
+
+        rss, children_rss = peak_rss_mb()
+        return {'corpus': args.corpus, 'mode': args.mode, 'files': len(files), 'state': task.get('state'), 'error': task.get('error'),
+                'failed_files': len(task.get('failed_files') or ()), 'wall_seconds': round(wall, 3), 'files_per_second': round(len(files) / wall, 3) if wall else None,
+                'stage_seconds': stages, 'result_zip_bytes': download_bytes,
+                'preview_seconds': preview, 'peak_rss_mb': rss, 'render_workers_peak_rss_mb': children_rss if args.render_workers > 0 else None}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_api_case(app, args):
+    """translate_text_via_api throughput: distinct texts (so nothing is cached) from TRANSLATION_MAX_CONCURRENCY threads."""
+    from concurrent.futures import ThreadPoolExecutor
+    rng = random.Random(1)
+    texts = [paragraph(rng, 3) for _ in range(args.api_calls)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=app.TRANSLATION_MAX_CONCURRENCY) as executor:
+        list(executor.map(lambda text: app.translate_text_via_api('bench', text, args.language, app.TRANSLATION_PROMPT), texts))
+    wall = time.perf_counter() - started
+    rss, _ = peak_rss_mb()
+    return {'corpus': None, 'mode': 'api', 'calls': len(texts), 'wall_seconds': round(wall, 3), 'calls_per_second': round(len(texts) / wall, 2),
+            'ai_client': app.AI_CLIENT.stats()['endpoints'][0]['latency_seconds'], 'peak_rss_mb': rss}
+
+# ==============================================================================
+# Driver
+# ==============================================================================
+def run_case_process(args, corpus, corpus_dir, mode, ai_url, server):
+    command = [sys.executable, os.path.abspath(__file__), '--run-case', '--mode', mode, '--ai-url', ai_url, '--language', args.language,
+               '--render-workers', str(args.render_workers), '--api-calls', str(args.api_calls)]
+    if corpus: command += ['--corpus', corpus, '--corpus-dir', corpus_dir]
+    requests_before = server.requests
+    completed = subprocess.run(command, capture_output=True, text=True)
+    try: result = json.loads(completed.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        result = {'corpus': corpus, 'mode': mode, 'state': 'CRASHED', 'error': (completed.stderr or completed.stdout)[-2000:]}
+    result['ai_requests'] = server.requests - requests_before
+    return result
+
+def print_results(results, baseline=None):
+    baseline = {(r.get('corpus'), r['mode']): r for r in (baseline or [])}
+    print(f"\n{'case':<26}{'state':<10}{'files':>6}{'wall s':>9}{'files/s':>9}{'AI req':>8}{'RSS MB':>8}  stages (s)")
+    for r in results:
+        case = f"{r.get('corpus') or '-'}/{r['mode']}"
+        stages = ' '.join(f"{stage}={seconds}" for stage, seconds in (r.get('stage_seconds') or {}).items() if seconds)
+        line = f"{case:<26}{str(r.get('state', '')):<10}{str(r.get('files', r.get('calls', ''))):>6}{str(r.get('wall_seconds', '')):>9}" \
+               f"{str(r.get('files_per_second', r.get('calls_per_second', ''))):>9}{str(r.get('ai_requests', '')):>8}{str(r.get('peak_rss_mb', '')):>8}  {stages}"
+        old = baseline.get((r.get('corpus'), r['mode']))
+        if old and old.get('wall_seconds') and r.get('wall_seconds'):
+            line += f"  [{(r['wall_seconds'] - old['wall_seconds']) / old['wall_seconds']:+.0%} wall vs baseline]"
+        print(line)
+        if r.get('error'): print(f"    error: {str(r['error']).strip().splitlines()[-1][:200]}")
+        if r.get('failed_files'): print(f"    {r['failed_files']} file(s) failed; timings cover a partial run")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--corpus', action='append', choices=sorted(CORPORA), help='corpus to run (repeatable; default: all)')
+    parser.add_argument('--mode', action='append', choices=EXPORT_MODES + ('api',), help='export mode to run (repeatable; default: all, plus the API case)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the size of every corpus')
+    parser.add_argument('--language', default='English')
+    parser.add_argument('--ai-latency', type=float, default=0.2, help='mock AI seconds per request')
+    parser.add_argument('--ai-latency-per-1k-tokens', type=float, default=0.5, help='mock AI seconds per 1000 tokens')
+    parser.add_argument('--ai-error-rate', type=float, default=0.0, help='share of mock AI requests answered with 503')
+    parser.add_argument('--render-workers', type=int, default=0, help='render worker processes (0 renders in-process)')
+    parser.add_argument('--api-calls', type=int, default=50, help='calls made by the translate_text_via_api case')
+    parser.add_argument('--output', default=f"bench_results_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument('--compare', help='earlier results file to compare wall times against')
+    parser.add_argument('--run-case', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--corpus-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--ai-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        args.corpus = args.corpus[0] if args.corpus else None
+        args.mode = args.mode[0]
+        print(json.dumps(run_case(args), ensure_ascii=False))
+        return
+
+    server = start_mock_ai_server(args.ai_latency, args.ai_latency_per_1k_tokens, args.ai_error_rate)
+    ai_url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    corpora_dir = tempfile.mkdtemp(prefix='md2pdf_corpora_')
+    results = []
+    try:
+        modes = args.mode or list(EXPORT_MODES) + ['api']
+        for corpus in args.corpus or sorted(CORPORA):
+            if not [m for m in modes if m != 'api']: break
+            corpus_dir = os.path.join(corpora_dir, corpus)
+            os.makedirs(corpus_dir)
+            CORPORA[corpus](corpus_dir, random.Random(corpus), args.scale)
+            for mode in modes:
+                if mode == 'api': continue
+                print(f"Running {corpus}/{mode}...", flush=True)
+                results.append(run_case_process(args, corpus, corpus_dir, mode, ai_url, server))
+        if 'api' in modes:
+            print("Running translate_text_via_api...", flush=True)
+            results.append(run_case_process(args, None, None, 'api', ai_url, server))
+    finally:
+        shutil.rmtree(corpora_dir, ignore_errors=True)
+        server.shutdown()
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('run_case', 'corpus_dir', 'ai_url', 'output', 'compare')}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0], 'settings': settings, 'results': results},
+                  f, ensure_ascii=False, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f: baseline = json.load(f)['results']
+    print_results(results, baseline)
+    print(f"\nResults saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import importlib.util
+import os
+import shutil
+import sys
+import types
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app_module(tmp_path):
+    """A fresh copy of ai_translator.py living in tmp_path, so its output, caches and task store start empty there."""
+    shutil.copy(os.path.join(BASE_DIR, 'ai_translator.py'), tmp_path)
+    spec = importlib.util.spec_from_file_location('ai_translator', tmp_path / 'ai_translator.py')
+    module = importlib.util.module_from_spec(spec)
+    previous = sys.modules.get('ai_translator')
+    sys.modules['ai_translator'] = module
+    try:
+        spec.loader.exec_module(module)
+        module.app.config['TESTING'] = True
+        yield module
+    finally:
+        if previous is None: sys.modules.pop('ai_translator', None)
+        else: sys.modules['ai_translator'] = previous
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def fake_weasyprint(app_module, monkeypatch):
+    """Stands in for WeasyPrint (which needs Pango): a PDF is b'%PDF ' + the HTML, and every render is recorded."""
+    renders = []
+    class HTML:
+        def __init__(self, string, url_fetcher=None): self.string = string
+        def render(self, stylesheets=(), font_config=None):
+            renders.append({'html': self.string, 'stylesheets': stylesheets, 'font_config': font_config})
+            return types.SimpleNamespace(pages=[object()], write_pdf=lambda: b'%PDF ' + self.string.encode('utf-8'))
+    class CSS:
+        def __init__(self, string, font_config=None): self.string, self.font_config = string, font_config
+    fonts = types.SimpleNamespace(FontConfiguration=lambda: object())
+    module = types.SimpleNamespace(__version__='99.0', HTML=HTML, CSS=CSS, text=types.SimpleNamespace(fonts=fonts))
+    for name, value in {'weasyprint': module, 'weasyprint.text': module.text, 'weasyprint.text.fonts': fonts}.items():
+        monkeypatch.setitem(sys.modules, name, value)
+    monkeypatch.setattr(app_module, 'convert_markdown', lambda md, highlight_style, backend=None: f"<p>{md.strip()}</p>")
+    return renders
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+MESSAGES = [{'role': 'user', 'content': 'Hello'}]
+
+
+def response(status=200, text='ok', headers=None, stream=None):
+    """A requests.Response as an OpenAI-compatible server would send it (stream: a list of deltas sent as SSE)."""
+    reply = requests.Response()
+    reply.status_code, reply.reason = status, {200: 'OK', 400: 'Bad Request', 429: 'Too Many Requests'}.get(status, 'Error')
+    reply.headers.update(headers or {})
+    reply.encoding = 'utf-8'
+    if stream is not None:
+        reply.headers['Content-Type'] = 'text/event-stream'
+        events = [{'choices': [{'delta': {'content': delta}}]} for delta in stream]
+        reply._content = ''.join(f"data: {json.dumps(event)}\n\n" for event in events).encode() + b"data: [DONE]\n\n"
+    else:
+        reply._content = json.dumps({'choices': [{'message': {'content': text}}], 'usage': {'prompt_tokens': 3, 'completion_tokens': 2}}).encode()
+    reply._content_consumed = True
+    return reply
+
+
+class FakeSession:
+    """Answers each POST with the next reply scripted for its URL (the last one repeats): a Response, an
+    exception to raise, or a callable returning either."""
+    def __init__(self): self.replies, self.posts = {}, []
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        self.posts.append(url)
+        replies = self.replies[url]
+        reply = replies.pop(0) if len(replies) > 1 else replies[0]
+        if callable(reply): reply = reply()
+        if isinstance(reply, Exception): raise reply
+        return reply
+
+
+@pytest.fixture
+def ai(app_module, monkeypatch):
+    """Builds an AIClient over the given backends whose HTTP session is a FakeSession; the test thread's sleeps are
+    recorded, not slept (the app's background threads sleep as usual)."""
+    sleeps, real_sleep, caller = [], time.sleep, threading.current_thread()
+    monkeypatch.setattr(time, 'sleep', lambda seconds: sleeps.append(seconds) if threading.current_thread() is caller else real_sleep(seconds))
+    monkeypatch.setattr(app_module, 'AI_RETRY_BASE_SECONDS', 0)
+    def make(*backends):
+        client = app_module.AIClient(list(backends) or [{'url': 'http://a'}])
+        client.session_, client.pid = FakeSession(), os.getpid()
+        return client
+    make.sleeps = sleeps
+    return make
+
+
+def test_5xx_and_dropped_connections_are_retried(ai):
+    client = ai()
+    client.session_.replies['http://a'] = [response(503), requests.exceptions.ConnectionError('reset'), response(text='Hallo')]
+    retries = []
+    assert client.chat(MESSAGES, on_retry=lambda attempt, error, delay: retries.append((attempt, str(error)))) == 'Hallo'
+    assert retries == [(1, 'HTTP 503 Error'), (2, 'reset')]
+    assert client.counters['retries'] == 2
+    assert client.endpoints[0].counters == {**client.endpoints[0].counters, 'requests': 3, 'failed': 2, 'succeeded': 1, 'prompt_tokens': 3}
+
+
+def test_retries_are_limited(app_module, ai, monkeypatch):
+    monkeypatch.setattr(app_module, 'AI_MAX_RETRIES', 2)
+    client = ai()
+    client.session_.replies['http://a'] = [response(500)]
+    with pytest.raises(ConnectionError, match='after 3 attempts'):
+        client.chat(MESSAGES)
+    assert len(client.session_.posts) == 3 and client.counters['failed'] == 1
+
+
+def test_client_errors_are_not_retried(ai):
+    client = ai()
+    client.session_.replies['http://a'] = [response(400)]
+    with pytest.raises(ConnectionError):
+        client.chat(MESSAGES)
+    assert len(client.session_.posts) == 1 and client.counters['retries'] == 0
+
+
+def test_retry_after_holds_the_endpoint_back(ai):
+    client = ai()
+    client.session_.replies['http://a'] = [response(429, headers={'Retry-After': '7'}), response()]
+    delays = []
+    client.chat(MESSAGES, on_retry=lambda attempt, error, delay: delays.append(delay))
+    endpoint = client.endpoints[0]
+    assert delays == [7.0] and endpoint.blocked_until > time.monotonic() + 5
+    assert endpoint.counters['rate_limited'] == 1
+    assert endpoint.consecutive_failures == 0  # busy is not unhealthy
+
+
+def test_retry_after_as_http_date(app_module):
+    assert 50 < app_module.parse_retry_after(time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 60))) <= 60
+    assert app_module.parse_retry_after('soon') is None and app_module.parse_retry_after('-3') == 0
+
+
+def test_token_bucket_waits_out_the_shortfall(app_module, ai):
+    bucket = app_module.TokenBucket(60)  # one a second, bursts of 60
+    assert bucket.acquire(60) == 0
+    assert bucket.acquire(2) == pytest.approx(2, abs=0.1)
+    bucket.adjust(-62)  # both reservations turned out to cost nothing
+    assert bucket.acquire(30) == 0
+    assert app_module.TokenBucket(0).acquire(10 ** 6) == 0
+    assert ai.sleeps == [pytest.approx(2, abs=0.1)]
+
+
+def test_endpoint_budgets_throttle_requests(ai):
+    client = ai({'url': 'http://a', 'requests_per_minute': 60})
+    client.session_.replies['http://a'] = [response()]
+    for _ in range(61): client.chat(MESSAGES)
+    assert ai.sleeps == [pytest.approx(1, abs=0.1)]
+    assert client.endpoints[0].counters['throttled_seconds'] == pytest.approx(1, abs=0.1)
+
+
+def test_endpoints_are_chosen_by_weighted_load(ai):
+    client = ai({'url': 'http://a', 'weight': 2, 'max_concurrency': 2}, {'url': 'http://b', 'max_concurrency': 1})
+    a, b = client.endpoints
+    assert [client.acquire() for _ in range(3)] == [a, a, b]
+    assert client.acquire(block=False) is None  # both at their concurrency cap
+    client.release(a)
+    assert client.acquire(exclude=(a,), block=False) is a  # excluded endpoints are still better than waiting
+
+
+def test_endpoints_told_to_back_off_are_avoided(ai):
+    client = ai({'url': 'http://a', 'weight': 5}, {'url': 'http://b'})
+    a, b = client.endpoints
+    a.blocked_until = time.monotonic() + 60
+    assert client.acquire() is b
+
+
+def test_retry_goes_to_another_endpoint_without_waiting(ai):
+    client = ai({'url': 'http://a', 'weight': 2}, {'url': 'http://b'})
+    client.session_.replies.update({'http://a': [response(502)], 'http://b': [response(text='from b')]})
+    assert client.chat(MESSAGES) == 'from b'
+    assert client.session_.posts == ['http://a', 'http://b'] and ai.sleeps == []
+
+
+def test_failing_endpoint_is_ejected_and_comes_back(app_module, ai, monkeypatch):
+    monkeypatch.setattr(app_module, 'AI_EJECT_AFTER_FAILURES', 2)
+    client = ai({'url': 'http://a', 'weight': 10}, {'url': 'http://b'})
+    a, b = client.endpoints
+    client.session_.replies.update({'http://a': [response(500)], 'http://b': [response()]})
+    for _ in range(2): client.chat(MESSAGES)
+    assert a.ejections == 1 and not client.stats()['endpoints'][0]['healthy']
+    client.session_.posts.clear()
+    for _ in range(3): client.chat(MESSAGES)
+    assert client.session_.posts == ['http://b'] * 3
+    a.ejected_until = time.monotonic() - 1  # ejection over: it gets live traffic again
+    assert client.acquire() is a
+
+
+def test_rate_limits_do_not_eject(app_module, ai, monkeypatch):
+    monkeypatch.setattr(app_module, 'AI_EJECT_AFTER_FAILURES', 1)
+    client = ai({'url': 'http://a'}, {'url': 'http://b'})
+    client.session_.replies.update({'http://a': [response(429)], 'http://b': [response()]})
+    client.chat(MESSAGES)
+    assert client.endpoints[0].ejections == 0
+
+
+def test_when_all_are_ejected_the_first_due_back_is_used(ai):
+    client = ai({'url': 'http://a'}, {'url': 'http://b'})
+    a, b = client.endpoints
+    a.ejected_until, b.ejected_until = time.monotonic() + 60, time.monotonic() + 30
+    assert client.acquire() is b
+
+
+def test_slow_request_is_hedged_on_another_endpoint(app_module, ai, monkeypatch):
+    monkeypatch.setattr(app_module, 'AI_HEDGE_AFTER_SECONDS', 0.05)
+    client = ai({'url': 'http://a', 'weight': 2}, {'url': 'http://b'})
+    client.hedge_executor = ThreadPoolExecutor(max_workers=2)
+    answered = threading.Event()
+    slow = lambda: response(text='from a') if answered.wait(5) else RuntimeError('not hedged')
+    client.session_.replies.update({'http://a': [slow], 'http://b': [response(text='from b')]})
+    try:
+        assert client.chat(MESSAGES) == 'from b'
+        assert client.counters['hedged'] == 1 and client.counters['hedge_wins'] == 1
+    finally:
+        answered.set()
+        client.hedge_executor.shutdown(wait=True)
+    assert [endpoint.outstanding for endpoint in client.endpoints] == [0, 0]
+
+
+def test_streamed_reply_reports_its_progress(ai):
+    client = ai()
+    client.session_.replies['http://a'] = [response(stream=['Hal', 'lo'])]
+    seen = []
+    assert client.chat(MESSAGES, on_text=seen.append) == 'Hallo'
+    assert seen == ['Hal', 'Hallo']
@@ -0,0 +1,24 @@
+import os
+import threading
+import time
+
+
+def test_asset_store_is_pruned_once_under_concurrency(app_module, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'prune_asset_store', lambda: (calls.append(1), time.sleep(0.05)))
+    start = threading.Barrier(8)
+    def worker(): start.wait(); app_module.prune_asset_store_once()
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert calls == [1]
+
+
+def test_prune_removes_only_old_assets(app_module):
+    os.makedirs(app_module.ASSET_DIR, exist_ok=True)
+    old, new = os.path.join(app_module.ASSET_DIR, 'old.png'), os.path.join(app_module.ASSET_DIR, 'new.png')
+    for path in (old, new): open(path, 'wb').close()
+    stale = time.time() - (app_module.ASSET_STORE_MAX_AGE_DAYS + 1) * 86400
+    os.utime(old, (stale, stale))
+    app_module.prune_asset_store_once()
+    assert not os.path.exists(old) and os.path.exists(new)
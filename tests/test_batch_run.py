@@ -0,0 +1,84 @@
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def batch(app_module, tmp_path, monkeypatch):
+    """A task over a source folder whose render step fails for the files listed in `failing`; `rendered` lists the
+    render jobs in the order they were handed over."""
+    failing, rendered = set(), []
+    def render(job):
+        rendered.append(job)
+        if job['rel_path'] in failing: raise RuntimeError('render failed')
+        return {'report': {'Original Pages': 1}, 'spans': [], 'pid': os.getpid()}
+    monkeypatch.setattr(app_module, 'RENDER_WORKERS', 0)
+    monkeypatch.setattr(app_module, 'FILE_MAX_RETRIES', 0)
+    monkeypatch.setattr(app_module, 'render_file_outputs', render)
+    task_dir = tmp_path / 'task'
+
+    def run(names, export_mode='original'):
+        for name in names:
+            os.makedirs((task_dir / 'source' / name).parent, exist_ok=True)
+            (task_dir / 'source' / name).write_text(f"# {name}\n", encoding='utf-8')
+        app_module.TASK_STORE.create('t1', task_dir=str(task_dir), state='RUNNING', params={'style_options': {}, 'target_language': 'en', 'export_mode': export_mode})
+        app_module.run_conversion_thread('t1', {}, 'en', export_mode)
+        return app_module.TASK_STORE.get('t1')
+    run.failing, run.rendered = failing, rendered
+    run.summary = lambda: pd.read_csv(task_dir / 'result' / 'translation_summary.csv', encoding='utf_8_sig')
+    return run
+
+
+def test_all_files_rendered(batch):
+    task = batch(['a.md', 'b.md'])
+    assert task['state'] == 'SUCCESS' and task['failed_files'] == []
+
+
+def test_translations_overlap_and_results_keep_file_order(app_module, batch, monkeypatch):
+    b_started = threading.Event()
+    def translate(task_id, md, target_language, log_id=''):
+        if log_id == 'a.md': assert b_started.wait(5)  # a.md can only finish while b.md is being translated too
+        if log_id == 'b.md': b_started.set()
+        return md.upper()
+    monkeypatch.setattr(app_module, 'translate_markdown_document', translate)
+    monkeypatch.setattr(app_module, 'translate_filenames', lambda task_id, stems, target_language: {stem: stem.upper() for stem in stems})
+    task = batch(['a.md', 'b.md', 'c.md'], export_mode='translated')
+    assert task['state'] == 'SUCCESS'
+    assert [(job['rel_path'], job['translated_md']) for job in batch.rendered] == [('a.md', '# A.MD\n'), ('b.md', '# B.MD\n'), ('c.md', '# C.MD\n')]
+    summary = batch.summary()
+    assert list(summary['Original Filename']) == ['a.md', 'b.md', 'c.md', 'TOTAL']
+    assert list(summary['Translated Filename'][:3]) == ['A.pdf', 'B.pdf', 'C.pdf']
+
+
+def test_translated_names_that_collide_get_a_suffix(app_module, batch, monkeypatch):
+    monkeypatch.setattr(app_module, 'translate_markdown_document', lambda task_id, md, target_language, log_id='': md)
+    monkeypatch.setattr(app_module, 'translate_filenames', lambda task_id, stems, target_language: {stem: 'Same' for stem in stems})
+    batch(['a.md', 'b.md', 'c.md', 'sub/d.md'], export_mode='translated')
+    assert [job['translated_filename_stem'] for job in batch.rendered] == ['Same', 'Same_2', 'Same_3', 'Same']
+
+
+def test_every_file_failed_ends_in_failure(batch):
+    batch.failing.add('a.md')
+    task = batch(['a.md'])
+    assert task['state'] == 'FAILURE'
+    assert task['failed_files'] == ['a.md']
+    assert not task.get('result_url')
+
+
+def test_some_files_failed_ends_in_partial(app_module, client, batch):
+    batch.failing.add('a.md')
+    task = batch(['a.md', 'b.md'])
+    assert task['state'] == 'PARTIAL'
+    assert task['failed_files'] == ['a.md'] and task['result_url'] == '/download/t1'
+    assert client.get('/status/t1').get_json()['state'] == 'PARTIAL'
+
+
+def test_resume_retries_a_failed_run(app_module, client, batch, monkeypatch):
+    batch.failing.add('a.md')
+    batch(['a.md'])
+    submitted = []
+    monkeypatch.setattr(app_module.JOB_SCHEDULER, 'submit', lambda kind, user, run, **kwargs: submitted.append(kwargs['job_id']))
+    assert client.post('/resume/t1').status_code == 200
+    assert submitted == ['t1']
@@ -0,0 +1,44 @@
+import re
+
+import pytest
+
+ORIGINAL = "# Title\n\nFirst\n\n```\ncode\n```\n\nLast\n"
+
+
+@pytest.fixture
+def converter(app_module, monkeypatch):
+    """A converter that makes each block a <p> and, like pandoc, passes HTML comments through (unless `keep_comments` is off)."""
+    calls = []
+    def convert(md, highlight_style, backend=None):
+        calls.append(md)
+        blocks = [block for block in md.split('\n\n') if block.strip()]
+        return '\n'.join(block if block.startswith('<!--') and converter.keep_comments else f"<p>{block.strip()}</p>" for block in blocks
+                         if converter.keep_comments or not block.startswith('<!--'))
+    converter.calls, converter.keep_comments = calls, True
+    monkeypatch.setattr(app_module, 'convert_markdown', convert)
+    return converter
+
+
+def rows(html):
+    return re.findall(r'<tr><td>(.*?)</td><td>(.*?)</td></tr>', html, re.S)
+
+
+def test_blocks_are_paired_by_kind(app_module):
+    split = lambda md: [(k, t) for k, t in app_module.split_markdown_blocks(md) if k != 'blank']
+    # The translation merged the two paragraphs and dropped nothing else
+    pairs = app_module.align_markdown_blocks(split(ORIGINAL), split("# Titel\n\nErster und Letzter\n\n```\ncode\n```\n"))
+    assert pairs == [('# Title\n', '# Titel\n'), ('First\n', 'Erster und Letzter\n'), ('```\ncode\n```\n', '```\ncode\n```\n'), ('Last\n', '')]
+
+
+def test_each_side_is_converted_once(app_module, converter):
+    html = app_module.build_bilingual_rows(ORIGINAL, "# Titel\n\nErster\n\n```\ncode\n```\n\nLetzter\n", None, '', {})
+    assert len(converter.calls) == 2
+    assert rows(html)[:2] == [('<p># Title</p>', '<p># Titel</p>'), ('<p>First</p>', '<p>Erster</p>')]
+    assert rows(html)[3] == ('<p>Last</p>', '<p>Letzter</p>')
+
+
+def test_converter_that_drops_the_markers_falls_back_to_one_block_at_a_time(app_module, converter):
+    converter.keep_comments = False
+    html = app_module.build_bilingual_rows("A\n\nB\n", "X\n", None, '', {})
+    assert rows(html) == [('<p>A</p>', '<p>X</p>'), ('<p>B</p>', '')]
+    assert len(converter.calls) == 5  # each side joined, then A, B and X on their own (the empty cell is not converted)
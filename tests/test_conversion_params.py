@@ -0,0 +1,16 @@
+import sys
+import types
+
+
+def test_unknown_export_mode_is_rejected(app_module, client):
+    app_module.TASK_STORE.create('t1', task_dir='', state='PENDING')
+    response = client.post('/start_conversion', json={'task_id': 't1', 'export_mode': 'everything'})
+    assert response.status_code == 400
+    assert 'everything' in response.get_json()['error']
+    assert app_module.TASK_STORE.get('t1')['state'] == 'PENDING'
+
+
+def test_layout_stats_of_unpinned_weasyprint_are_pages_only(app_module, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'weasyprint', types.SimpleNamespace(__version__='99.0'))
+    document = types.SimpleNamespace(pages=[object(), object()])
+    assert app_module.layout_stats(document) == {'pages': 2, 'images': None, 'overflowing': None}
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+PARAMS = {'style_options': {}, 'target_language': 'de', 'export_mode': 'translated'}
+
+
+@pytest.fixture
+def task_dir(tmp_path):
+    for name, text in {'a.md': "# Title\n\nFirst paragraph.\n\nSecond paragraph.\n", 'b.md': "Only one.\n"}.items():
+        (tmp_path / 'task' / 'source').mkdir(parents=True, exist_ok=True)
+        (tmp_path / 'task' / 'source' / name).write_text(text, encoding='utf-8')
+    return str(tmp_path / 'task')
+
+
+@pytest.fixture
+def api(app_module, monkeypatch):
+    """Counts the AI requests a real run makes; replies are upper-cased (element-wise for JSON arrays)."""
+    calls = []
+    def call(task_id, content, target_language, prompt_template, log_id="", on_text=None):
+        calls.append(content)
+        return json.dumps([item.upper() for item in json.loads(content)]) if content.startswith('[') else content.upper()
+    monkeypatch.setattr(app_module, 'call_translation_api', call)
+    return calls
+
+
+def test_token_estimate(app_module):
+    assert app_module.estimate_tokens('abcdefgh') == 2
+    assert app_module.estimate_tokens('你好abcd') == 3  # one per CJK character, one per four others
+
+
+def test_one_call_per_segment_group(app_module):
+    estimate = lambda segments: app_module.estimate_translation_calls(segments, 'de', 'batch {target_language}', 'single {target_language}')
+    assert estimate(['abcd', 'efgh']) == (0, 1, app_module.estimate_tokens('batch de') + app_module.estimate_tokens('["abcd", "efgh"]'), app_module.estimate_tokens('["abcd", "efgh"]'))
+    app_module.TRANSLATION_CACHE.set(app_module.PersistentCache.make_key('abcd', 'de', 'batch {target_language}'), 'de', 'ABCD')
+    assert estimate(['abcd', 'efgh']) == (1, 1, app_module.estimate_tokens('single de') + 1, 1)  # one left: sent on its own
+    assert estimate(['abcd']) == (1, 0, 0, 0)
+
+
+def test_estimate_matches_the_calls_of_a_run(app_module, api, task_dir):
+    before = app_module.estimate_batch(task_dir, PARAMS)
+    source = app_module.get_task_source(task_dir)
+    app_module.translate_filenames('t1', ['a', 'b'], 'de')
+    for rel_path in source.list_markdown(): app_module.translate_markdown_document('t1', source.read_text(rel_path), 'de')
+    assert before['api_calls'] == len(api) and before['filename_api_calls'] == 1
+    assert (before['files_to_process'], before['segments'], before['cached_segments']) == (2, 4, 0)
+    after = app_module.estimate_batch(task_dir, PARAMS)
+    assert (after['api_calls'], after['input_tokens'], after['cached_segments']) == (0, 0, 4)
+
+
+def test_checkpointed_files_are_left_out(app_module, task_dir):
+    app_module.TaskCheckpoint(task_dir, PARAMS).mark_done('a.md', {})
+    estimate = app_module.estimate_batch(task_dir, PARAMS)
+    assert (estimate['files'], estimate['files_done'], [entry['file'] for entry in estimate['per_file']]) == (2, 1, ['b.md'])
+
+
+def test_duration_and_cost(app_module, task_dir, monkeypatch):
+    monkeypatch.setattr(app_module, 'AI_PRICE_PER_1K_INPUT_TOKENS', 1)
+    monkeypatch.setattr(app_module, 'AI_PRICE_PER_1K_OUTPUT_TOKENS', 2)
+    monkeypatch.setattr(app_module, 'RENDER_WORKERS', 2)
+    app_module.THROUGHPUT_HISTORY.record('ai_tokens', 1000, 10)
+    estimate = app_module.estimate_batch(task_dir, PARAMS)
+    tokens = estimate['input_tokens'] + estimate['output_tokens']
+    assert estimate['estimated_cost'] == round((estimate['input_tokens'] + 2 * estimate['output_tokens']) / 1000, 4)
+    assert estimate['rates']['measured'] == {'ai': True, 'render': False}
+    assert estimate['estimated_seconds']['translation'] == round(tokens * 0.01 / estimate['concurrency'], 1)
+    chars = sum(entry['chars'] for entry in estimate['per_file'])
+    assert estimate['estimated_seconds']['render'] == round(chars * app_module.ESTIMATE_DEFAULT_RENDER_SECONDS_PER_1K_CHARS / 1000 / 2, 1)
+
+
+def test_request_budget_sets_the_pace(app_module, task_dir, monkeypatch):
+    monkeypatch.setattr(app_module, 'AI_CLIENT', app_module.AIClient([{'requests_per_minute': 1}]))
+    estimate = app_module.estimate_batch(task_dir, PARAMS)
+    assert estimate['estimated_seconds']['translation'] == 60 * estimate['api_calls']
+    assert estimate['estimated_seconds']['total'] >= estimate['estimated_seconds']['translation']
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def api(app_module, monkeypatch):
+    """Answers batched file-name requests through `translate`; single names are upper-cased."""
+    calls = []
+    def call(task_id, content, target_language, prompt_template, log_id="", on_text=None):
+        if prompt_template == app_module.FILENAME_BATCH_TRANSLATION_PROMPT:
+            calls.append(json.loads(content))
+            return json.dumps([api.translate(name) for name in json.loads(content)])
+        calls.append(content)
+        return content.upper()
+    api.calls, api.translate = calls, str.upper
+    monkeypatch.setattr(app_module, 'call_translation_api', call)
+    return api
+
+
+def test_names_are_translated_in_batches_once_each(app_module, api, monkeypatch):
+    monkeypatch.setattr(app_module, 'FILENAME_BATCH_SIZE', 2)
+    names = app_module.translate_filenames('t1', ['a', 'b', 'a', 'c'], 'en')
+    assert names == {'a': 'A', 'b': 'B', 'c': 'C'}
+    assert sorted(api.calls, key=str) == [['a', 'b'], 'c']  # a batch of one goes out as a plain request
+
+
+def test_unusable_names_fall_back_to_one_request_then_the_original(app_module, api):
+    api.translate = lambda name: {'a': 'Two words', 'b': '', 'c': 'x/y:z', '__': '__'}[name]
+    names = app_module.translate_filenames('t1', ['a', 'b', 'c', '__'], 'en')
+    assert names == {'a': 'Two_words', 'b': 'B', 'c': 'xyz', '__': '__'}  # b's retry on its own came back usable, '__' never does
+    assert api.calls == [['a', 'b', 'c', '__'], 'b', '__']
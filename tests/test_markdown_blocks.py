@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+DOCUMENT = """# Title
+
+Intro paragraph
+over two lines.
+
+| Name | Value |
+|------|------:|
+| a | 1 |
+
+- one
+- two
+    - nested
+
+```python
+x = 1
+
+y = 2
+```
+
+$$
+a + b
+$$
+
+> quoted
+"""
+
+
+def kinds(app_module, text):
+    return [kind for kind, _ in app_module.split_markdown_blocks(text) if kind != 'blank']
+
+
+def test_blocks_reproduce_the_input(app_module):
+    blocks = app_module.split_markdown_blocks(DOCUMENT)
+    assert ''.join(text for _, text in blocks) == DOCUMENT
+    assert kinds(app_module, DOCUMENT) == ['heading', 'paragraph', 'table', 'list', 'code', 'math', 'quote']
+
+
+@pytest.mark.parametrize('text', [
+    "Sub | x\n---\n",             # setext heading whose text has a pipe
+    "a | b\n--- | --- | ---\n",   # delimiter row with more cells than the header
+    "a | b\n:-:\n",
+])
+def test_rows_that_do_not_open_a_table(app_module, text):
+    assert 'table' not in kinds(app_module, text)
+
+
+@pytest.mark.parametrize('text', [
+    "a | b\n--- | ---\n1 | 2\n",
+    "| a |\n| --- |\n| 1 |\n",
+    "| a \\| b | c |\n|---|:--|\n",  # an escaped pipe is not a cell border
+])
+def test_pipe_tables(app_module, text):
+    assert kinds(app_module, text) == ['table']
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("Intro\n$$\na + b\n$$\n", ['paragraph', 'math']),
+    ("Intro\n| a | b |\n|---|---|\n| 1 | 2 |\n", ['paragraph', 'table']),
+    ("Intro\n```\ncode\n```\n", ['paragraph', 'code']),
+    ("Intro with a | pipe\nand more\n", ['paragraph']),
+])
+def test_blocks_that_interrupt_a_paragraph(app_module, text, expected):
+    assert kinds(app_module, text) == expected
+
+
+LIST_WITH_CODE = "- Run:\n\n  ```sh\n  make all\n  ```\n\n  Then check.\n- Done\n"
+
+
+def test_code_fenced_in_a_list_item_is_not_translatable(app_module):
+    segments = app_module.split_translation_segments(app_module.split_markdown_blocks(LIST_WITH_CODE))
+    assert ''.join(text for _, text in segments) == LIST_WITH_CODE
+    assert [(translatable, text.strip()) for translatable, text in segments] == [
+        (True, '- Run:'), (False, '```sh\n  make all\n  ```'), (True, 'Then check.'), (True, '- Done')]
+
+
+def test_code_fenced_in_a_list_item_is_not_sent(app_module, monkeypatch):
+    sent = []
+    def call(task_id, content, target_language, prompt_template, log_id="", on_text=None):
+        sent.append(content)
+        return json.dumps([item.upper() for item in json.loads(content)])
+    monkeypatch.setattr(app_module, 'call_translation_api', call)
+    translated = app_module.translate_markdown_document('t1', LIST_WITH_CODE, 'en')
+    assert translated == "- RUN:\n\n  ```sh\n  make all\n  ```\n\n  THEN CHECK.\n- DONE"
+    assert 'make' not in ''.join(sent)
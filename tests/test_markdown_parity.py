@@ -0,0 +1,67 @@
+import difflib
+import re
+
+import pytest
+
+pypandoc = pytest.importorskip('pypandoc')
+try:
+    PANDOC_VERSION = pypandoc.get_pandoc_version()
+except OSError:
+    pytest.skip('pandoc is not installed', allow_module_level=True)
+
+SAMPLES = {
+    'headings': "# Title\n\n## Section\n\nSome *emphasis*, **strong** and `code`.\n",
+    'lists': "- one\n- two\n    - nested\n\n1. first\n2. second\n",
+    'table': "| Name | Value |\n|------|------:|\n| a | 1 |\n| b | 2 |\n",
+    'code': "```python\ndef f(x):\n\n    return x * 2\n```\n",
+    'quote_links': "> Quoted [link](https://example.com) and ![img](data:image/png;base64,iVBORw0KGgo=)\n",
+    'cjk': "# 标题\n\n中文段落，包含**粗体**和`代码`。\n\n- 列表项\n",
+    'math': "Inline $x^2$ and\n\n$$\n\\frac{a}{b}\n$$\n",
+}
+SERVER_START_ERRORS = []  # remembered so only the first case waits for a server that can't start
+
+
+def normalize(html):
+    # Highlighting spans, line anchors, ids and classes differ between engines without changing the rendered text
+    html = re.sub(r'</?span[^>]*>|<a [^>]*></a>', '', html)
+    html = re.sub(r'\s+(id|class|aria-hidden|tabindex)="[^"]*"', '', html)
+    return re.sub(r'\s+', ' ', re.sub(r'>\s+<', '><', html)).strip()
+
+
+def similarity(app_module, sample, backend):
+    reference = normalize(app_module.convert_markdown(sample, 'kate', backend='pandoc'))
+    candidate = normalize(app_module.convert_markdown(sample, 'kate', backend=backend))
+    return difflib.SequenceMatcher(None, reference, candidate).ratio()
+
+
+@pytest.fixture
+def server_module(app_module):
+    if not app_module.PANDOC_SERVER_POOL.supported(): pytest.skip(f"pandoc {PANDOC_VERSION} has no `pandoc server`")
+    if not SERVER_START_ERRORS:
+        try:
+            app_module.PANDOC_SERVER_POOL._ensure_started()
+        except RuntimeError as e:
+            SERVER_START_ERRORS.append(e)  # e.g. a pandoc build without the threaded runtime
+    if SERVER_START_ERRORS: pytest.skip(f"pandoc server could not start: {SERVER_START_ERRORS[0]}")
+    yield app_module
+    app_module.PANDOC_SERVER_POOL.shutdown()
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_pandoc_server_matches_pandoc(server_module, name):
+    assert similarity(server_module, SAMPLES[name], 'pandoc-server') == 1.0
+    assert server_module.PANDOC_SERVER_POOL.servers  # really went through the pool
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_python_markdown_is_close_to_pandoc(app_module, name):
+    pytest.importorskip('markdown')
+    assert similarity(app_module, SAMPLES[name], 'python-markdown') >= 0.9
+
+
+def test_old_pandoc_falls_back_to_one_process_per_conversion(app_module, monkeypatch, capsys):
+    monkeypatch.setattr(pypandoc, 'get_pandoc_version', lambda: '2.17.1.1')
+    assert not app_module.PANDOC_SERVER_POOL.supported()
+    assert 'pandoc 2.17.1.1 has no `pandoc server`' in capsys.readouterr().out
+    html = app_module.convert_markdown(SAMPLES['headings'], 'kate', backend='pandoc-server')
+    assert '<strong>strong</strong>' in html and not app_module.PANDOC_SERVER_POOL.servers
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import pytest
+
+PREVIEW = {'task_id': 't1', 'preview_file': 'a.md', 'style_options': {}, 'target_language': 'en', 'progressive': True}
+
+
+@pytest.fixture
+def api(app_module, monkeypatch):
+    calls = []
+    def call(task_id, content, target_language, prompt_template, log_id="", on_text=None):
+        calls.append(content)
+        if on_text: api.on_call(on_text)
+        return content.upper()
+    api.calls, api.on_call = calls, lambda on_text: None
+    monkeypatch.setattr(app_module, 'call_translation_api', call)
+    return api
+
+
+def test_cancelled_translation_sends_nothing(app_module, api):
+    cancel = threading.Event(); cancel.set()
+    with pytest.raises(app_module.TaskStopped):
+        app_module.translate_markdown_document('t1', "Hello", 'en', on_progress=lambda md: None, cancel=cancel)
+    assert api.calls == []
+
+
+def test_cancel_abandons_a_streamed_reply(app_module, api):
+    cancel = threading.Event()
+    def stream(on_text): cancel.set(); on_text('["HELLO"')
+    api.on_call = stream
+    with pytest.raises(app_module.TaskStopped):
+        app_module.translate_markdown_document('t1', "Hello\n\nWorld", 'en', on_progress=lambda md: None, cancel=cancel)
+    assert app_module.translate_markdown_document('t1', "Hello\n\nWorld", 'en') == 'HELLO\n\nWORLD'  # nothing half-done was cached
+    assert len(api.calls) == 2
+
+
+def test_newer_preview_supersedes_the_older_one(app_module, client, monkeypatch):
+    cancels = []
+    def preview(task_id, rel_path, style_options, target_language, emit, cancel=None):
+        cancels.append(cancel)
+        if len(cancels) == 1:
+            assert cancel.wait(5)
+            raise app_module.TaskStopped("Translation was cancelled")
+        emit(b'%PDF-new')
+    monkeypatch.setattr(app_module, 'generate_progressive_preview', preview)
+    # The test client runs a streamed response up to its first frame, so the older request has to wait in a thread
+    first = []
+    waiting = threading.Thread(target=lambda: first.append(client.post('/preview/translated', json=PREVIEW).get_data()))
+    waiting.start()
+    while not app_module.PREVIEW_CANCELS: time.sleep(0.01)
+    second = client.post('/preview/translated', json=PREVIEW)
+    waiting.join(5)
+    assert first == [b'']  # cancelled quietly, no error frame
+    assert second.get_data() == app_module.preview_frame(b'P', b'%PDF-new')
+    assert cancels[0].is_set() and cancels[1].is_set()  # the finished stream released its job too
+    assert app_module.PREVIEW_CANCELS == {}
@@ -0,0 +1,24 @@
+import os
+import time
+
+
+def test_partial_frames_stay_out_of_the_render_caches(app_module, fake_weasyprint, tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'task' / 'source')
+    (tmp_path / 'task' / 'source' / 'a.md').write_text("Hello\n\nWorld\n", encoding='utf-8')
+    app_module.TASK_STORE.create('t1', task_dir=str(tmp_path / 'task'), state='READY')
+    monkeypatch.setattr(app_module, 'PREVIEW_REFRESH_SECONDS', 0)
+    frames = []
+    def translate(task_id, md_content, target_language, log_id="", on_progress=None, cancel=None):
+        on_progress("HELLO")
+        deadline = time.monotonic() + 5
+        while not frames and time.monotonic() < deadline: time.sleep(0.01)
+        return "HELLO\n\nWORLD"
+    monkeypatch.setattr(app_module, 'translate_markdown_document', translate)
+
+    app_module.generate_progressive_preview('t1', 'a.md', {}, 'en', frames.append)
+    assert [b'WORLD' in frame for frame in frames] == [False, True]  # the partial frame, then the finished PDF
+    assert app_module.PDF_RENDER_CACHE.stats()['entries'] == 1
+    assert app_module.PDF_RENDER_STORE.stats()['entries'] == 1
+    assert app_module.HTML_RENDER_CACHE.stats()['entries'] == 1
+    assert app_module.html_to_pdf(fake_weasyprint[-1]['html'], app_module.get_css_style({})) == frames[-1]
+    assert len(fake_weasyprint) == 2  # the finished PDF came from the cache
@@ -0,0 +1,43 @@
+def test_lru_evicts_by_entry_count_and_size(app_module):
+    cache = app_module.MemoryLRUCache(max_entries=2, max_bytes=10)
+    cache.set('a', b'xxx')
+    cache.set('b', b'yyy')
+    assert cache.get('a') == b'xxx'  # 'b' is now the least recently used
+    cache.set('c', b'zzz')
+    assert cache.get('b') is None and cache.get('a') == b'xxx'
+    cache.set('d', b'dddddddd')  # 8 + 3 bytes is over the limit, so 'a' goes too
+    assert (cache.get('a'), cache.get('c'), cache.get('d')) == (None, None, b'dddddddd')
+    cache.set('e', b'e' * 11)  # larger than the whole cache: not kept, nothing evicted for it
+    assert cache.get('e') is None and cache.get('d') == b'dddddddd'
+    assert cache.stats() == {**cache.stats(), 'entries': 1, 'bytes': 8, 'evictions': 3}
+
+
+def test_identical_html_and_css_render_once(app_module, fake_weasyprint):
+    first = app_module.render_pdf('<p>a</p>', 'body {}')
+    assert app_module.render_pdf('<p>a</p>', 'body {}') == first
+    assert len(fake_weasyprint) == 1
+    app_module.render_pdf('<p>a</p>', 'body { color: red }')  # same content, another style
+    assert len(fake_weasyprint) == 2
+
+
+def test_rendered_pdfs_outlive_the_process_cache(app_module, fake_weasyprint):
+    pdf, layout = app_module.render_pdf('<p>a</p>', 'body {}')
+    app_module.PDF_RENDER_CACHE.clear()  # e.g. a render worker that was restarted
+    assert app_module.render_pdf('<p>a</p>', 'body {}') == (pdf, layout) and len(fake_weasyprint) == 1
+
+
+def test_html_cache_is_keyed_by_code_theme(app_module, monkeypatch):
+    converted = []
+    monkeypatch.setattr(app_module, 'convert_markdown', lambda md, highlight_style, backend=None: converted.append(highlight_style) or f"<p>{md}</p>")
+    for theme in ('kate', 'kate', 'tango'):
+        assert app_module.markdown_to_html('Hello', None, '', {'code_theme': theme}) == '<p>Hello</p>'
+    assert converted == ['kate', 'tango']
+
+
+def test_batch_pdfs_are_not_copied_into_the_caches(app_module, fake_weasyprint, tmp_path):
+    layout = app_module.write_pdf_file(str(tmp_path / 'out' / 'a.pdf'), '<p>a</p>', 'body {}')
+    assert (tmp_path / 'out' / 'a.pdf').read_bytes() == b'%PDF <p>a</p>' and layout['pages'] == 1
+    assert app_module.PDF_RENDER_CACHE.stats()['entries'] == 0 and app_module.PDF_RENDER_STORE.stats()['entries'] == 0
+    app_module.render_pdf('<p>b</p>', 'body {}')  # e.g. the preview of another file
+    app_module.write_pdf_file(str(tmp_path / 'out' / 'b.pdf'), '<p>b</p>', 'body {}')
+    assert len(fake_weasyprint) == 2 and (tmp_path / 'out' / 'b.pdf').read_bytes() == b'%PDF <p>b</p>'
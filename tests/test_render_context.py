@@ -0,0 +1,28 @@
+import threading
+
+
+def test_stylesheet_and_fonts_are_reused(app_module, fake_weasyprint):
+    app_module.render_pdf('<p>a</p>', 'body {}')
+    app_module.render_pdf('<p>b</p>', 'body {}')
+    app_module.render_pdf('<p>a</p>', 'body { color: red }')  # a style-only change
+    first, second, third = fake_weasyprint
+    assert first['stylesheets'][0] is second['stylesheets'][0] and third['stylesheets'][0].string == 'body { color: red }'
+    assert first['font_config'] is second['font_config'] is third['font_config']
+    savings = app_module.render_context_savings()
+    assert (savings['built'], savings['reused']) == (2, 1)
+
+
+def test_only_recent_styles_are_kept(app_module, fake_weasyprint, monkeypatch):
+    monkeypatch.setattr(app_module, 'RENDER_CONTEXT_MAX_STYLES', 2)
+    contexts = [app_module.render_context(css)[0] for css in ('a {}', 'b {}', 'a {}', 'c {}')]
+    assert contexts[0] is contexts[2]
+    assert app_module.render_context('a {}') == (contexts[0], True)
+    assert app_module.render_context('b {}')[1] is False  # pushed out by 'c {}'
+
+
+def test_each_thread_has_its_own_context(app_module, fake_weasyprint):
+    here = app_module.render_context('body {}')[0]
+    there = []
+    thread = threading.Thread(target=lambda: there.append(app_module.render_context('body {}')))
+    thread.start(); thread.join()
+    assert there[0][1] is False and there[0][0]['font_config'] is not here['font_config']
@@ -0,0 +1,61 @@
+import io
+import threading
+import time
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def task(app_module, tmp_path):
+    """A task with one finished PDF in its result folder and one still being written."""
+    result = tmp_path / 'task' / 'result'
+    (result / 'translated_pdfs').mkdir(parents=True)
+    (result / 'translated_pdfs' / 'a.pdf').write_bytes(b'%PDF a')
+    (result / 'translated_pdfs' / 'b.pdf.part').write_bytes(b'%PDF half')
+    def create(state):
+        app_module.TASK_STORE.create('t1', task_dir=str(tmp_path / 'task'), state=state)
+        return result
+    return create
+
+
+def patch_sleep(monkeypatch, fake):
+    """Replaces time.sleep for this thread only; the app's background threads (e.g. its heartbeat) sleep as usual."""
+    real, caller = time.sleep, threading.current_thread()
+    monkeypatch.setattr(time, 'sleep', lambda seconds: fake(seconds) if threading.current_thread() is caller else real(seconds))
+
+
+def archive(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return {info.filename: (zf.read(info), info.compress_type) for info in zf.infolist()}
+
+
+def test_finished_task_downloads_its_complete_files(task, client):
+    result = task('SUCCESS')
+    (result / 'translation_summary.csv').write_text('a,b\n' * 100)
+    files = archive(client.get('/download/t1').get_data())
+    assert sorted(files) == ['translated_pdfs/a.pdf', 'translation_summary.csv']
+    assert files['translated_pdfs/a.pdf'] == (b'%PDF a', zipfile.ZIP_STORED)  # already compressed
+    assert files['translation_summary.csv'][1] == zipfile.ZIP_DEFLATED
+
+
+def test_running_task_streams_files_until_it_ends(app_module, task, monkeypatch):
+    result = task('RUNNING')
+    def next_scan(seconds):
+        (result / 'translated_pdfs' / 'b.pdf.part').rename(result / 'translated_pdfs' / 'b.pdf')
+        app_module.TASK_STORE.update('t1', {'state': 'SUCCESS'})
+    patch_sleep(monkeypatch, next_scan)
+    files = archive(b''.join(app_module.stream_result_zip('t1', str(result))))
+    assert files['translated_pdfs/b.pdf'][0] == b'%PDF half'
+
+
+@pytest.mark.parametrize('state', ['QUEUED', 'PAUSED', 'STOPPING'])
+def test_parked_task_ends_the_archive_at_once(app_module, task, client, monkeypatch, state):
+    task(state)
+    patch_sleep(monkeypatch, lambda seconds: pytest.fail('download waited on a task that is not running'))
+    assert list(archive(client.get('/download/t1').get_data())) == ['translated_pdfs/a.pdf']
+
+
+def test_task_not_started_has_nothing_to_download(task, client):
+    task('READY')
+    assert client.get('/download/t1').status_code == 404
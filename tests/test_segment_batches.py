@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def api(app_module, monkeypatch):
+    """Stands in for the AI API: batches (JSON arrays) are answered by `reply`, single texts are upper-cased."""
+    calls = []
+    def call(task_id, content, target_language, prompt_template, log_id="", on_text=None):
+        if prompt_template == 'batch':
+            items = json.loads(content)
+            calls.append(len(items))
+            return api.reply(items, len(calls))
+        calls.append(content)
+        return content.upper()
+    api.calls, api.reply = calls, lambda items, n: json.dumps([item.upper() for item in items])
+    monkeypatch.setattr(app_module, 'call_translation_api', call)
+    return api
+
+
+def translate(app_module, segments, **kwargs):
+    return app_module.translate_segments_via_api('t1', segments, 'en', 'batch', 'single', **kwargs)
+
+
+def test_malformed_reply_is_retried_as_a_batch(app_module, api):
+    api.reply = lambda items, n: 'not json' if n == 1 else json.dumps([item.upper() for item in items])
+    assert translate(app_module, ['a', 'b', 'c']) == ['A', 'B', 'C']
+    assert api.calls == [3, 3]
+
+
+def test_batch_that_keeps_failing_is_split_in_halves(app_module, api):
+    # Replies to more than two items come back one item short
+    api.reply = lambda items, n: json.dumps([item.upper() for item in items][:2 if len(items) > 2 else None])
+    segments = [f"s{n}" for n in range(8)]
+    assert translate(app_module, segments) == [s.upper() for s in segments]
+    assert api.calls == [8, 8, 4, 2, 2, 4, 2, 2]  # never one request per segment
+
+
+def test_only_rejected_items_are_sent_one_by_one(app_module, api):
+    api.reply = lambda items, n: json.dumps([item.upper() if item != 'b' else '' for item in items])
+    assert translate(app_module, ['a', 'b', 'c'], validator=lambda source, translation: bool(translation)) == ['A', 'B', 'C']
+    assert api.calls == [3, 'b']
+
+
+def test_cached_segments_are_not_sent(app_module, api):
+    translate(app_module, ['a', 'b'])
+    assert translate(app_module, ['a', 'b', 'c']) == ['A', 'B', 'C']
+    assert api.calls == [2, 'c']
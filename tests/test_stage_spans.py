@@ -0,0 +1,19 @@
+import pytest
+
+
+def test_span_report_sums_stages_and_pdf_bytes(app_module):
+    with app_module.recording_spans() as spans:
+        for size in (100, 50):
+            with app_module.stage_span('write_pdf') as span: span['bytes'] = size
+    report = app_module.span_report(spans)
+    assert report['PDF Bytes'] == 150
+    assert report[app_module.STAGE_REPORT_COLUMNS['write_pdf']] >= 0
+
+
+def test_span_that_failed_counts_no_bytes(app_module):
+    with app_module.recording_spans() as spans:
+        with app_module.stage_span('write_pdf') as span: span['bytes'] = 100
+        with pytest.raises(OSError):
+            with app_module.stage_span('write_pdf'): raise OSError('disk full')
+    assert [span['bytes'] for span in spans] == [100, None]
+    assert app_module.span_report(spans)['PDF Bytes'] == 100
@@ -0,0 +1,16 @@
+def test_running_task_continues(app_module):
+    app_module.TASK_STORE.create('t1', task_dir='', state='RUNNING')
+    assert app_module.check_task_control('t1')
+
+
+def test_stop_request_marks_task_stopped(app_module):
+    app_module.TASK_STORE.create('t1', task_dir='', state='STOPPING')
+    assert not app_module.check_task_control('t1')
+    assert app_module.TASK_STORE.get('t1')['state'] == 'STOPPED'
+
+
+def test_deleted_task_counts_as_stopped(app_module):
+    app_module.TASK_STORE.create('t1', task_dir='', state='RUNNING')
+    app_module.TASK_STORE.delete('t1')
+    assert not app_module.check_task_control('t1')
+    assert app_module.TASK_STORE.get('t1') is None
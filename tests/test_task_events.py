@@ -0,0 +1,45 @@
+import json
+
+
+def read_events(response):
+    """Parses a finished SSE response into (id, event, data) tuples, skipping comments and the retry hint."""
+    events = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line and not line.startswith(':'))
+        if 'event' in fields: events.append((int(fields['id']) if 'id' in fields else None, fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def finished_task(app_module, logs=3):
+    app_module.TASK_STORE.create('t1', task_dir='', state='RUNNING')
+    for n in range(logs): app_module.update_task_status('t1', log=f'line {n}')
+    app_module.update_task_status('t1', 'SUCCESS', progress=100)
+    return app_module.TASK_STORE.get('t1')['event_seq']
+
+
+def test_stream_replays_all_events_and_ends(app_module, client):
+    finished_task(app_module)
+    events = read_events(client.get('/events/t1'))
+    assert [data['log'] for _, kind, data in events if kind == 'log'] == ['line 0', 'line 1', 'line 2']
+    assert events[-1][1] == 'end'
+
+
+def test_reconnect_with_cursor_query_skips_seen_events(app_module, client):
+    finish_seq = finished_task(app_module)
+    events = read_events(client.get('/events/t1?cursor=2'))
+    assert all(event_id > 2 for event_id, kind, _ in events if kind != 'end')
+    assert [data['log'] for _, kind, data in events if kind == 'log'] == ['line 2']
+    assert events[-1][1] == 'end'
+    # Reconnecting with everything already seen only ends the stream
+    assert [kind for _, kind, _ in read_events(client.get(f'/events/t1?cursor={finish_seq}'))] == ['end']
+
+
+def test_last_event_id_header_wins_over_cursor_query(app_module, client):
+    finished_task(app_module)
+    events = read_events(client.get('/events/t1?cursor=0', headers={'Last-Event-ID': '3'}))
+    assert [data['log'] for _, kind, data in events if kind == 'log'] == []
+    assert events[-1][1] == 'end'
+
+
+def test_unknown_task_is_404(client):
+    assert client.get('/events/nope?cursor=1').status_code == 404
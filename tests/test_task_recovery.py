@@ -0,0 +1,101 @@
+import os
+import socket
+import time
+
+import pytest
+
+
+def owned_task(app_module, task_id, runner, state='STOPPING'):
+    """A task in the store as if another process owned it; STOPPING tasks are finished off (not rerun) when taken over."""
+    app_module.TASK_STORE.create(task_id, task_dir='', state=state)
+    with app_module.TASK_STORE._connect() as conn: conn.execute('UPDATE tasks SET runner = ? WHERE task_id = ?', (runner, task_id))
+
+
+def set_heartbeat(app_module, runner, at):
+    with app_module.TASK_STORE._connect() as conn: conn.execute('INSERT OR REPLACE INTO runners (runner, heartbeat) VALUES (?, ?)', (runner, at))
+
+
+def test_runner_id_changes_with_each_process(app_module):
+    first = app_module.runner_id()
+    assert first == app_module.runner_id()
+    assert first.startswith(f"{socket.gethostname()}:{os.getpid()}:")
+    app_module.RUNNER_NONCES.clear()  # what a restarted service (same host, same pid) starts with
+    assert app_module.runner_id() != first
+
+
+def test_predecessor_with_same_pid_is_taken_over(app_module):
+    # A container restart: same hostname, same pid (1), but a different process whose heartbeat is still fresh
+    predecessor = f"{socket.gethostname()}:{os.getpid()}:0123456789ab"
+    set_heartbeat(app_module, predecessor, time.time())
+    owned_task(app_module, 't1', predecessor)
+    app_module.recover_interrupted_tasks()
+    task = app_module.TASK_STORE.get('t1')
+    assert task['state'] == 'STOPPED' and task['runner'] == app_module.runner_id()
+
+
+def test_remote_owner_with_fresh_heartbeat_keeps_its_paused_task(app_module):
+    runner = 'other-host:42:abcdef'
+    set_heartbeat(app_module, runner, time.time())
+    owned_task(app_module, 't1', runner, state='PAUSED')
+    with app_module.TASK_STORE._connect() as conn: conn.execute('UPDATE tasks SET updated = 0')  # paused for ages
+    app_module.recover_interrupted_tasks()
+    assert app_module.TASK_STORE.get('t1')['runner'] == runner
+
+
+def test_remote_owner_with_stale_heartbeat_is_taken_over(app_module):
+    runner = 'other-host:42:abcdef'
+    set_heartbeat(app_module, runner, time.time() - app_module.TASK_STALE_SECONDS - 1)
+    owned_task(app_module, 't1', runner)
+    app_module.recover_interrupted_tasks()
+    assert app_module.TASK_STORE.get('t1')['state'] == 'STOPPED'
+
+
+def test_owner_that_never_beat_is_taken_over(app_module):
+    owned_task(app_module, 't1', 'other-host:42')  # runner id from before heartbeats existed
+    app_module.recover_interrupted_tasks()
+    assert app_module.TASK_STORE.get('t1')['state'] == 'STOPPED'
+
+
+def test_own_tasks_are_left_alone(app_module):
+    owned_task(app_module, 't1', app_module.runner_id())
+    app_module.recover_interrupted_tasks()
+    assert app_module.TASK_STORE.get('t1')['state'] == 'STOPPING'
+
+
+def test_first_request_writes_heartbeat(app_module, client):
+    client.get('/status/none')
+    assert time.time() - app_module.TASK_STORE.heartbeats()[app_module.runner_id()] < 5
+
+
+def test_start_claims_a_task_without_runner(app_module, monkeypatch):
+    owned_task(app_module, 't1', None, state='STOPPED')
+    submitted = []
+    monkeypatch.setattr(app_module.JOB_SCHEDULER, 'submit', lambda kind, user, run, **kwargs: submitted.append(kwargs['job_id']))
+    app_module.start_task_thread('t1', {'style_options': {}, 'target_language': None, 'export_mode': 'translated'})
+    assert submitted == ['t1']
+    assert app_module.TASK_STORE.get('t1')['runner'] == app_module.runner_id()
+
+
+def test_start_from_a_stale_read_is_refused(app_module, monkeypatch):
+    owned_task(app_module, 't1', app_module.runner_id(), state='FAILURE')
+    submitted = []
+    monkeypatch.setattr(app_module.JOB_SCHEDULER, 'submit', lambda kind, user, run, **kwargs: submitted.append(kwargs['job_id']))
+    params = {'style_options': {}, 'target_language': None, 'export_mode': 'translated'}
+    snapshot = app_module.TASK_STORE.get('t1')
+    app_module.start_task_thread('t1', params, expected=snapshot)
+    with pytest.raises(app_module.TaskConflict): app_module.start_task_thread('t1', params, expected=snapshot)
+    assert submitted == ['t1']
+
+
+def test_concurrent_resume_gets_409(app_module, client, monkeypatch):
+    params = {'style_options': {}, 'target_language': None, 'export_mode': 'translated'}
+    app_module.TASK_STORE.create('t1', task_dir='', state='FAILURE', params=params)
+    submitted = []
+    monkeypatch.setattr(app_module.JOB_SCHEDULER, 'submit', lambda kind, user, run, **kwargs: submitted.append(kwargs['job_id']))
+    def other_request_wins(kind):
+        # Runs after this request has checked the task's state and before it claims the task
+        monkeypatch.setattr(app_module.JOB_SCHEDULER, 'admission_error', lambda kind: None)
+        app_module.start_task_thread('t1', params)
+    monkeypatch.setattr(app_module.JOB_SCHEDULER, 'admission_error', other_request_wins)
+    assert client.post('/resume/t1').status_code == 409
+    assert submitted == ['t1']
@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, app_module, monkeypatch):
+    """The app's task store: the default SQLite file, or RedisTaskStore against an in-process fakeredis server."""
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        import redis
+        server = fakeredis.FakeServer()
+        monkeypatch.setattr(redis.Redis, 'from_url', classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server)))
+        monkeypatch.setattr(app_module, 'TASK_STORE', app_module.RedisTaskStore('redis://localhost/0'))
+    return app_module.TASK_STORE
+
+
+def test_updates_and_events(app_module, store):
+    store.create('t1', task_dir='', state='READY')
+    assert store.update('t1', {'progress': 5}, [('log', {'log': 'a'})], publish_status=True) == 2
+    task = store.get('t1')
+    assert (task['state'], task['progress'], task['event_seq'], task['runner']) == ('READY', 5, 2, app_module.runner_id())
+    assert [(seq, kind) for seq, kind, _ in store.events_since('t1', 0)] == [(1, 'log'), (2, 'status')]
+    assert store.events_since('t1', 1)[0][2]['progress'] == 5
+    assert store.get('missing') is None and store.event_seq('missing') is None
+
+
+def test_find_follows_state_changes(store):
+    store.create('t1', task_dir='', state='READY')
+    store.create('t2', task_dir='', state='RUNNING')
+    assert set(store.find(('RUNNING', 'READY'))) == {'t1', 't2'}
+    store.update('t1', {'state': 'RUNNING'})
+    store.update('t2', {'state': 'SUCCESS'})
+    assert set(store.find(('RUNNING',))) == {'t1'}
+    assert set(store.find(('SUCCESS',))) == {'t2'} and store.find(('READY',)) == {}
+    assert store.find(('SUCCESS',), updated_before=time.time() - 60) == {}
+    store.delete('t2')
+    assert store.find(('SUCCESS',)) == {} and store.get('t2') is None
+
+
+def test_claim_is_a_compare_and_set(app_module, store):
+    store.create('t1', task_dir='', state='FAILURE')
+    task = store.get('t1')
+    assert not store.claim('t1', 'other-host:1:abc')
+    assert store.claim('t1', task['runner'], task['updated'])
+    assert not store.claim('t1', task['runner'], task['updated'])  # the first claim changed the task
+    assert store.claim('t1', app_module.runner_id())
+
+
+def test_heartbeats(app_module, store):
+    store.heartbeat()
+    assert time.time() - store.heartbeats()[app_module.runner_id()] < 5
+
+
+def test_finished_tasks_are_pruned_after_retention(app_module, store, monkeypatch):
+    for task_id, state in [('old-done', 'SUCCESS'), ('old-running', 'RUNNING')]:
+        os.makedirs(os.path.join(app_module.OUTPUT_DIR, task_id))
+        with monkeypatch.context() as patch:
+            then = time.time() - (app_module.TASK_RETENTION_DAYS + 1) * 86400
+            patch.setattr(time, 'time', lambda: then)
+            store.create(task_id, task_dir=os.path.join(app_module.OUTPUT_DIR, task_id), state=state)
+    store.create('new-done', task_dir='', state='SUCCESS')
+    app_module.prune_finished_tasks()
+    assert store.get('old-done') is None and not os.path.exists(os.path.join(app_module.OUTPUT_DIR, 'old-done'))
+    assert store.get('old-running') and os.path.exists(os.path.join(app_module.OUTPUT_DIR, 'old-running'))
+    assert store.get('new-done')
+
+
+def test_event_stream_works_on_each_store(app_module, client, store):
+    store.create('t1', task_dir='', state='RUNNING')
+    app_module.update_task_status('t1', log='line 1')
+    app_module.update_task_status('t1', 'SUCCESS', progress=100)
+    body = client.get('/events/t1').get_data(as_text=True)
+    assert 'line 1' in body and 'event: end' in body
+
+
+def test_redis_store_indexes_tasks_of_the_old_layout(app_module, store):
+    if not isinstance(store, app_module.RedisTaskStore): pytest.skip('Redis only')
+    store.create('t1', task_dir='', state='RUNNING')
+    store.client.delete(store._state_key('RUNNING'))
+    store.client.sadd(f"{store.prefix}tasks", 't1')  # how tasks were listed before the state index
+    store._index_legacy_tasks()
+    assert set(store.find(('RUNNING',))) == {'t1'}
+    assert not store.client.exists(f"{store.prefix}tasks")
@@ -0,0 +1,44 @@
+import itertools
+import time
+
+import pytest
+
+
+@pytest.fixture
+def cache(app_module, tmp_path, monkeypatch):
+    """A 100-byte cache; time.time() ticks once per call so access order is never a tie."""
+    clock = itertools.count(1000)
+    monkeypatch.setattr(time, 'time', lambda: next(clock))
+    return app_module.PersistentCache(str(tmp_path / 'cache' / 'c.sqlite3'), 100)
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    cache.set('a', 'en', 'x' * 40)
+    cache.set('b', 'en', 'y' * 40)
+    assert cache.get('a') == 'x' * 40  # 'b' is now the least recently used
+    cache.set('c', 'en', 'z' * 40)  # 120 bytes: evicts down to 90% of the limit
+    assert cache.contains(['a', 'b', 'c']) == {'a', 'c'}
+    stats = cache.stats()
+    assert stats['total_bytes'] == 80 and stats['counters']['evictions'] == 1
+
+
+def test_replacing_an_entry_counts_its_size_once(cache):
+    cache.set('a', 'en', 'x' * 40)
+    cache.set('a', 'en', 'x' * 60)
+    assert cache.stats()['total_bytes'] == 60 and cache.stats()['entries'] == 1
+
+
+def test_entries_and_counters_are_shared_through_the_file(app_module, cache):
+    cache.set('a', 'de', 'Hallo')
+    other = app_module.PersistentCache(cache.path, 100)  # e.g. another worker process
+    assert other.get('a') == 'Hallo' and other.get('b') is None
+    stats = cache.stats()
+    assert stats['counters']['hits'] == 1 and stats['hit_ratio'] == 0.5
+    assert stats['languages'] == {'de': {'entries': 1, 'bytes': 5}}
+
+
+def test_purge_by_language(cache):
+    cache.set('a', 'de', 'Hallo')
+    cache.set('b', 'fr', 'Salut')
+    assert cache.purge('de') == {'purged_entries': 1, 'purged_bytes': 5}
+    assert cache.contains(['a', 'b']) == {'b'} and cache.stats()['total_bytes'] == 5
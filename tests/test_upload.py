@@ -0,0 +1,62 @@
+import io
+import os
+import zipfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+
+@pytest.fixture
+def upload(app_module, client, monkeypatch):
+    """Posts to /prepare_upload; uploaded files must arrive by renaming their spooled temp file, never by a copy."""
+    monkeypatch.setattr(FileStorage, 'save', lambda self, dst, buffer_size=16384: pytest.fail('upload was copied'))
+    def post(**kwargs):
+        response = client.post('/prepare_upload', **kwargs)
+        assert not os.path.exists(app_module.UPLOAD_TMP_DIR) or os.listdir(app_module.UPLOAD_TMP_DIR) == []  # nothing left behind
+        return response
+    return post
+
+
+def task_dir(app_module, response):
+    return os.path.join(app_module.OUTPUT_DIR, response.get_json()['task_id'])
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for name, data in members.items(): zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_single_file_is_moved_into_the_task(app_module, upload):
+    response = upload(data={'upload_type': 'file', 'file': (io.BytesIO(b'# Hello'), 'hello.md')})
+    assert response.get_json()['preview_files'] == ['hello.md']
+    with open(os.path.join(task_dir(app_module, response), 'source', 'hello.md'), 'rb') as f: assert f.read() == b'# Hello'
+
+
+def test_folder_keeps_its_layout(app_module, upload):
+    files = [(io.BytesIO(b'# A'), os.path.join('docs', 'a.md')), (io.BytesIO(b'# B'), os.path.join('docs', 'sub', 'b.md'))]
+    response = upload(data={'upload_type': 'folder', 'files[]': files})
+    assert response.get_json()['preview_files'] == ['docs/a.md', 'docs/sub/b.md']
+
+
+def test_zip_as_raw_body_is_kept_unextracted(app_module, upload):
+    response = upload(data=zip_bytes({'a.md': '# A', 'img.png': b'\x89PNG'}), content_type='application/zip')
+    assert response.get_json()['preview_files'] == ['a.md']
+    assert sorted(os.listdir(task_dir(app_module, response))) == ['source', 'source.zip']
+    assert os.listdir(os.path.join(task_dir(app_module, response), 'source')) == []
+
+
+def test_zip_as_form_field(app_module, upload):
+    response = upload(data={'upload_type': 'zip', 'zipfile': (io.BytesIO(zip_bytes({'a.md': '# A'})), 'docs.zip')})
+    assert response.get_json()['preview_files'] == ['a.md']
+
+
+def test_invalid_zip_is_refused_and_removed(app_module, upload):
+    response = upload(data=b'not a zip', content_type='application/zip')
+    assert response.status_code == 400 and 'Invalid ZIP' in response.get_json()['error']
+    assert [name for name in os.listdir(app_module.OUTPUT_DIR) if not name.startswith(('.', 'tasks'))] == []
+
+
+def test_refused_upload_leaves_no_temp_file(upload):
+    assert upload(data={'upload_type': 'file', 'file': (io.BytesIO(b'x'), 'notes.txt')}).status_code == 400
@@ -0,0 +1,39 @@
+import zipfile
+
+import pytest
+
+
+def make_zip(path, members, compression=zipfile.ZIP_STORED):
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        for name, data in members.items(): zf.writestr(name, data)
+    return str(path)
+
+
+def test_reads_members_within_limits(app_module, tmp_path):
+    source = app_module.ZipSource(make_zip(tmp_path / 'in.zip', {'docs/a.md': '# A', 'docs/img.png': b'\x89PNG', '__MACOSX/docs/._a.md': 'x'}))
+    assert source.list_markdown() == ['docs/a.md']
+    assert source.read_text('docs/a.md') == '# A'
+    assert source.stats() == {'members': 2, 'markdown_files': 1, 'bytes': 7}
+
+
+def test_total_uncompressed_size_is_limited(app_module, tmp_path, monkeypatch):
+    # Each member is under the per-member limit, but together they exceed the archive total
+    monkeypatch.setattr(app_module, 'ZIP_MAX_MEMBER_BYTES', 1000)
+    monkeypatch.setattr(app_module, 'ZIP_MAX_UNCOMPRESSED_BYTES', 1500)
+    source = app_module.ZipSource(make_zip(tmp_path / 'in.zip', {'a.md': 'a' * 800, 'b.md': 'b' * 800}))
+    with pytest.raises(ValueError, match='extraction limit'): source.list_markdown()
+
+
+def test_member_count_is_limited(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'ZIP_MAX_MEMBERS', 2)
+    source = app_module.ZipSource(make_zip(tmp_path / 'in.zip', {f"{n}.md": 'x' for n in range(3)}))
+    with pytest.raises(ValueError, match='entries'): source.list_markdown()
+
+
+def test_member_size_and_ratio_are_limited(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'ZIP_MAX_MEMBER_BYTES', 100)
+    source = app_module.ZipSource(make_zip(tmp_path / 'big.zip', {'big.md': 'x' * 200}))
+    with pytest.raises(ValueError, match='size limit'): source.read_bytes('big.md')
+    source = app_module.ZipSource(make_zip(tmp_path / 'bomb.zip', {'bomb.md': '0' * 50}, zipfile.ZIP_DEFLATED))
+    monkeypatch.setattr(app_module, 'ZIP_MAX_COMPRESSION_RATIO', 2)
+    with pytest.raises(ValueError, match='compression ratio'): source.read_bytes('bomb.md')